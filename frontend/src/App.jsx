@@ -36,8 +36,15 @@ export default function App() {
 
   const fetchCompanies = async () => {
     try {
-      const response = await apiClient.get('/companies');
-      setCompanies(response.data);
+      // The list is paginated: follow X-Next-Cursor until the last page
+      let all = [];
+      let afterId = null;
+      do {
+        const response = await apiClient.get('/companies', { params: afterId ? { after_id: afterId } : {} });
+        all = all.concat(response.data);
+        afterId = response.headers['x-next-cursor'];
+      } while (afterId);
+      setCompanies(all);
     } catch (error) {
       console.error(error);
     }
@@ -6,7 +6,7 @@ import EmailIcon from '@mui/icons-material/Email';
 import CloseIcon from '@mui/icons-material/Close';
 import ContentCopyIcon from '@mui/icons-material/ContentCopy';
 import ReactMarkdown from 'react-markdown';
-import apiClient from '../api/client';
+import { streamPost } from '../api/client';
 
 export default function ActionPanel({ companyId }) {
   const [loadingType, setLoadingType] = useState(null);
@@ -19,8 +19,15 @@ export default function ActionPanel({ companyId }) {
     setIsModalOpen(true); // Pop the modal open immediately to show the loading spinner
     
     try {
-      const response = await apiClient.post(`/generate/${endpoint}`, { company_id: companyId });
-      setResult({ type, content: response.data.content });
+      // Swap the spinner for the text as soon as the first token arrives
+      let content = '';
+      await streamPost(`/generate/${endpoint}/stream`, { company_id: companyId }, (event, data) => {
+        if (event === 'token' || event === 'error') {
+          content += data;
+          setLoadingType(null);
+          setResult({ type, content });
+        }
+      });
     } catch (error) { 
       setResult({ type, content: "Error generating content. Please try again." }); 
     } finally { 
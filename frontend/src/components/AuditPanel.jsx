@@ -1,25 +1,37 @@
 import React, { useState, useEffect } from 'react';
-import { Box, Typography, Paper, Table, TableBody, TableCell, TableContainer, TableHead, TableRow, Chip, CircularProgress } from '@mui/material';
+import { Box, Typography, Paper, Table, TableBody, TableCell, TableContainer, TableHead, TableRow, Chip, CircularProgress, Button } from '@mui/material';
 import apiClient from '../api/client';
 
 export default function AuditPanel({ companies }) {
   const [logs, setLogs] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  // Logs come newest first, one page at a time
+  const fetchLogs = async (cursor) => {
+    const response = await apiClient.get('/audit', { params: cursor ? { cursor } : {} });
+    setLogs((previous) => (cursor ? previous.concat(response.data) : response.data));
+    setNextCursor(response.headers['x-next-cursor'] || null);
+  };
 
   useEffect(() => {
-    const fetchLogs = async () => {
-      try {
-        const response = await apiClient.get('/audit');
-        setLogs(response.data);
-      } catch (error) {
-        console.error("Failed to fetch audit logs", error);
-      } finally {
-        setLoading(false);
-      }
-    };
-    fetchLogs();
+    fetchLogs()
+      .catch((error) => console.error("Failed to fetch audit logs", error))
+      .finally(() => setLoading(false));
   }, []);
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      await fetchLogs(nextCursor);
+    } catch (error) {
+      console.error("Failed to fetch audit logs", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // Helper to get company name from ID
   const getCompanyName = (id) => {
     const company = companies.find(c => c.id === id);
@@ -84,6 +96,13 @@ export default function AuditPanel({ companies }) {
             )}
           </TableBody>
         </Table>
+        {nextCursor && (
+          <Box sx={{ display: 'flex', justifyContent: 'center', py: 2 }}>
+            <Button onClick={loadMore} disabled={loadingMore} sx={{ color: '#0052CC', fontWeight: 600 }}>
+              {loadingMore ? "Loading..." : "Load more"}
+            </Button>
+          </Box>
+        )}
       </TableContainer>
     </Box>
   );
@@ -1,13 +1,16 @@
 import React, { useState, useRef, useEffect } from 'react';
-import { Box, TextField, IconButton, Typography, CircularProgress, Chip, Avatar } from '@mui/material';
+import { Box, TextField, IconButton, Typography, CircularProgress, Chip, Avatar, Dialog, DialogContent } from '@mui/material';
 import SearchIcon from '@mui/icons-material/Search';
+import CloseIcon from '@mui/icons-material/Close';
 import ReactMarkdown from 'react-markdown';
-import apiClient from '../api/client';
+import { API_BASE_URL, streamPost } from '../api/client';
 
 export default function ChatPanel({ companyId }) {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
+  // Source chip clicked: shows just that 10-K section instead of the whole filing
+  const [openSource, setOpenSource] = useState(null);
   const messagesEndRef = useRef(null);
 
   useEffect(() => { setMessages([]); }, [companyId]);
@@ -22,9 +25,22 @@ export default function ChatPanel({ companyId }) {
     setInput('');
     setLoading(true);
     
+    // Tokens are appended to the last (bot) message as they stream in
+    const updateBotMessage = (update) => setMessages((prev) => {
+      const last = prev[prev.length - 1];
+      return [...prev.slice(0, -1), { ...last, ...update(last) }];
+    });
+
     try {
-      const response = await apiClient.post('/chat', { company_id: companyId, query: userMessage.content });
-      setMessages((prev) => [...prev, { role: 'bot', content: response.data.answer, sources: response.data.sources }]);
+      let started = false;
+      await streamPost('/chat/stream', { company_id: companyId, query: userMessage.content }, (event, data) => {
+        if (!started) {
+          started = true;
+          setMessages((prev) => [...prev, { role: 'bot', content: '', sources: [] }]);
+        }
+        if (event === 'sources') updateBotMessage(() => ({ sources: data }));
+        else if (event === 'token' || event === 'error') updateBotMessage((msg) => ({ content: msg.content + data }));
+      });
     } catch (error) {
       setMessages((prev) => [...prev, { role: 'bot', content: "Error communicating." }]);
     } finally { 
@@ -85,7 +101,7 @@ export default function ChatPanel({ companyId }) {
               {msg.sources && msg.sources.length > 0 && (
                 <Box sx={{ mt: 2, pt: 2, borderTop: '1px solid #EDF2F7', display: 'flex', flexWrap: 'wrap', gap: 1 }}>
                   {Array.from(new Set(msg.sources)).map((src, i) => (
-                    <Chip key={i} label={src} size="small" sx={{ bgcolor: '#F4F5F7', color: '#4A5568', fontSize: '0.7rem', fontWeight: 600, borderRadius: '8px' }} />
+                    <Chip key={i} label={src} size="small" onClick={() => setOpenSource(src)} sx={{ bgcolor: '#F4F5F7', color: '#4A5568', fontSize: '0.7rem', fontWeight: 600, borderRadius: '8px' }} />
                   ))}
                 </Box>
               )}
@@ -126,6 +142,33 @@ export default function ChatPanel({ companyId }) {
           </IconButton>
         </Box>
       </Box>
+
+      {/* --- Cited Section Popup --- */}
+      <Dialog
+        open={Boolean(openSource)}
+        onClose={() => setOpenSource(null)}
+        fullWidth
+        maxWidth="lg"
+        PaperProps={{ sx: { borderRadius: '24px', height: '90vh' } }}
+      >
+        <Box sx={{ display: 'flex', alignItems: 'center', justifyContent: 'space-between', p: 2, borderBottom: '1px solid #EDF2F7' }}>
+          <Typography variant="subtitle1" fontWeight="700">{openSource}</Typography>
+          <IconButton onClick={() => setOpenSource(null)}>
+            <CloseIcon />
+          </IconButton>
+        </Box>
+        <DialogContent sx={{ p: 0, overflow: 'hidden' }}>
+          {openSource && (
+            <iframe
+              src={`${API_BASE_URL}/companies/${companyId}/filing/sections/${encodeURIComponent(openSource)}`}
+              title={openSource}
+              width="100%"
+              height="100%"
+              style={{ border: 'none' }}
+            />
+          )}
+        </DialogContent>
+      </Dialog>
     </Box>
   );
 }
\ No newline at end of file
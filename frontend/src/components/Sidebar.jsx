@@ -3,8 +3,28 @@ import { List, ListItem, ListItemButton, ListItemText, Typography, Box, Button,
 import AddIcon from '@mui/icons-material/Add';
 import apiClient from '../api/client';
 
+const POLL_INTERVAL_MS = 2000;
+
+// Ingestion runs in a background job: poll until it finishes
+const waitForJob = async (jobId, onProgress) => {
+  while (true) {
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+    const { data: job } = await apiClient.get(`/ingest/jobs/${jobId}`);
+    if (job.status === 'succeeded' || job.status === 'failed') return job;
+    onProgress(job);
+  }
+};
+
+const progressLabel = (job) => {
+  const { sections_done, sections_total } = job.progress || {};
+  if (job.status === 'queued') return "Queued...";
+  if (sections_total) return `Processing ${sections_done}/${sections_total} sections...`;
+  return "Processing...";
+};
+
 export default function Sidebar({ selectedCompany, onSelectCompany, companies, refreshCompanies }) {
   const [loading, setLoading] = useState(false);
+  const [status, setStatus] = useState("Uploading...");
 
   const handleFileUpload = async (event) => {
     const file = event.target.files[0];
@@ -12,11 +32,17 @@ export default function Sidebar({ selectedCompany, onSelectCompany, companies, r
     const formData = new FormData();
     formData.append('file', file);
     setLoading(true);
+    setStatus("Uploading...");
     try {
-      await apiClient.post('/ingest', formData, { headers: { 'Content-Type': 'multipart/form-data' } });
+      const { data } = await apiClient.post('/ingest', formData, { headers: { 'Content-Type': 'multipart/form-data' } });
+      const job = await waitForJob(data.job_id, (job) => setStatus(progressLabel(job)));
+      if (job.status === 'failed') alert(`Ingestion failed: ${job.error}`);
       await refreshCompanies();
     } catch (error) { 
-      alert("Failed to upload file."); 
+      const code = error.response?.status;
+      if (code === 429 || code === 503) alert("Ingestion is busy, please try again in a minute.");
+      else if (code === 413) alert(error.response.data.detail);
+      else alert("Failed to upload file."); 
     } finally { 
       setLoading(false); 
       event.target.value = null; 
@@ -34,7 +60,7 @@ export default function Sidebar({ selectedCompany, onSelectCompany, companies, r
             '&:hover': { bgcolor: '#EDF2F7', border: '1px solid #CBD5E0' }
           }}
         >
-          {loading ? "Processing..." : "New 10-K Upload"}
+          {loading ? status : "New 10-K Upload"}
           <input type="file" hidden accept=".json" onChange={handleFileUpload} />
         </Button>
       </Box>
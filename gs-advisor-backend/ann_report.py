@@ -0,0 +1,139 @@
+"""
+Recall-vs-latency report for the pgvector ANN settings.
+
+Samples stored chunks as queries, computes the exact top-k for each (index
+scans disabled), then replays the same company-filtered search used by
+query_rag at each ef_search (HNSW) or probes (IVFFlat) value.
+
+    python ann_report.py --samples 100 --k 5 --values 10 20 40 80 160
+"""
+import argparse
+import json
+import statistics
+import time
+from sqlalchemy import select, text
+from app.core import database
+from app.core.config import settings
+from app.core.database import SessionLocal, configure_vector_search, init_db
+from app.models.domain import Chunk
+from app.services.vector_store import _search_query, embedding_column, embedding_values
+
+
+def search(db, embedding, company_id, k):
+    return db.scalars(_search_query(company_id, embedding, k)).all()
+
+
+def exact_search(db, embedding, company_id, k, column=None):
+    # Plain L2 ordering; with "binary" storage search() ranks through bit codes first
+    column = embedding_column() if column is None else column
+    return db.scalars(
+        select(Chunk.id)
+        .filter(Chunk.company_id == company_id)
+        .order_by(column.l2_distance(embedding))
+        .limit(k)
+    ).all()
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+
+    def percentile(q):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * q))], 2)
+
+    return {"p50_ms": percentile(0.5), "p95_ms": percentile(0.95), "p99_ms": percentile(0.99)}
+
+
+def exact_top_k(db, queries, k, column=None):
+    """
+    Ground truth: with index scans disabled Postgres falls back to an exact
+    scan of the company's chunks. Returns (truth sets, latency summary).
+    column defaults to the configured embedding column.
+    """
+    truth = []
+    latencies = []
+    for embedding, company_id in queries:
+        db.execute(text("SET LOCAL enable_indexscan = off"))
+        started = time.perf_counter()
+        truth.append(set(exact_search(db, embedding, company_id, k, column)))
+        latencies.append((time.perf_counter() - started) * 1000)
+        db.rollback()
+    return truth, {"recall": 1.0, **latency_summary(latencies)}
+
+
+def measure(db, queries, truth, k):
+    latencies = []
+    recalls = []
+    for (embedding, company_id), expected in zip(queries, truth):
+        configure_vector_search(db)
+        started = time.perf_counter()
+        found = search(db, embedding, company_id, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        db.rollback()
+        recalls.append(len(expected & set(found)) / max(len(expected), 1))
+    return {"recall": round(statistics.mean(recalls), 4), **latency_summary(latencies)}
+
+
+def sample_queries(db, samples, column=None):
+    """Embeddings of randomly chosen chunks, paired with their company."""
+    column = embedding_column() if column is None else column
+    queries = [
+        (list(embedding_values(row.embedding)), row.company_id)
+        for row in db.execute(
+            select(column.label("embedding"), Chunk.company_id)
+            .filter(Chunk.company_id.isnot(None), column.isnot(None))
+            .order_by(text("random()"))
+            .limit(samples)
+        )
+    ]
+    db.rollback()
+    return queries
+
+
+def run_report(samples, k, values):
+    init_db()
+    index_type = settings.vector_index_type
+    knob = {"hnsw": "hnsw_ef_search", "ivfflat": "ivfflat_probes"}.get(index_type)
+    if knob is None:
+        print("vector_index_type is 'none': every search is already exact.")
+        return []
+
+    db = SessionLocal()
+    try:
+        queries = sample_queries(db, samples)
+        if not queries:
+            print("No chunks found. Ingest some filings first.")
+            return []
+
+        truth, exact_stats = exact_top_k(db, queries, k)
+        rows = [{"setting": "exact", "value": None, **exact_stats}]
+        original = getattr(settings, knob)
+        try:
+            for value in values:
+                setattr(settings, knob, value)
+                rows.append({"setting": knob, "value": value, **measure(db, queries, truth, k)})
+        finally:
+            setattr(settings, knob, original)
+    finally:
+        db.close()
+
+    print(f"\npgvector {database.vector_extension_version()}, index={index_type}, "
+          f"storage={settings.embedding_storage}, k={k}, queries={len(queries)}")
+    print(f"{'setting':<16}{'value':>8}{'recall':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in rows:
+        value = "-" if row["value"] is None else row["value"]
+        print(f"{row['setting']:<16}{value:>8}{row['recall']:>10.3f}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare ANN recall and latency across query-time settings.")
+    parser.add_argument("--samples", type=int, default=100, help="Number of sampled query chunks.")
+    parser.add_argument("--k", type=int, default=settings.retrieval_top_k, help="Top-k to evaluate.")
+    parser.add_argument("--values", type=int, nargs="+", default=[10, 20, 40, 80, 160],
+                        help="ef_search (HNSW) or probes (IVFFlat) values to try.")
+    parser.add_argument("--json", action="store_true", help="Also print the rows as JSON.")
+    args = parser.parse_args()
+
+    report = run_report(args.samples, args.k, args.values)
+    if args.json:
+        print(json.dumps(report, indent=2))
@@ -1,82 +1,368 @@
 import os
-import shutil
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.services.ingestion import ingest_10k_json
-from app.services.rag import query_rag, generate_specialized_content
+import json
+import uuid
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import get_async_db, AsyncSessionLocal
+from app.services.audit import get_audit_page, get_audit_writer, stream_audit_export
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from app.services.jobs import (
+    IngestQueueClosed, IngestQueueFull, UploadTooLarge, get_job_queue, limit_body, save_upload
+)
+from app.services.rag import (
+    query_rag,
+    generate_specialized_content,
+    stream_rag,
+    stream_rag_batch,
+    stream_specialized_content,
+    cache_stats,
+)
+from app.services.context import context_stats
+from app.services.llm_client import LLMUnavailable, get_llm_client
+from app.services.filing_assets import etag_matches, get_filing_assets, resolve_item, select_encoding
 from app.models.domain import Company
-from app.schemas.pydantic_models import QueryRequest, QueryResponse, CompanyResponse, GenerationRequest, GenerationResponse
+from app.schemas.pydantic_models import BatchQueryRequest, QueryRequest, QueryResponse, CompanyResponse, GenerationRequest, GenerationResponse
 from typing import List
-from app.models.domain import AuditLog
 from app.schemas.pydantic_models import AuditLogResponse
 router = APIRouter()
+# Mounted at the root, outside /api/v1 (see main.py)
+static_router = APIRouter()
+
+# URL segment -> generation mode, shared by the plain and streaming endpoints
+GENERATION_MODES = {"summary": "summary", "risk": "risk_note", "email": "email"}
+
+def sse_response(make_events):
+    """
+    Wraps an async (event, data) generator as a Server-Sent Events stream. The
+    session is opened inside the stream so it lives exactly as long as it does.
+    """
+    async def body():
+        async with AsyncSessionLocal() as db:
+            try:
+                async for event, data in make_events(db):
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def llm_unavailable(e: LLMUnavailable) -> HTTPException:
+    # 429 (Gemini quota) or 503 (queue full, Gemini down), both worth retrying later
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+# Pagination: list endpoints return a plain JSON list and, when more rows
+# exist, the cursor for the next page in this header
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
 # --- 1. Utility: List Companies ---
 @router.get("/companies", response_model=List[CompanyResponse])
-def list_companies(db: Session = Depends(get_db)):
-    return db.query(Company).all()
+async def list_companies(
+    response: Response,
+    limit: int = Query(500, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Only what CompanyResponse serializes
+    query = select(
+        Company.id, Company.name, Company.cik, Company.filename, Company.filing_date, Company.filing_type
+    ).order_by(Company.id)
+    if after_id is not None:
+        query = query.filter(Company.id > after_id)
+    companies = (await db.execute(query.limit(limit + 1))).all()
+    if len(companies) > limit:
+        companies = companies[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = str(companies[-1].id)
+    return companies
 
 # --- 2. Ingestion: Upload 10-K JSON ---
-@router.post("/ingest")
-async def ingest_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    # Ensure data directory exists
-    os.makedirs("data", exist_ok=True)
-    
-    file_location = f"data/{file.filename}"
-    
-    # Save uploaded file to disk
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
+# The body is parsed in the handler (see below), so describe the form for /docs by hand
+INGEST_REQUEST_BODY = {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "properties": {"file": {"type": "string", "format": "binary"}},
+        "required": ["file"],
+    }}},
+}
+
+@router.post("/ingest", status_code=202, openapi_extra={"requestBody": INGEST_REQUEST_BODY})
+async def ingest_file(request: Request):
+    """
+    Saves the upload ("file" form field) and queues it for a background
+    worker. Poll GET /ingest/jobs/{job_id} for progress and the ingestion
+    report.
+
+    The multipart body is read from the request stream here rather than
+    through an UploadFile parameter, which FastAPI would spool in full
+    before the handler runs: reading stops as soon as the size limit is
+    crossed, whatever Content-Length the client sent.
+    """
+    max_bytes = settings.ingest_max_upload_mb * 1024 * 1024
+    # Room for the multipart boundaries and part headers around the file
+    max_body = max_bytes + 64 * 1024
+    # Reject obviously oversized uploads without reading anything
+    if int(request.headers.get("content-length") or 0) > max_body:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {settings.ingest_max_upload_mb} MB limit")
+
+    parser = MultiPartParser(request.headers, limit_body(request.stream(), max_body))
     try:
-        # Trigger the ingestion logic
-        ingest_10k_json(file_location, db)
-        return {"message": f"Successfully ingested {file.filename}", "status": "success"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        form = await parser.parse()
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {settings.ingest_max_upload_mb} MB limit")
+    except (KeyError, MultiPartException) as e:
+        # KeyError: no Content-Type header at all
+        raise HTTPException(status_code=400, detail=f"Expected a multipart upload: {str(e)}")
+
+    try:
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            raise HTTPException(status_code=422, detail="Missing the 'file' form field")
+
+        # Never trust the client's path: keep the base name, prefixed so uploads can't collide
+        filename = os.path.basename(file.filename or "") or "upload.json"
+        os.makedirs(settings.ingest_upload_dir, exist_ok=True)
+        file_location = os.path.join(settings.ingest_upload_dir, f"{uuid.uuid4().hex[:8]}_{filename}")
+
+        try:
+            await run_in_threadpool(save_upload, file.file, file_location, max_bytes)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+    finally:
+        await form.close()
+
+    try:
+        job = get_job_queue().submit(file_location, filename)
+    except IngestQueueFull as e:
+        os.remove(file_location)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    except IngestQueueClosed as e:
+        os.remove(file_location)
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"message": f"Queued {filename} for ingestion", "status": job["status"], "job_id": job["job_id"]}
+
+@router.get("/ingest/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingestion job")
+    return job
 
 # --- 3. RAG: Chat with Company ---
 @router.post("/chat", response_model=QueryResponse)
-def chat_with_company(request: QueryRequest, db: Session = Depends(get_db)):
+async def chat_with_company(request: QueryRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        result = query_rag(db, request.query, request.company_id)
+        result = await query_rag(db, request.query, request.company_id, request.retrieval_mode)
         return QueryResponse(answer=result["answer"], sources=result["sources"])
+    except LLMUnavailable as e:
+        raise llm_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+@router.post("/chat/stream")
+async def stream_chat_with_company(request: QueryRequest):
+    return sse_response(lambda db: stream_rag(db, request.query, request.company_id, request.retrieval_mode))
+
+@router.post("/chat/batch")
+async def batch_chat_with_companies(request: BatchQueryRequest):
+    """
+    One question across a portfolio. Streams a "result" event per company as
+    each answer completes, then "done".
+    """
+    # Duplicates would pay for the same answer twice
+    company_ids = list(dict.fromkeys(request.company_ids))
+    if not company_ids:
+        raise HTTPException(status_code=400, detail="company_ids must not be empty")
+    if len(company_ids) > settings.chat_batch_max_companies:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.chat_batch_max_companies} companies per batch"
+        )
+    return sse_response(lambda db: stream_rag_batch(db, request.query, company_ids, request.retrieval_mode))
+
 # --- 4. Specialized Generation: Summaries, Risks, Emails ---
 
 @router.post("/generate/summary", response_model=GenerationResponse)
-def api_generate_summary(request: GenerationRequest, db: Session = Depends(get_db)):
+async def api_generate_summary(request: GenerationRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        result = generate_specialized_content(db, request.company_id, "summary")
-        return GenerationResponse(content=result["content"], sources=result["sources"])
+        result = await generate_specialized_content(db, request.company_id, "summary")
+        return GenerationResponse(content=result["content"], sources=result["sources"], cached=result.get("cached", False))
+    except LLMUnavailable as e:
+        raise llm_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/generate/risk", response_model=GenerationResponse)
-def api_generate_risk(request: GenerationRequest, db: Session = Depends(get_db)):
+async def api_generate_risk(request: GenerationRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        result = generate_specialized_content(db, request.company_id, "risk_note")
-        return GenerationResponse(content=result["content"], sources=result["sources"])
+        result = await generate_specialized_content(db, request.company_id, "risk_note")
+        return GenerationResponse(content=result["content"], sources=result["sources"], cached=result.get("cached", False))
+    except LLMUnavailable as e:
+        raise llm_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/generate/email", response_model=GenerationResponse)
-def api_generate_email(request: GenerationRequest, db: Session = Depends(get_db)):
+async def api_generate_email(request: GenerationRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        result = generate_specialized_content(db, request.company_id, "email")
-        return GenerationResponse(content=result["content"], sources=result["sources"])
+        result = await generate_specialized_content(db, request.company_id, "email")
+        return GenerationResponse(content=result["content"], sources=result["sources"], cached=result.get("cached", False))
+    except LLMUnavailable as e:
+        raise llm_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+@router.post("/generate/{kind}/stream")
+async def api_generate_stream(kind: str, request: GenerationRequest):
+    mode = GENERATION_MODES.get(kind)
+    if mode is None:
+        raise HTTPException(status_code=404, detail=f"Unknown generation type: {kind}")
+    return sse_response(lambda db: stream_specialized_content(db, request.company_id, mode))
+
 # --- 5. Audit & Compliance ---
 @router.get("/audit", response_model=List[AuditLogResponse])
-def get_audit_logs(db: Session = Depends(get_db)):
+async def get_audit_logs(
+    response: Response,
+    company_id: Optional[int] = None,
+    mode: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Newest first, one page at a time; pass X-Next-Cursor back as ?cursor=."""
     try:
-        # Fetch all logs, newest first
-        logs = db.query(AuditLog).order_by(AuditLog.timestamp.desc()).all()
-        return logs
+        logs, next_cursor = await get_audit_page(
+            db, limit, cursor, company_id=company_id, mode=mode, since=since, until=until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return logs
+
+@router.get("/audit/export")
+async def export_audit_logs(
+    company_id: Optional[int] = None,
+    mode: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """Every matching record as NDJSON, streamed from a server-side cursor."""
+    async def body():
+        async with AsyncSessionLocal() as db:
+            async for line in stream_audit_export(
+                db, company_id=company_id, mode=mode, since=since, until=until
+            ):
+                yield line
+
+    return StreamingResponse(
+        body(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="audit_export.ndjson"'}
+    )
+
+# --- 6. Operations ---
+@router.get("/cache/stats")
+async def get_cache_stats():
+    return cache_stats()
+
+@router.get("/llm/stats")
+async def get_llm_stats():
+    # Scheduler queue and budgets, coalesced calls and retries of this process
+    return get_llm_client().stats()
+
+@router.get("/context/stats")
+async def get_context_stats():
+    # Prompt tokens saved by overlap merging and the token budget
+    return context_stats()
+
+@router.get("/audit/writer")
+async def get_audit_writer_stats():
+    # queue_depth: records accepted but not yet in audit_logs
+    # dead_lettered: records the database rejected, kept in the dead-letter file
+    return get_audit_writer().stats()
+
+@router.get("/ingest/stats")
+async def get_ingest_stats():
+    return get_job_queue().stats()
+
+# --- 7. Filings ---
+# SEC HTMs reference images and stylesheets that were never downloaded;
+# those get an empty 204 instead of filling the console with 404s
+SILENCED_ASSET_EXTENSIONS = (".jpg", ".png", ".gif", ".ico", ".css")
+
+def cache_headers(etag: str) -> dict:
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.filings_max_age_seconds}",
+        "Vary": "Accept-Encoding"
+    }
+
+@static_router.api_route("/static-filings/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def get_static_filing(path: str, request: Request):
+    assets = get_filing_assets()
+    entry = assets.get(path)
+    if entry is None:
+        if path.lower().endswith(SILENCED_ASSET_EXTENSIONS):
+            return Response(status_code=204)
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    sha = entry["sha256"] or await run_in_threadpool(assets.digest, entry)
+    # No-op once the gzip/brotli copies exist
+    assets.schedule_compression(entry)
+    encoding = select_encoding(request.headers.get("accept-encoding"), entry["variants"])
+    # Each representation needs its own strong ETag
+    headers = cache_headers(f'"{sha}-{encoding}"' if encoding else f'"{sha}"')
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    file_path, stat = entry["path"], entry["stat"]
+    if encoding:
+        file_path, stat = entry["variants"][encoding]
+        headers["Content-Encoding"] = encoding
+    # Range and If-Range requests are answered by FileResponse
+    return FileResponse(file_path, headers=headers, media_type=entry["media_type"], stat_result=stat)
+
+@router.get("/companies/{company_id}/filing/sections/{item}")
+async def get_filing_section(company_id: int, item: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    HTML of one 10-K item of the company's filing. item: an item code
+    ("item_1A") or a section name as listed in chat sources ("Risk Factors").
+    """
+    number = resolve_item(item)
+    if number is None:
+        raise HTTPException(status_code=400, detail=f"Unknown 10-K item: {item}")
+    filename = await db.scalar(select(Company.filename).filter(Company.id == company_id))
+    if not filename:
+        raise HTTPException(status_code=404, detail="No filing on record for this company")
+    assets = get_filing_assets()
+    entry = assets.get(filename)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Filing not found")
+
+    excerpt = await run_in_threadpool(assets.section_excerpt, filename, entry, number)
+    if excerpt is None:
+        raise HTTPException(status_code=404, detail=f"Item {number} not found in the filing")
+    html, gzipped = excerpt
+    compressed = select_encoding(request.headers.get("accept-encoding"), {"gzip": gzipped}) == "gzip"
+    headers = cache_headers(f'"{entry["sha256"]}-item{number}' + ('-gzip"' if compressed else '"'))
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if compressed:
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=gzipped if compressed else html, media_type="text/html", headers=headers)
@@ -0,0 +1,156 @@
+from typing import Literal
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """
+    Runtime tuning knobs. Every field can be overridden with an environment
+    variable of the same name (case-insensitive) or from the .env file.
+    """
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    # --- Concurrency ---
+    # Async DB pool for the request path; a connection is only held while a
+    # query runs, never across an LLM call
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    # Upper bound on outstanding Gemini calls per process (see llm_client.py)
+    llm_max_concurrency: int = 64
+    # Threads running CPU-bound query embeddings off the event loop
+    embedding_threads: int = 2
+
+    # --- Embeddings (app/services/embeddings.py) ---
+    # "onnx" runs an int8-quantized export of MiniLM on onnxruntime: less memory
+    # per worker and faster on CPU. Pick the file matching the host's CPU
+    # (e.g. onnx/model_qint8_avx512.onnx, onnx/model_qint8_arm64.onnx)
+    embedding_backend: Literal["torch", "onnx"] = "torch"
+    embedding_onnx_file: str = "onnx/model_quint8_avx2.onnx"
+    # Compare the ONNX model against torch when it loads; fall back if it drifts
+    embedding_parity_check: bool = True
+    embedding_parity_min_cosine: float = 0.99
+    # Load the model in the background at startup instead of on first request
+    embedding_warmup: bool = True
+    # Queries arriving while a forward pass runs are batched into the next
+    # one: it starts after this many ms or once it is full. 0 ms embeds each
+    # query alone
+    query_embedding_batch_wait_ms: float = 5.0
+    query_embedding_batch_max: int = 32
+
+    # --- Background ingestion (POST /ingest) ---
+    # Worker processes; each loads its own embedding model
+    ingest_workers: int = 1
+    # Jobs allowed to wait for a worker before uploads get 429
+    ingest_queue_size: int = 8
+    # Niceness of worker processes, so chat keeps priority on shared pods
+    ingest_worker_nice: int = 10
+    ingest_max_upload_mb: int = 100
+    ingest_upload_dir: str = "data"
+    # Finished jobs remembered for GET /ingest/jobs/{id}
+    ingest_job_history: int = 500
+    # Chunks embedded and inserted at a time; with one section read at a time,
+    # this keeps ingestion memory flat however large the filing
+    ingest_batch_size: int = 256
+
+    # --- Audit log writer (app/services/audit.py) ---
+    # Records are appended to a local WAL, then inserted in batches off the request path
+    audit_wal_dir: str = "data/audit_wal"
+    audit_batch_size: int = 200
+    audit_flush_interval_ms: int = 200
+    # fsync every append: survives power loss, not just a process crash
+    audit_wal_fsync: bool = False
+    # Records the database rejects (bad data, not an outage) are appended here
+    # as JSON lines instead of being retried. Empty: audit-rejected.jsonl in audit_wal_dir
+    audit_dead_letter_path: str = ""
+
+    # --- Gemini client (app/services/llm_client.py) ---
+    # Per-process budgets; set them to the project's quota divided by the
+    # number of API processes. 0 disables a budget.
+    llm_requests_per_minute: int = 1000
+    llm_tokens_per_minute: int = 1000000
+    # Reserved per call for the answer until the real usage is known
+    llm_expected_output_tokens: int = 1024
+    # Retries of rate-limited or unavailable responses, with jittered
+    # exponential backoff between base and max seconds
+    llm_max_retries: int = 4
+    llm_backoff_base_seconds: float = 1.0
+    llm_backoff_max_seconds: float = 30.0
+    # A call still queued for budget after this long fails with 503
+    llm_queue_timeout_seconds: float = 60.0
+
+    # --- Map-reduce generation for oversized 10-K sections ---
+    # Above this many context tokens, sections are summarized part by part
+    # concurrently and the final output is generated from the part notes
+    generation_map_reduce_threshold_tokens: int = 60000
+    generation_part_tokens: int = 12000
+    generation_map_concurrency: int = 8
+
+    # --- Retrieval ---
+    retrieval_top_k: int = 5
+    # "vector" (MiniLM only), "lexical" (Postgres full-text only) or "hybrid"
+    # (both, fused with reciprocal rank fusion). Overridable per request.
+    # Compare them on your corpus with eval_retrieval.py
+    retrieval_mode: Literal["vector", "lexical", "hybrid"] = "vector"
+    # Upper bound on companies in one POST /chat/batch
+    chat_batch_max_companies: int = 50
+    # Chat prompts: retrieved chunks are merged (overlap removed) and added by
+    # relevance until this many tokens of context. 0: room for retrieval_top_k
+    # full chunks (see context.context_token_budget), so no hit is dropped
+    context_token_budget: int = 0
+    # tiktoken encoding used to count tokens (app/services/tokens.py)
+    tokenizer_encoding: str = "cl100k_base"
+    # Candidates taken from each retriever before fusion
+    hybrid_candidates: int = 20
+    # RRF damping constant: score = sum(1 / (rrf_k + rank))
+    rrf_k: int = 60
+    # "pgvector" searches inside Postgres; "numpy" searches memory-mapped
+    # per-company matrices in process (synced from the chunks table)
+    vector_store_backend: Literal["pgvector", "numpy"] = "pgvector"
+    vector_store_dir: str = "data/vector_store"
+    vector_store_sync_seconds: int = 60
+
+    # --- Query caches (in-process, per worker) ---
+    query_embedding_cache_size: int = 2048
+    query_embedding_cache_ttl_seconds: int = 24 * 3600
+    retrieval_cache_size: int = 4096
+    retrieval_cache_ttl_seconds: int = 900
+
+    # --- pgvector ANN index (managed by init_db) ---
+    vector_index_type: Literal["hnsw", "ivfflat", "none"] = "hnsw"
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 64
+    ivfflat_lists: int = 100
+
+    # --- Embedding storage (pgvector >= 0.7 for the compact forms) ---
+    # "vector": float32 in chunks.embedding. "halfvec": float16 in
+    # chunks.embedding_half, half the size of the rows and the index.
+    # "binary": halfvec rows searched through a 1-bit-per-dimension index,
+    # then re-ranked on the halfvec values. Existing rows are converted with
+    # migrate_embeddings.py.
+    embedding_storage: Literal["vector", "halfvec", "binary"] = "vector"
+    # "binary" only: candidates taken from the bit index per result kept
+    binary_rerank_factor: int = 8
+
+    # --- pgvector query-time tuning ---
+    hnsw_ef_search: int = 40
+    ivfflat_probes: int = 10
+    # pgvector >= 0.8 only: keeps scanning the index until the company filter
+    # has enough rows
+    hnsw_iterative_scan: Literal["relaxed_order", "strict_order", "off"] = "relaxed_order"
+
+    # --- SEC filings served at /static-filings (app/services/filing_assets.py) ---
+    # Empty: 10K-data/raw at the repository root
+    filings_dir: str = ""
+    # gzip/brotli copies of HTM and CSS files, named by content hash
+    filings_cache_dir: str = "data/filing_cache"
+    filings_precompress: bool = True
+    # How often the directory is checked for added or replaced filings
+    filings_refresh_seconds: int = 30
+    # Browsers revalidate with If-None-Match after this; filings rarely change
+    filings_max_age_seconds: int = 3600
+
+    # --- Observability (app/core/metrics.py, GET /metrics) ---
+    # Print the stage breakdown of requests slower than this; 0 disables
+    slow_request_log_ms: int = 0
+
+
+settings = Settings()
@@ -1,7 +1,14 @@
 import os
-from sqlalchemy import create_engine, text
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from app.models.domain import Base
+from sqlalchemy.schema import CreateColumn
+from app.models.domain import Base, EMBEDDING_DIM
+from app.core.config import settings
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,6 +20,204 @@ DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://advisor_admin:securepassw
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for the request path (asyncpg). Ingestion and scripts keep the sync engine.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+# No pgvector codec is registered on asyncpg connections: the SQLAlchemy
+# Vector/HALFVEC types already bind and parse the text form, which asyncpg
+# passes through for types it has no codec for. The binary codec from
+# pgvector.asyncpg rejects those pre-formatted strings.
+
+# Per-request SQL statement counter. The context variable holds a mutable
+# list rather than an int so increments made in child tasks (middleware,
+# streaming bodies) and in SQLAlchemy's greenlets land in the same counter.
+_statement_counter = ContextVar("sql_statement_counter", default=None)
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _statement_counter.get()
+    if counter is not None:
+        counter[0] += 1
+
+event.listen(engine, "before_cursor_execute", _count_statement)
+event.listen(async_engine.sync_engine, "before_cursor_execute", _count_statement)
+
+@contextmanager
+def count_statements():
+    """
+    Counts SQL statements executed in this context (sync or async engine):
+
+        with count_statements() as counter:
+            ...
+        assert counter[0] <= 3
+    """
+    counter = [0]
+    token = _statement_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _statement_counter.reset(token)
+
+# create_all() never alters tables that already exist, so columns added after
+# the first deploy are applied here. Every statement must be idempotent and
+# cheap on a large table: backfills and table rewrites belong in
+# migrate_schema.py, which runs them in batches.
+SCHEMA_MIGRATIONS = [
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents (content_hash)",
+    # Denormalized company filter for vector search (no join to documents)
+    "ALTER TABLE chunks ADD COLUMN IF NOT EXISTS company_id INTEGER REFERENCES companies (id)",
+    "CREATE INDEX IF NOT EXISTS ix_chunks_company_id ON chunks (company_id)",
+    "ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN DEFAULT FALSE",
+    # Keyset pagination on /audit: newest first, optionally per company or mode
+    "CREATE INDEX IF NOT EXISTS ix_audit_logs_timestamp_id ON audit_logs (timestamp DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_audit_logs_company_timestamp_id ON audit_logs (company_id, timestamp DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_audit_logs_mode_timestamp_id ON audit_logs (llm_mode, timestamp DESC, id DESC)",
+    # Write-behind audit writer: replayed WAL records are skipped by ON CONFLICT (record_id)
+    "ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS record_id UUID",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_audit_logs_record_id ON audit_logs (record_id)",
+]
+
+CHUNK_TSV_QUERY = text(
+    "SELECT 1 FROM information_schema.columns "
+    "WHERE table_name = 'chunks' AND column_name = 'chunk_tsv'"
+)
+
+@compiles(CreateColumn)
+def _skip_migration_only_columns(element, compiler, **kw):
+    # Columns marked migration_only (types an older server may lack) are left
+    # out of CREATE TABLE and added conditionally by init_db
+    if element.element.info.get("migration_only"):
+        return None
+    return compiler.visit_create_column(element, **kw)
+
+# Installed pgvector version, used to skip features it lacks. Read from
+# pg_extension on first use in each process (API workers, ingestion job
+# processes, scripts), not only where init_db() ran; "" once read as absent
+_vector_version = None
+VECTOR_VERSION_QUERY = text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+
+def vector_extension_version(conn=None):
+    """The pgvector version string, or None if the extension isn't installed."""
+    global _vector_version
+    if _vector_version is None:
+        if conn is None:
+            with engine.connect() as conn:
+                _vector_version = conn.execute(VECTOR_VERSION_QUERY).scalar() or ""
+        else:
+            _vector_version = conn.execute(VECTOR_VERSION_QUERY).scalar() or ""
+    return _vector_version or None
+
+def _version_tuple(version):
+    return tuple(int(part) for part in version.split(".") if part.isdigit())
+
+# The column (or expression) each embedding_storage searches, its operator
+# class, and the name its indexes are prefixed with
+EMBEDDING_INDEX_TARGETS = {
+    "vector": ("embedding", "vector_l2_ops", "embedding"),
+    "halfvec": ("embedding_half", "halfvec_l2_ops", "embedding_half"),
+    "binary": (f"(binary_quantize(embedding_half)::bit({EMBEDDING_DIM}))", "bit_hamming_ops", "embedding_bits"),
+}
+
+def compact_storage_supported(conn=None):
+    # halfvec and binary_quantize() arrived in pgvector 0.7
+    version = vector_extension_version(conn)
+    return bool(version) and _version_tuple(version) >= (0, 7)
+
+def vector_index_definition(storage=None):
+    """
+    Returns (index_name, CREATE INDEX statement) for the configured ANN index,
+    or (None, None) when vector_index_type is 'none'. Build parameters are part
+    of the name, so changing them in config triggers a rebuild. storage
+    defaults to settings.embedding_storage.
+    """
+    column, opclass, prefix = EMBEDDING_INDEX_TARGETS[storage or settings.embedding_storage]
+    index_type = settings.vector_index_type
+    if index_type == "hnsw":
+        name = f"ix_chunks_{prefix}_hnsw_m{settings.hnsw_m}_ef{settings.hnsw_ef_construction}"
+        return name, (
+            f"CREATE INDEX IF NOT EXISTS {name} ON chunks USING hnsw ({column} {opclass}) "
+            f"WITH (m = {settings.hnsw_m}, ef_construction = {settings.hnsw_ef_construction})"
+        )
+    if index_type == "ivfflat":
+        name = f"ix_chunks_{prefix}_ivfflat_l{settings.ivfflat_lists}"
+        return name, (
+            f"CREATE INDEX IF NOT EXISTS {name} ON chunks USING ivfflat ({column} {opclass}) "
+            f"WITH (lists = {settings.ivfflat_lists})"
+        )
+    return None, None
+
+def ensure_embedding_storage(conn):
+    """
+    Adds chunks.embedding_half when pgvector can store it. Compact storage on
+    an older pgvector fails here, at startup, rather than on the first search.
+    """
+    if compact_storage_supported(conn):
+        conn.execute(text(f"ALTER TABLE chunks ADD COLUMN IF NOT EXISTS embedding_half halfvec({EMBEDDING_DIM})"))
+    else:
+        check_embedding_storage(conn)
+
+def check_embedding_storage(conn=None):
+    """Raises if the configured embedding_storage needs a newer pgvector."""
+    if settings.embedding_storage != "vector" and not compact_storage_supported(conn):
+        raise RuntimeError(
+            f"embedding_storage '{settings.embedding_storage}' needs pgvector >= 0.7 "
+            f"(installed: {vector_extension_version(conn)}; if the server has a newer one, "
+            "run python migrate_embeddings.py --update-extension)"
+        )
+
+def ensure_vector_index(conn):
+    """
+    Creates the configured ANN index on the embedding column in use and drops
+    any embedding index built for another storage, type or parameters.
+    Note: IVFFlat learns its centroids at build time, so build it after the
+    corpus is loaded (re-run init_db or batch_ingest once ingestion is done).
+    """
+    wanted, create_sql = vector_index_definition()
+    existing = conn.execute(text(
+        "SELECT indexname FROM pg_indexes "
+        "WHERE tablename = 'chunks' AND indexname LIKE 'ix_chunks_embedding_%'"
+    )).scalars().all()
+    for name in existing:
+        if name != wanted:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    if create_sql:
+        conn.execute(text(create_sql))
+
+def vector_search_statements(version=None):
+    """
+    The query-time ANN knobs as SET LOCAL statements, so they only apply to
+    the current transaction and never leak to other requests sharing the
+    pooled connection. version: the pgvector version, when already known.
+    """
+    index_type = settings.vector_index_type
+    statements = []
+    if index_type == "hnsw":
+        statements.append(f"SET LOCAL hnsw.ef_search = {int(settings.hnsw_ef_search)}")
+        if (settings.hnsw_iterative_scan != "off" and version
+                and _version_tuple(version) >= (0, 8)):
+            statements.append(f"SET LOCAL hnsw.iterative_scan = {settings.hnsw_iterative_scan}")
+    elif index_type == "ivfflat":
+        statements.append(f"SET LOCAL ivfflat.probes = {int(settings.ivfflat_probes)}")
+    return statements
+
+def configure_vector_search(db):
+    for statement in vector_search_statements(vector_extension_version(db)):
+        db.execute(text(statement))
+
+async def configure_vector_search_async(db: AsyncSession):
+    global _vector_version
+    if _vector_version is None:
+        # Read on the request's own connection rather than blocking the loop on the sync engine
+        _vector_version = (await db.execute(VECTOR_VERSION_QUERY)).scalar() or ""
+    for statement in vector_search_statements(_vector_version or None):
+        await db.execute(text(statement))
+
 def init_db():
     # Ensure the pgvector extension is created before creating tables
     # We use text() here because SQLAlchemy 2.0+ requires it for raw SQL
@@ -20,12 +225,37 @@ def init_db():
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
         conn.commit()
     
+    apply_schema_migrations()
+    with engine.connect() as conn:
+        # Chunks from before hybrid retrieval: adding the generated column here
+        # would rewrite the table under an exclusive lock at startup
+        if conn.execute(CHUNK_TSV_QUERY).scalar() is None:
+            raise RuntimeError("chunks.chunk_tsv is missing: run python migrate_schema.py once to add it")
+
+    # Databases created on an older image keep their extension version: it is
+    # only upgraded by `python migrate_embeddings.py --update-extension`
+    with engine.connect() as conn:
+        ensure_embedding_storage(conn)
+        ensure_vector_index(conn)
+        conn.commit()
+
+def apply_schema_migrations():
     # Create all tables defined in domain.py
     Base.metadata.create_all(bind=engine)
 
+    # Bring tables created by older versions up to date
+    with engine.connect() as conn:
+        for statement in SCHEMA_MIGRATIONS:
+            conn.execute(text(statement))
+        conn.commit()
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
\ No newline at end of file
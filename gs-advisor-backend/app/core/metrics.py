@@ -0,0 +1,102 @@
+"""
+Stage timing for the request path and ingestion.
+
+Every `with stage_timer("embed"):` block is observed in the
+advisor_stage_seconds histogram (scraped from GET /metrics) and, when it
+runs inside an HTTP request, added to that request's timings, which the
+middleware in main.py returns as a Server-Timing header and prints for
+requests slower than slow_request_log_ms.
+
+Ingestion jobs run in worker processes with their own registry, so they
+collect their timings into the job report instead (see jobs.py) and the API
+process observes them when the job finishes.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+# Stages span sub-millisecond cache hits to minute-long map-reduce generations
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "advisor_stage_seconds",
+    "Time spent per pipeline stage (embed, retrieve, context, llm, audit, ingest_*).",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "advisor_request_seconds",
+    "HTTP request duration, until the last byte of the body was sent.",
+    ["method", "route", "status"],
+    buckets=STAGE_BUCKETS,
+)
+QUERY_EMBEDDING_BATCH_SIZE = Histogram(
+    "advisor_query_embedding_batch_size",
+    "Distinct queries per batched MiniLM forward pass (app/services/embedding_batcher.py).",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+QUERY_EMBEDDING_WAIT_SECONDS = Histogram(
+    "advisor_query_embedding_wait_seconds",
+    "Time a query embedding waited for its batch to be dispatched.",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+LLM_COALESCED = Counter(
+    "advisor_llm_coalesced_total",
+    "Gemini calls answered by joining an identical call already in flight.",
+    ["kind"],
+)
+LLM_RETRIES = Counter(
+    "advisor_llm_retries_total",
+    "Gemini calls retried after a rate-limited or unavailable response.",
+    ["reason"],
+)
+
+# Per-request stage totals. Mutable dict for the same reason as
+# database._statement_counter: child tasks and greenlets share the holder.
+_request_timings = ContextVar("request_stage_timings", default=None)
+
+
+def observe_stage(stage: str, seconds: float, into: dict = None):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    for timings in (_request_timings.get(), into):
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(stage: str, into: dict = None):
+    """
+    Times the block (async code inside it included) as `stage`. A stage that
+    runs several times per request is summed in the request's timings. into,
+    if given, receives the total as well.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, into)
+
+
+@contextmanager
+def request_timings():
+    """Collects the stage timings of this context into the yielded dict."""
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing_header(timings: dict, total: float = None) -> str:
+    # Server-Timing durations are in milliseconds
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def render_metrics():
+    """(body, content type) for GET /metrics."""
+    return generate_latest(), CONTENT_TYPE_LATEST
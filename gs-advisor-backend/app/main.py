@@ -1,74 +1,127 @@
 import os
-from fastapi.staticfiles import StaticFiles
+import time
+import asyncio
 from fastapi import FastAPI, Response
-from app.core.database import engine, init_db
+from app.core.database import engine, init_db, SessionLocal, async_engine, count_statements
+from app.core.config import settings
+from app.core.metrics import REQUEST_SECONDS, render_metrics, request_timings, server_timing_header
+from app.services.vector_store import run_periodic_sync, sync_vector_store
+from app.services.embeddings import warm_up as warm_up_embeddings
+from app.services.jobs import shutdown_job_queue
+from app.services.audit import get_audit_writer, shutdown_audit_writer
+from app.services.filing_assets import get_filing_assets, run_periodic_refresh, shutdown_filing_assets
 from app.api import routes
 from fastapi.middleware.cors import CORSMiddleware
-from pathlib import Path
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import Request
 
 
 app = FastAPI(title="GS Advisor RAG API")
-# Get the path of the current file (app/main.py)
-current_file = Path(__file__).resolve()
 
-# 1. 'app' folder
-# 2. 'gs-advisor-backend' folder
-# 3. 'financial-advisor' folder (The Root)
-root_dir = current_file.parent.parent.parent
+# Frontend origins allowed to call the API and to read its timing headers
+ALLOWED_ORIGINS = ["http://localhost:5173"] # Vite's default port
 
-# Now point to the raw folder from the root
-raw_path = os.path.join(root_dir, "10K-data", "raw")
+@app.middleware("http")
+async def sql_statement_counter(request: Request, call_next):
+    # Streaming responses report what ran before their headers went out
+    with count_statements() as counter:
+        response = await call_next(request)
+        response.headers["X-SQL-Statements"] = str(counter[0])
+    return response
 
-print(f"DEBUG: Looking for HTM files at: {raw_path}")
+@app.middleware("http")
+async def stage_timing(request: Request, call_next):
+    # Server-Timing carries the stages that ran before the headers went out.
+    # The request histogram and slow-request log wait for the end of the body,
+    # so streamed LLM output is included (the task streaming it keeps adding
+    # to the same timings dict).
+    started = time.perf_counter()
+    with request_timings() as timings:
+        response = await call_next(request)
+    response.headers["Server-Timing"] = server_timing_header(timings, time.perf_counter() - started)
+    # Lets the frontend read the stages in the Resource Timing API (serverTiming)
+    response.headers["Timing-Allow-Origin"] = ", ".join(ALLOWED_ORIGINS)
 
-if not os.path.exists(raw_path):
-    # We use a print instead of an error so the app still starts 
-    # even if you are working on a machine without the data folder
-    print(f"CRITICAL WARNING: Static directory not found at {raw_path}")
-else:
-    app.mount("/static-filings", StaticFiles(directory=raw_path), name="static-filings")
-    print("Successfully mounted /static-filings")
+    route = request.scope.get("route")
+    # Unmatched paths share one label so scanners can't blow up the series count
+    route_label = getattr(route, "path", "unmatched")
+    body_iterator = response.body_iterator
 
+    async def timed_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            elapsed = time.perf_counter() - started
+            REQUEST_SECONDS.labels(request.method, route_label, str(response.status_code)).observe(elapsed)
+            if settings.slow_request_log_ms and elapsed * 1000 >= settings.slow_request_log_ms:
+                print(
+                    f"Slow request: {request.method} {request.url.path} {response.status_code} "
+                    f"{elapsed * 1000:.0f}ms ({server_timing_header(timings)})"
+                )
 
-class SilenceSECAssetsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Check if the request is for an image inside our static folder
-        path = request.url.path
-        if path.startswith("/static-filings/") or path == "/favicon.ico":
-            # List of extensions that SEC HTMs often try to load
-            if any(path.endswith(ext) for ext in [".jpg", ".png", ".gif", ".ico", ".css"]):
-                # Check if the file actually exists on disk
-                # root_dir and raw_path should be defined as we did previously
-                full_path = os.path.join(raw_path, path.replace("/static-filings/", ""))
-                
-                if not os.path.exists(full_path):
-                    # Return a "Silent" 204 No Content instead of a 404 Error
-                    return Response(status_code=204)
-        
-        return await call_next(request)
-# Add the middleware to your app
-app.add_middleware(SilenceSECAssetsMiddleware)
+    response.body_iterator = timed_body()
+    return response
 
-# Keep your existing mount below this
-app.mount("/static-filings", StaticFiles(directory=raw_path), name="static-filings")
 # --- Add CORS Middleware ---
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:5173"], # Vite's default port
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Pagination cursor on list endpoints, per-request stage timings and SQL statement count
+    expose_headers=["X-Next-Cursor", "Server-Timing", "X-SQL-Statements"],
 )
-app.mount("/static-filings", StaticFiles(directory=raw_path), name="static-filings")
 # Initialize DB on startup
 @app.on_event("startup")
 def on_startup():
     init_db()
     print("Database tables created successfully!")
+    # Replays records a previous run left in the audit WAL
+    get_audit_writer()
+    # Manifest of the raw filings served at /static-filings; compression continues in the background
+    get_filing_assets()
+    if settings.vector_store_backend == "numpy":
+        rebuilt = sync_vector_store(SessionLocal)
+        print(f"Vector store ready ({rebuilt} companies rebuilt)")
+
+@app.on_event("startup")
+async def start_vector_store_sync():
+    if settings.vector_store_backend == "numpy":
+        asyncio.create_task(run_periodic_sync(SessionLocal, settings.vector_store_sync_seconds))
+
+@app.on_event("startup")
+async def start_filing_assets_refresh():
+    asyncio.create_task(run_periodic_refresh(settings.filings_refresh_seconds))
+
+@app.on_event("startup")
+async def start_embedding_warmup():
+    # In the background: the health check answers while the model loads
+    if settings.embedding_warmup:
+        async def warm_up():
+            try:
+                print(f"Embedding model ready: {await asyncio.to_thread(warm_up_embeddings)}")
+            except Exception as e:
+                print(f"Embedding warm-up failed: {str(e)}")
+        asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    shutdown_job_queue()
+    shutdown_filing_assets()
+    # Flush queued audit records before the process exits
+    await asyncio.to_thread(shutdown_audit_writer)
+    await async_engine.dispose()
 # Include the API router with a prefix
 app.include_router(routes.router, prefix="/api/v1") # <--- Add this line
+# /static-filings: the SEC HTMs shown in the UI's filing viewer
+app.include_router(routes.static_router)
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Prometheus scrape target: stage and request latency histograms
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/")
 def health_check():
     return {"status": "ok", "message": "GS Advisor API is running"}
\ No newline at end of file
@@ -1,10 +1,16 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, ARRAY
-from sqlalchemy.orm import declarative_base, relationship
-from pgvector.sqlalchemy import Vector
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, ARRAY, Boolean, UniqueConstraint, Computed, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
+from sqlalchemy.orm import declarative_base, deferred, relationship
+from pgvector.sqlalchemy import HALFVEC, Vector
 from datetime import datetime
 
 Base = declarative_base()
 
+# Text search configuration of chunks.chunk_tsv; queries must use the same one
+TEXT_SEARCH_CONFIG = "english"
+# all-MiniLM-L6-v2 output size
+EMBEDDING_DIM = 384
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -30,22 +36,43 @@ class Document(Base):
     company_id = Column(Integer, ForeignKey("companies.id"))
     item_code = Column(String) # e.g., "item_1A"
     item_name = Column(String) # e.g., "Risk Factors"
-    raw_text = Column(Text)
+    # Whole sections run to megabytes: only loaded when a query asks for the column
+    raw_text = deferred(Column(Text))
+    content_hash = Column(String(64), index=True) # sha256 of raw_text, used to skip unchanged sections
     
     company = relationship("Company", back_populates="documents")
     chunks = relationship("Chunk", back_populates="document", cascade="all, delete")
 
 class Chunk(Base):
     __tablename__ = "chunks"
+    __table_args__ = (
+        Index("ix_chunks_chunk_tsv", "chunk_tsv", postgresql_using="gin"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     document_id = Column(Integer, ForeignKey("documents.id"))
+    # Denormalized from documents so vector search filters without a join
+    company_id = Column(Integer, ForeignKey("companies.id"), index=True)
     chunk_index = Column(Integer)
     chunk_text = Column(Text)
+    content_hash = Column(String(64)) # sha256 of chunk_text, used to reuse embeddings
     
     # Change this line from Vector(3072) to Vector(384)
-    embedding = Column(Vector(384)) 
+    # Deferred: searches run in SQL or the vector store, never on loaded rows
+    embedding = deferred(Column(Vector(EMBEDDING_DIM)))
+    # float16 form used instead when settings.embedding_storage is "halfvec" or
+    # "binary" (pgvector >= 0.7). Ingestion writes only the configured column.
+    # Left out of create_all, since older pgvector has no halfvec type:
+    # ensure_embedding_storage adds it where the server supports it.
+    embedding_half = deferred(Column(HALFVEC(EMBEDDING_DIM), info={"migration_only": True}))
     
     token_count = Column(Integer)
+    # Lexical side of hybrid retrieval (GIN-indexed). Maintained by Postgres, never loaded by default.
+    # Tables created before it get a plain column kept up to date by a trigger
+    # instead (migrate_schema.py), since adding a generated column rewrites the table
+    chunk_tsv = deferred(Column(
+        TSVECTOR,
+        Computed(f"to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(chunk_text, ''))", persisted=True)
+    ))
     document = relationship("Document", back_populates="chunks")
 
 class AuditLog(Base):
@@ -57,4 +84,36 @@ class AuditLog(Base):
     retrieved_chunk_ids = Column(ARRAY(Integer))
     llm_mode = Column(String) # chat, summary, risk_note, email
     llm_response = Column(Text)
-    timestamp = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    cache_hit = Column(Boolean, default=False) # served from generation_cache, no LLM call
+    record_id = Column(UUID(as_uuid=True), unique=True, index=True) # set by the audit writer; makes WAL replay idempotent
+    timestamp = Column(DateTime, default=datetime.utcnow)
+
+class SectionSummary(Base):
+    """
+    Map-phase output of map-reduce generation, keyed on the text of one part
+    of a section, so unchanged parts are never re-summarized.
+    """
+    __tablename__ = "section_summaries"
+    __table_args__ = (
+        UniqueConstraint("content_hash", "mode", "prompt_version", name="uq_section_summary_key"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64)) # sha256 of the part text
+    mode = Column(String) # summary, risk_note, email
+    prompt_version = Column(String(16))
+    summary = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class GenerationCache(Base):
+    __tablename__ = "generation_cache"
+    __table_args__ = (
+        UniqueConstraint("company_id", "mode", "source_hash", "prompt_version", name="uq_generation_cache_key"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"))
+    mode = Column(String) # summary, risk_note, email
+    source_hash = Column(String(64)) # hash of the source documents' content hashes
+    prompt_version = Column(String(16)) # hash of model name + prompt text
+    content = Column(Text)
+    sources = Column(ARRAY(String))
+    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
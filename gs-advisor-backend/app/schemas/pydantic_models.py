@@ -1,10 +1,17 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 # --- Chat/RAG Schemas ---
 class QueryRequest(BaseModel):
     company_id: int
     query: str
+    # Overrides settings.retrieval_mode for this request
+    retrieval_mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+
+class BatchQueryRequest(BaseModel):
+    company_ids: List[int]
+    query: str
+    retrieval_mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
 
 class SourceDocument(BaseModel):
     source: str  # e.g. "Risk Factors"
@@ -32,6 +39,7 @@ class GenerationRequest(BaseModel):
 class GenerationResponse(BaseModel):
     content: str
     sources: List[str]
+    cached: bool = False
 
 # --- Audit Log Schema ---
 from datetime import datetime
@@ -42,6 +50,7 @@ class AuditLogResponse(BaseModel):
     query_text: str
     llm_mode: str
     llm_response: str
+    cache_hit: Optional[bool] = False
     timestamp: datetime
 
     class Config:
@@ -0,0 +1,417 @@
+"""
+The compliance log.
+
+Writing: AuditWriter takes records off the request path. Each record is
+appended to a local write-ahead file first, then bulk-inserted by a
+background thread in batches. Inserts are idempotent on record_id, so
+replaying the file after a crash can never duplicate rows.
+
+Reading: keyset pagination, filters and NDJSON export. Pages are ordered
+newest first on (timestamp, id) and continue from an opaque cursor holding
+the last row's key, so every page is an index range scan no matter how deep
+the client pages. Matching indexes are created by SCHEMA_MIGRATIONS in
+app/core/database.py.
+"""
+import base64
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from functools import lru_cache
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import DisconnectionError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.metrics import stage_timer
+from app.models.domain import AuditLog
+
+try:
+    import fcntl
+except ImportError: # Windows: no advisory locks, see _adopt_orphans
+    fcntl = None
+
+# Every column, for exports; the UI list only needs AuditLogResponse's fields
+AUDIT_EXPORT_COLUMNS = [
+    AuditLog.id,
+    AuditLog.timestamp,
+    AuditLog.company_id,
+    AuditLog.user_id,
+    AuditLog.llm_mode,
+    AuditLog.cache_hit,
+    AuditLog.query_text,
+    AuditLog.retrieved_chunk_ids,
+    AuditLog.llm_response,
+]
+
+EXPORT_BATCH_SIZE = 1000
+
+# Worth retrying: the database or the connection, not the record, is the problem
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError)
+
+
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> list:
+    """Raises ValueError for anything encode_cursor didn't produce."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def naive_utc(value: datetime):
+    # Timestamps are stored as naive UTC (datetime.utcnow)
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def filter_audit_query(query, company_id: int = None, mode: str = None,
+                       since: datetime = None, until: datetime = None):
+    if company_id is not None:
+        query = query.filter(AuditLog.company_id == company_id)
+    if mode:
+        query = query.filter(AuditLog.llm_mode == mode)
+    if since is not None:
+        query = query.filter(AuditLog.timestamp >= naive_utc(since))
+    if until is not None:
+        query = query.filter(AuditLog.timestamp < naive_utc(until))
+    return query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc())
+
+
+async def get_audit_page(db: AsyncSession, limit: int, cursor: str = None, **filters):
+    """
+    Returns (logs, next_cursor); next_cursor is None on the last page.
+    One extra row is fetched to know whether another page exists.
+    """
+    query = filter_audit_query(select(AuditLog), **filters)
+    if cursor:
+        try:
+            timestamp, last_id = decode_cursor(cursor)
+            key = (datetime.fromisoformat(timestamp), int(last_id))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+        query = query.filter(tuple_(AuditLog.timestamp, AuditLog.id) < key)
+    logs = (await db.scalars(query.limit(limit + 1))).all()
+    if len(logs) <= limit:
+        return logs, None
+    logs = logs[:limit]
+    return logs, encode_cursor(logs[-1].timestamp.isoformat(), logs[-1].id)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+async def stream_audit_export(db: AsyncSession, **filters):
+    """
+    Yields one JSON line per audit record. Rows come from a server-side cursor
+    EXPORT_BATCH_SIZE at a time, so memory stays flat however large the pull.
+    """
+    query = filter_audit_query(select(*AUDIT_EXPORT_COLUMNS), **filters)
+    result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    async for row in result:
+        yield json.dumps(row._asdict(), default=_json_default) + "\n"
+
+
+# --- Write-behind writer ---
+
+def new_audit_record(company_id: int, query_text: str, llm_mode: str, llm_response: str,
+                     retrieved_chunk_ids=None, cache_hit: bool = False) -> dict:
+    """A JSON-safe audit record, stamped now (not when it reaches the table)."""
+    return {
+        "record_id": uuid.uuid4().hex,
+        "timestamp": datetime.utcnow().isoformat(),
+        "company_id": company_id,
+        "query_text": query_text,
+        "retrieved_chunk_ids": list(retrieved_chunk_ids or []),
+        "llm_mode": llm_mode,
+        "llm_response": llm_response,
+        "cache_hit": cache_hit,
+    }
+
+
+def _to_row(record: dict) -> dict:
+    return {
+        **record,
+        "record_id": uuid.UUID(record["record_id"]),
+        "timestamp": datetime.fromisoformat(record["timestamp"]),
+    }
+
+
+def is_transient(error: Exception) -> bool:
+    return isinstance(error, TRANSIENT_ERRORS) or getattr(error, "connection_invalidated", False)
+
+
+def _read_wal(path: str):
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn final line from a crash mid-append: the request never got its response
+                print(f"Audit WAL {path}: skipping unreadable line")
+    return records
+
+
+class AuditWriter:
+    """
+    submit() costs one buffered append (plus fsync if audit_wal_fsync) and
+    never touches the database. A background thread inserts batches of up to
+    batch_size records, waiting at most flush_interval for a batch to fill.
+    Inserts failing on a transient error (connection lost, database down)
+    are retried with backoff. When the database rejects the data itself (a
+    NUL character, a foreign key violation) the batch is inserted row by row
+    and the rejected rows are appended to the dead-letter file with the
+    error, so one bad record can't stall every later one.
+
+    The WAL is a series of segment files in wal_dir, each locked by the
+    process writing it. Before a batch is flushed the active segment is
+    sealed and new records go to a fresh one; a sealed segment is deleted
+    once every record in it is committed or dead-lettered. So the WAL holds
+    roughly what is still queued, however long the process runs, and a
+    crash replays only that. On start, segments left behind by dead
+    processes are adopted: copied into our own segment, queued, removed.
+    """
+
+    def __init__(self, engine, wal_dir: str, batch_size: int, flush_interval: float,
+                 fsync: bool = False, dead_letter_path: str = None):
+        self.engine = engine
+        self.wal_dir = wal_dir
+        self.dead_letter_path = dead_letter_path or os.path.join(wal_dir, "audit-rejected.jsonl")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._queue = queue.Queue() # (record, segment number)
+        self._lock = threading.Lock()
+        self._pending = 0 # submitted (or replayed) but not yet committed
+        self._stopping = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+        self.last_error = None
+
+        os.makedirs(wal_dir, exist_ok=True)
+        # Unique per writer: containers often restart under the same PID
+        self._prefix = f"audit-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._segments = {} # number -> {"file", "path", "pending"}
+        self._segment_number = 0
+        self._active = None
+        self._open_segment()
+
+    def _open_segment(self):
+        # Caller holds the lock (or is __init__)
+        self._segment_number += 1
+        path = os.path.join(self.wal_dir, f"{self._prefix}-{self._segment_number:06d}.wal")
+        f = open(path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._segments[self._segment_number] = {"file": f, "path": path, "pending": 0}
+        self._active = self._segment_number
+
+    def start(self):
+        adopted = self._adopt_orphans()
+        if adopted:
+            print(f"Audit writer: replaying {adopted} records from the WAL")
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def _adopt_orphans(self) -> int:
+        """Moves records from WAL segments of dead processes into ours and queues them."""
+        own = {segment["path"] for segment in self._segments.values()}
+        adopted = 0
+        for path in sorted(glob.glob(os.path.join(self.wal_dir, "audit-*.wal"))):
+            if path in own:
+                continue
+            try:
+                f = open(path, "r+b")
+            except FileNotFoundError:
+                continue # deleted by its owner after the listing
+            with f:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue # still owned by a live process
+                records = _read_wal(path)
+                with self._lock:
+                    self._enqueue(records)
+                # Only once the records are safe in our own segment
+                os.remove(path)
+            adopted += len(records)
+        return adopted
+
+    def _enqueue(self, records):
+        # Caller holds the lock
+        segment = self._segments[self._active]
+        f = segment["file"]
+        f.write(b"".join(json.dumps(record).encode("utf-8") + b"\n" for record in records))
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+        segment["pending"] += len(records)
+        self._pending += len(records)
+        for record in records:
+            self._queue.put((record, self._active))
+
+    def submit(self, record: dict):
+        with self._lock:
+            self._enqueue([record])
+
+    def _rotate(self):
+        """Seals the active segment; records submitted from now on go to a new one."""
+        with self._lock:
+            if self._segments[self._active]["pending"]:
+                self._open_segment()
+
+    def _release(self, batch, inserted: int, rejected: int):
+        """Accounts for a finished batch and deletes segments with nothing left to insert."""
+        with self._lock:
+            self._pending -= len(batch)
+            self.written += inserted
+            self.dead_lettered += rejected
+            for _, number in batch:
+                self._segments[number]["pending"] -= 1
+            for number in {number for _, number in batch}:
+                segment = self._segments[number]
+                if segment["pending"]:
+                    continue
+                if number == self._active:
+                    segment["file"].truncate(0)
+                    continue
+                # Removed before the lock is released (on close), so no other process adopts it
+                os.remove(segment["path"])
+                segment["file"].close()
+                del self._segments[number]
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, batch):
+        statement = insert(AuditLog).values([_to_row(record) for record in batch])
+        with stage_timer("audit_flush"), self.engine.begin() as conn:
+            conn.execute(statement.on_conflict_do_nothing(index_elements=["record_id"]))
+
+    def _dead_letter(self, record: dict, error: Exception):
+        line = json.dumps({
+            "rejected_at": datetime.utcnow().isoformat(),
+            "error": str(error),
+            "record": record,
+        }, default=str)
+        # One write per line in append mode, so workers sharing the file don't interleave
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        print(f"Audit writer: record {record.get('record_id')} rejected, written to {self.dead_letter_path}: {str(error)}")
+
+    def _run(self):
+        backoff = 0.5
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._stopping.is_set():
+                    return
+                continue
+            # Every record in the batch was appended before this point
+            self._rotate()
+            remaining = [record for record, _ in batch]
+            row_by_row = False
+            inserted = rejected = 0
+            while remaining:
+                part = remaining[:1] if row_by_row else remaining
+                try:
+                    self._insert(part)
+                    inserted += len(part)
+                except Exception as e:
+                    self.last_error = str(e)
+                    if is_transient(e):
+                        self.failed_batches += 1
+                        print(f"Audit writer: insert of {len(part)} records failed, retrying: {str(e)}")
+                        if self._stopping.is_set():
+                            # Shutting down with the DB unavailable: the WAL keeps them for the next start
+                            return
+                        time.sleep(backoff)
+                        backoff = min(backoff * 2, 30)
+                        continue
+                    if len(part) > 1:
+                        # Find the offending rows; the rest of the batch still goes in
+                        row_by_row = True
+                        continue
+                    self._dead_letter(part[0], e)
+                    rejected += 1
+                backoff = 0.5
+                del remaining[:len(part)]
+            self._release(batch, inserted, rejected)
+
+    def stop(self, timeout: float = 10):
+        """Flushes what is queued (bounded by timeout) and stops the thread."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._pending:
+            print(f"Audit writer: {self._pending} records left in {self.wal_dir}, replayed on next start")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._pending,
+                "written": self.written,
+                "failed_batches": self.failed_batches,
+                "dead_lettered": self.dead_lettered,
+                "last_error": self.last_error,
+                "wal_segments": len(self._segments),
+                "wal_bytes": sum(os.fstat(segment["file"].fileno()).st_size for segment in self._segments.values()),
+            }
+
+
+@lru_cache
+def get_audit_writer() -> AuditWriter:
+    from app.core.database import engine
+
+    writer = AuditWriter(
+        engine,
+        settings.audit_wal_dir,
+        batch_size=settings.audit_batch_size,
+        flush_interval=settings.audit_flush_interval_ms / 1000,
+        fsync=settings.audit_wal_fsync,
+        dead_letter_path=settings.audit_dead_letter_path or None
+    )
+    writer.start()
+    return writer
+
+
+def record_audit(**fields):
+    """Queues an audit record (see new_audit_record) for the background writer."""
+    with stage_timer("audit"):
+        get_audit_writer().submit(new_audit_record(**fields))
+
+
+def shutdown_audit_writer():
+    if get_audit_writer.cache_info().currsize:
+        get_audit_writer().stop()
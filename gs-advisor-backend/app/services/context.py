@@ -0,0 +1,146 @@
+"""
+Assembles the chat prompt context from ranked chunks.
+
+Chunks are cut with CHUNK_OVERLAP characters of overlap, so when neighbouring
+chunks of one section are both retrieved, pasting them verbatim repeats that
+text. Here hits are grouped into runs of consecutive chunk_index within a
+document, each run is stitched back into one passage with the overlap
+dropped, and passages are added by relevance (the best rank among their
+chunks) until the token budget is spent. Passages left out for lack of
+budget are counted in the stats as passages_dropped.
+"""
+import threading
+from app.core.config import settings
+from app.services.filings import CHUNK_OVERLAP, CHUNK_SIZE
+from app.services.tokens import count_tokens
+
+# Shorter suffix/prefix matches are treated as coincidence, not overlap:
+# neighbours split inside a long paragraph often share none, and trimming a
+# chance match ("... $ 1" + "1 billion") would drop real text
+MIN_OVERLAP = 20
+
+# Upper estimate of one full chunk as a prompt passage: ~4 characters per
+# token for prose, plus a quarter for figures and tables (which tokenize
+# denser) and the Source/Content header
+PASSAGE_TOKENS = CHUNK_SIZE // 4 * 5 // 4
+
+# Running totals since startup, served by GET /context/stats
+_stats_lock = threading.Lock()
+_totals = {
+    "prompts": 0, "chunks_retrieved": 0, "chunks_used": 0, "passages_dropped": 0,
+    "tokens_verbatim": 0, "tokens_used": 0,
+}
+
+
+def context_token_budget() -> int:
+    """The configured budget, or by default enough for retrieval_top_k full chunks."""
+    return settings.context_token_budget or settings.retrieval_top_k * PASSAGE_TOKENS
+
+
+def format_passage(item_name: str, text: str) -> str:
+    return f"---\nSource: {item_name}\nContent: {text}\n"
+
+
+def merge_overlap(left: str, right: str, max_overlap: int = CHUNK_OVERLAP,
+                  min_overlap: int = MIN_OVERLAP) -> str:
+    """
+    Joins two consecutive chunks, dropping the longest suffix of `left` that
+    `right` starts with, if it is at least min_overlap characters. Otherwise
+    the chunks are joined as-is on a blank line: repeating a few words is
+    harmless, losing a digit of a figure is not.
+    """
+    for size in range(min(len(left), len(right), max_overlap), min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return f"{left}\n\n{right}"
+
+
+def merge_runs(chunks):
+    """
+    chunks: ranked rows from rag.load_chunks (best first). Returns passages,
+    best first: dicts with item_name, text, chunk_ids (in document order)
+    and rank.
+    """
+    by_document = {}
+    for rank, chunk in enumerate(chunks):
+        by_document.setdefault(chunk.document_id, []).append((chunk.chunk_index, rank, chunk))
+
+    passages = []
+    for hits in by_document.values():
+        hits.sort(key=lambda hit: hit[0])
+        run = [hits[0]]
+        for hit in hits[1:]:
+            if hit[0] == run[-1][0] + 1:
+                run.append(hit)
+                continue
+            passages.append(_passage(run))
+            run = [hit]
+        passages.append(_passage(run))
+    return sorted(passages, key=lambda passage: passage["rank"])
+
+
+def _passage(run) -> dict:
+    text = run[0][2].chunk_text
+    for _, _, chunk in run[1:]:
+        text = merge_overlap(text, chunk.chunk_text)
+    return {
+        "item_name": run[0][2].item_name,
+        "text": text,
+        "chunk_ids": [chunk.id for _, _, chunk in run],
+        "rank": min(rank for _, rank, _ in run),
+    }
+
+
+def build_context(chunks, token_budget: int) -> dict:
+    """
+    Returns {"context", "chunk_ids", "sources", "stats"} for the ranked
+    chunks. Passages that don't fit the remaining budget are skipped (a
+    smaller, less relevant one may still fit); the best passage is always
+    kept so a tight budget never yields an empty prompt.
+    """
+    verbatim_tokens = sum(
+        count_tokens(format_passage(chunk.item_name, chunk.chunk_text)) for chunk in chunks
+    )
+
+    parts = []
+    chunk_ids = []
+    sources = []
+    used_tokens = 0
+    dropped = 0
+    for passage in merge_runs(chunks):
+        block = format_passage(passage["item_name"], passage["text"])
+        tokens = count_tokens(block)
+        if parts and used_tokens + tokens > token_budget:
+            dropped += 1
+            continue
+        parts.append(block)
+        chunk_ids.extend(passage["chunk_ids"])
+        sources.append(passage["item_name"])
+        used_tokens += tokens
+
+    stats = {
+        "chunks_retrieved": len(chunks),
+        "chunks_used": len(chunk_ids),
+        "passages": len(parts),
+        "passages_dropped": dropped,
+        "tokens_verbatim": verbatim_tokens,
+        "tokens_used": used_tokens,
+        "tokens_saved": verbatim_tokens - used_tokens,
+    }
+    _record(stats)
+    return {"context": "".join(parts), "chunk_ids": chunk_ids, "sources": sources, "stats": stats}
+
+
+def _record(stats: dict):
+    with _stats_lock:
+        _totals["prompts"] += 1
+        for key in ("chunks_retrieved", "chunks_used", "passages_dropped", "tokens_verbatim", "tokens_used"):
+            _totals[key] += stats[key]
+
+
+def context_stats() -> dict:
+    with _stats_lock:
+        totals = dict(_totals)
+    totals["tokens_saved"] = totals["tokens_verbatim"] - totals["tokens_used"]
+    totals["saved_ratio"] = round(totals["tokens_saved"] / totals["tokens_verbatim"], 4) if totals["tokens_verbatim"] else 0.0
+    return totals
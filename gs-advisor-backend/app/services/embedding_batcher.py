@@ -0,0 +1,73 @@
+"""
+Micro-batching for query embeddings.
+
+Under load many chat requests need a query embedded at the same moment.
+One MiniLM forward pass over 16 short queries costs little more than one
+over a single query, while 16 separate passes compete for the same cores.
+So while a batch is running, new callers are queued for up to
+query_embedding_batch_wait_ms, or until query_embedding_batch_max are
+waiting. The batch then runs as one embed_documents call on the embedding
+executor, and each caller gets its own vector. A query arriving when no
+batch is running starts right away, so a quiet pod pays no extra latency.
+Padding is masked out of MiniLM's mean pooling, so a batched vector
+matches the single-query one up to float rounding.
+
+Batch sizes and per-query queueing time are exported on /metrics.
+"""
+import asyncio
+import time
+from app.core.metrics import QUERY_EMBEDDING_BATCH_SIZE, QUERY_EMBEDDING_WAIT_SECONDS
+from app.services.embeddings import embed_documents
+
+
+class QueryEmbeddingBatcher:
+    """Lives on the event loop; only the forward pass runs on the executor."""
+
+    def __init__(self, executor, max_batch: int, max_wait_ms: float):
+        self.executor = executor
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._pending = []
+        self._timer = None
+        self._running = 0
+
+    async def embed(self, text: str):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        if self._running == 0 or len(self._pending) >= self.max_batch or self.max_wait == 0:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            # Cancelled callers (client went away) don't need a vector
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+            now = time.perf_counter()
+            for _, _, queued_at in batch:
+                QUERY_EMBEDDING_WAIT_SECONDS.observe(now - queued_at)
+            # The same question asked twice in one window is embedded once
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            QUERY_EMBEDDING_BATCH_SIZE.observe(len(texts))
+            self._running += 1
+            run = asyncio.get_running_loop().run_in_executor(self.executor, embed_documents, texts)
+            run.add_done_callback(lambda run, batch=batch, texts=texts: self._deliver(run, batch, texts))
+
+    def _deliver(self, run, batch, texts):
+        self._running -= 1
+        error = run.exception()
+        vectors = None if error is not None else dict(zip(texts, run.result()))
+        for text, future, _ in batch:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(vectors[text])
@@ -0,0 +1,119 @@
+"""
+Shared MiniLM embedding provider.
+
+The model is loaded once per process, on first use (or by warm_up() at
+startup), and shared by ingestion and the query path. Two backends:
+
+- "torch": the reference sentence-transformers model.
+- "onnx": the same model exported to ONNX with int8 weights, run by
+  onnxruntime. Roughly half the resident memory and a faster CPU forward
+  pass. Its output must stay interchangeable with the vectors already stored
+  in chunks.embedding, so whenever it is loaded (warm_up() at startup, or
+  the first embedding in an ingestion worker or script) it is checked
+  against the reference model on a fixed set of sentences, and torch is
+  used instead if they drift apart.
+
+Run `python -m app.services.embeddings` to print the parity report.
+"""
+import gc
+import threading
+import numpy as np
+from langchain_huggingface import HuggingFaceEmbeddings
+from app.core.config import settings
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Short, filing-like sentences: what the parity check compares on
+PARITY_SENTENCES = [
+    "What are the main risk factors for the company?",
+    "Net revenue increased 12% year over year, driven by higher advisory fees.",
+    "The company is exposed to interest rate risk on its variable-rate debt.",
+    "Item 7. Management's Discussion and Analysis of Financial Condition and Results of Operations",
+    "We depend on a limited number of suppliers for key components.",
+    "Summarize the business segments and their contribution to operating income.",
+]
+
+_model = None
+_backend = None
+_parity = None
+_lock = threading.Lock()
+
+
+def _load(backend: str):
+    if backend == "onnx":
+        return HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL_NAME,
+            model_kwargs={
+                "backend": "onnx",
+                "model_kwargs": {"file_name": settings.embedding_onnx_file},
+            }
+        )
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+def check_parity(candidate, reference) -> dict:
+    """Cosine similarity between the two models' vectors for PARITY_SENTENCES."""
+    a = np.asarray(candidate.embed_documents(PARITY_SENTENCES), dtype=np.float32)
+    b = np.asarray(reference.embed_documents(PARITY_SENTENCES), dtype=np.float32)
+    cosines = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {
+        "min_cosine": round(float(cosines.min()), 6),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "threshold": settings.embedding_parity_min_cosine,
+        "passed": bool(cosines.min() >= settings.embedding_parity_min_cosine),
+    }
+
+
+def _load_configured():
+    """
+    (model, backend, parity report) for the configured backend. An ONNX model
+    is only returned once it passed the parity check; the reference model is
+    only held for the duration of the check.
+    """
+    backend = settings.embedding_backend
+    model = _load(backend)
+    if backend != "onnx" or not settings.embedding_parity_check:
+        return model, backend, None
+    reference = _load("torch")
+    report = check_parity(model, reference)
+    print(f"Embedding parity (onnx vs torch): {report}")
+    if report["passed"]:
+        del reference
+    else:
+        print("WARNING: ONNX embeddings drifted from the reference model, falling back to torch")
+        model, backend = reference, "torch"
+    gc.collect()
+    return model, backend, report
+
+
+def get_embeddings_model():
+    """The process-wide embedding model, loaded on first call (thread-safe)."""
+    global _model, _backend, _parity
+    if _model is None:
+        with _lock:
+            if _model is None:
+                _model, _backend, _parity = _load_configured()
+                print(f"Embedding model loaded ({EMBEDDING_MODEL_NAME}, backend={_backend})")
+    return _model
+
+
+def embed_query(text: str):
+    return get_embeddings_model().embed_query(text)
+
+
+def embed_documents(texts):
+    return get_embeddings_model().embed_documents(texts)
+
+
+def warm_up():
+    """
+    Loads the model (running the ONNX parity check) and runs one forward
+    pass, so the first request doesn't pay for either.
+    """
+    get_embeddings_model().embed_query("warm up")
+    return {"model": EMBEDDING_MODEL_NAME, "backend": _backend, "parity": _parity}
+
+
+if __name__ == "__main__":
+    reference = _load("torch")
+    print(check_parity(_load("onnx"), reference))
@@ -0,0 +1,312 @@
+"""
+The raw SEC filings (HTM plus their images and CSS) behind /static-filings.
+
+The directory is scanned into an in-memory manifest at startup and rescanned
+when one of its directories' mtime changes (checked every
+filings_refresh_seconds), so requests never stat the disk to find a file.
+Files are expected to be added or replaced, not edited in place.
+
+Text assets are compressed once with gzip (and brotli, when the package is
+installed) into filings_cache_dir, named after the file's sha256. The hash
+doubles as the strong ETag. A file is served uncompressed until its
+compressed copies exist.
+
+section_excerpt() cuts a single "Item N" section out of a filing, so the UI
+can show the part of a 10-K a chat answer cited instead of the whole file.
+"""
+import asyncio
+import bisect
+import gzip
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from mimetypes import guess_type
+from pathlib import Path
+from app.core.config import settings
+from app.services.filings import ITEM_MAPPINGS
+
+try:
+    import brotli
+except ImportError: # gzip only
+    brotli = None
+
+# Path: gs-advisor-backend/app/services/filing_assets.py -> repository root
+DEFAULT_FILINGS_DIR = os.path.join(Path(__file__).resolve().parents[3], "10K-data", "raw")
+
+COMPRESSIBLE_EXTENSIONS = {".htm", ".html", ".css", ".js", ".txt", ".xml", ".svg"}
+# Preferred first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Every 10-K item heading; a section ends where another one starts
+ITEM_SEQUENCE = [
+    "1", "1A", "1B", "1C", "2", "3", "4", "5", "6", "7", "7A", "8",
+    "9", "9A", "9B", "9C", "10", "11", "12", "13", "14", "15", "16",
+]
+# "Item 1A", "ITEM&#160;1A.", "Item <b>1A</b>" ... but not "Item 10" for "1"
+_HEADING_GAP = r"(?:\s|&#160;|&#xa0;|&nbsp;|<[^>]*>)*"
+_BLOCK_OPEN = re.compile(r"<(?:div|p|table|tr|h[1-6])\b", re.IGNORECASE)
+# Tags and whitespace directly before a match, and the block tags that make it a heading
+_LEADING_MARKUP = re.compile(r"(?:\s|&#160;|&#xa0;|&nbsp;|<[^>]*>)*$", re.IGNORECASE)
+_BLOCK_TAG = re.compile(r"</?(?:div|p|br|td|th|tr|table|li|h[1-6])\b", re.IGNORECASE)
+EXCERPT_CACHE_SIZE = 64
+
+
+def _heading_pattern(numbers):
+    alternatives = "|".join(re.escape(number) for number in numbers)
+    return re.compile(rf"item{_HEADING_GAP}(?:{alternatives})(?![0-9a-z])", re.IGNORECASE)
+
+
+def resolve_item(value: str):
+    """
+    Item number ("1A") for an item code ("item_1A"), a section name as sent
+    in chat sources ("Risk Factors") or a bare number. None if unknown.
+    """
+    names = {name.lower(): code for code, name in ITEM_MAPPINGS.items()}
+    value = names.get(value.strip().lower(), value.strip())
+    number = re.sub(r"^item_?", "", value, flags=re.IGNORECASE).upper()
+    return number if number in ITEM_SEQUENCE else None
+
+
+def _block_start(html: str, position: int) -> int:
+    # Back up to the enclosing block so the excerpt doesn't start mid-element
+    window = max(0, position - 2000)
+    starts = [match.start() for match in _BLOCK_OPEN.finditer(html, window, position)]
+    return starts[-1] if starts else position
+
+
+def _heading_positions(html: str, numbers):
+    """
+    Where "Item N" starts a block (a heading or a table of contents row)
+    rather than running text ("... see Item 7 ..."). Falls back to every
+    match for filings formatted in ways this doesn't recognize.
+    """
+    matches = [match.start() for match in _heading_pattern(numbers).finditer(html)]
+    headings = [
+        position for position in matches
+        if _BLOCK_TAG.search(_LEADING_MARKUP.search(html, max(0, position - 500), position).group())
+    ]
+    return headings or matches
+
+
+def find_section(html: str, number: str):
+    """
+    (start, end) of the section in the filing's HTML, or None. A section
+    runs to the next heading of any other item. Headings also appear in the
+    table of contents, so the occurrence followed by the most text is taken
+    as the section itself.
+    """
+    starts = _heading_positions(html, [number])
+    if not starts:
+        return None
+    ends = _heading_positions(html, [other for other in ITEM_SEQUENCE if other != number])
+
+    best = None
+    for start in starts:
+        index = bisect.bisect_right(ends, start)
+        end = ends[index] if index < len(ends) else len(html)
+        if best is None or end - start > best[1] - best[0]:
+            best = (start, end)
+    start, end = best
+    return _block_start(html, start), (_block_start(html, end) if end < len(html) else end)
+
+
+def _decode(raw: bytes) -> str:
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        # EDGAR filings predating UTF-8 are mostly windows-1252
+        return raw.decode("cp1252", errors="replace")
+
+
+@lru_cache(maxsize=EXCERPT_CACHE_SIZE)
+def _excerpt(path: str, sha256: str, number: str, base_href: str):
+    # sha256 is part of the key so a replaced file never serves a stale excerpt
+    with open(path, "rb") as f:
+        html = _decode(f.read())
+    bounds = find_section(html, number)
+    if bounds is None:
+        return None
+    document = (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<base href="{base_href}"></head><body>{html[bounds[0]:bounds[1]]}</body></html>'
+    ).encode("utf-8")
+    return document, gzip.compress(document, compresslevel=6)
+
+
+class FilingAssets:
+    """
+    Manifest entries are dicts: path, stat (os.stat_result, handed to
+    FileResponse so it doesn't stat again), media_type, compressible,
+    sha256 (filled on first use) and variants ({encoding: (path, stat)}).
+    """
+
+    def __init__(self, directory: str, cache_dir: str):
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self.manifest = {}
+        self._dir_mtimes = {}
+        self._lock = threading.Lock()
+        self._queued = set()
+        # One thread: compression is a background chore, not worth competing with requests
+        self._compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="filing-compress")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def scan(self) -> int:
+        """Rebuilds the manifest; hashes and compressed copies of unchanged files are kept."""
+        manifest = {}
+        dir_mtimes = {}
+        if os.path.isdir(self.directory):
+            for dirpath, _, filenames in os.walk(self.directory):
+                dir_mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    stat = os.stat(path)
+                    relpath = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                    previous = self.manifest.get(relpath)
+                    if previous is not None and (previous["stat"].st_size, previous["stat"].st_mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                        manifest[relpath] = previous
+                        continue
+                    manifest[relpath] = {
+                        "path": path,
+                        "stat": stat,
+                        "media_type": guess_type(filename)[0] or "application/octet-stream",
+                        "compressible": os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS,
+                        "sha256": None,
+                        "variants": {},
+                    }
+        with self._lock:
+            self.manifest = manifest
+            self._dir_mtimes = dir_mtimes
+        return len(manifest)
+
+    def changed(self) -> bool:
+        if not self._dir_mtimes:
+            return os.path.isdir(self.directory)
+        for dirpath, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(dirpath).st_mtime_ns != mtime:
+                    return True
+            except FileNotFoundError:
+                return True
+        return False
+
+    def refresh(self) -> bool:
+        if not self.changed():
+            return False
+        self.scan()
+        if settings.filings_precompress:
+            self.precompress_all()
+        return True
+
+    def get(self, relpath: str):
+        # Only scanned files are keys, so "../" and the like can never match
+        return self.manifest.get(relpath)
+
+    def digest(self, entry: dict) -> str:
+        if entry["sha256"] is None:
+            sha = hashlib.sha256()
+            with open(entry["path"], "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(block)
+            entry["sha256"] = sha.hexdigest()
+        return entry["sha256"]
+
+    def _compress(self, entry: dict):
+        sha = self.digest(entry)
+        data = None
+        for encoding in ENCODINGS:
+            target = os.path.join(self.cache_dir, sha + ENCODING_SUFFIXES[encoding])
+            if not os.path.exists(target):
+                if data is None:
+                    with open(entry["path"], "rb") as f:
+                        data = f.read()
+                compressed = brotli.compress(data, quality=11) if encoding == "br" else gzip.compress(data, compresslevel=9)
+                tmp_path = f"{target}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(compressed)
+                os.replace(tmp_path, target)
+            entry["variants"][encoding] = (target, os.stat(target))
+
+    def schedule_compression(self, entry: dict):
+        if not entry["compressible"] or len(entry["variants"]) == len(ENCODINGS):
+            return
+        with self._lock:
+            if entry["path"] in self._queued:
+                return
+            self._queued.add(entry["path"])
+
+        def run():
+            try:
+                self._compress(entry)
+            except Exception as e:
+                print(f"Compressing {entry['path']} failed: {str(e)}")
+            finally:
+                with self._lock:
+                    self._queued.discard(entry["path"])
+
+        self._compressor.submit(run)
+
+    def precompress_all(self):
+        for entry in list(self.manifest.values()):
+            self.schedule_compression(entry)
+
+    def section_excerpt(self, relpath: str, entry: dict, number: str):
+        """(html bytes, gzipped bytes) of one item of a filing, or None if not found."""
+        base_href = "/static-filings/" + (relpath.rsplit("/", 1)[0] + "/" if "/" in relpath else "")
+        return _excerpt(entry["path"], self.digest(entry), number, base_href)
+
+    def shutdown(self):
+        self._compressor.shutdown(wait=False, cancel_futures=True)
+
+
+def select_encoding(accept_encoding: str, variants: dict):
+    """Best precompressed variant the client accepts, or None for identity."""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    for encoding in ENCODINGS:
+        if encoding in variants and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+
+@lru_cache
+def get_filing_assets() -> FilingAssets:
+    assets = FilingAssets(settings.filings_dir or DEFAULT_FILINGS_DIR, settings.filings_cache_dir)
+    count = assets.scan()
+    print(f"Filing assets: {count} files under {assets.directory}")
+    if settings.filings_precompress:
+        assets.precompress_all()
+    return assets
+
+
+async def run_periodic_refresh(interval: int):
+    """Picks up filings added to (or removed from) the directory while running."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await asyncio.to_thread(get_filing_assets().refresh):
+                print(f"Filing assets: manifest refreshed ({len(get_filing_assets().manifest)} files)")
+        except Exception as e:
+            print(f"Filing assets refresh failed: {str(e)}")
+
+
+def shutdown_filing_assets():
+    if get_filing_assets.cache_info().currsize:
+        get_filing_assets().shutdown()
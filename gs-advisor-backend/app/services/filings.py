@@ -0,0 +1,115 @@
+import hashlib
+import json
+from datetime import datetime
+import ijson
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from app.services.tokens import count_tokens
+
+# Mapping JSON keys to human-readable Section Names
+ITEM_MAPPINGS = {
+    "item_1": "Business",
+    "item_1A": "Risk Factors",
+    "item_7": "Management's Discussion and Analysis"
+}
+
+# ~2000 chars is roughly 500 tokens
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 200
+
+
+def build_text_splitter():
+    """
+    Returns the splitter used for every 10-K section. Kept in one place so the
+    API ingestion path and the batch pipeline always produce identical chunks.
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+
+
+def load_filing(file_path: str) -> dict:
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _top_level_items(file_path: str):
+    # One (key, value) at a time; a value is only built when its turn comes
+    with open(file_path, "rb") as f:
+        yield from ijson.kvitems(f, "", use_float=True)
+
+
+def scan_filing(file_path: str):
+    """
+    First of two streaming passes over a 10-K JSON: returns (metadata, item
+    codes of the non-empty sections). metadata is every top-level field but
+    the item_* sections, whose text is dropped as soon as it is parsed.
+    """
+    metadata = {}
+    item_codes = []
+    for key, value in _top_level_items(file_path):
+        if not key.startswith("item_"):
+            metadata[key] = value
+        elif key in ITEM_MAPPINGS and isinstance(value, str) and value.strip():
+            item_codes.append(key)
+    return metadata, item_codes
+
+
+def iter_filing_sections(file_path: str):
+    """
+    Second pass: iter_sections for a file, holding only the current section
+    in memory. Sections come in file order.
+    """
+    for key, value in _top_level_items(file_path):
+        if key in ITEM_MAPPINGS and isinstance(value, str) and value.strip():
+            yield key, ITEM_MAPPINGS[key], value
+
+
+def resolve_company_name(data: dict) -> str:
+    # Resolve company name using the 'company' key from the extracted JSON format
+    return data.get("company") or data.get("name") or "Unknown Company"
+
+
+def parse_filing_dates(data: dict):
+    """
+    Returns (filing_date, period_of_report) with safety fallbacks.
+    """
+    try:
+        f_date = datetime.strptime(data.get("filing_date", "2023-01-01"), "%Y-%m-%d")
+        p_date = datetime.strptime(data.get("period_of_report", "2022-12-31"), "%Y-%m-%d")
+    except (ValueError, TypeError):
+        f_date = datetime(2023, 1, 1)
+        p_date = datetime(2022, 12, 31)
+    return f_date, p_date
+
+
+def iter_sections(data: dict):
+    """
+    Yields (item_code, item_name, raw_text) for every non-empty section
+    defined in ITEM_MAPPINGS.
+    """
+    for item_code, item_name in ITEM_MAPPINGS.items():
+        raw_text = data.get(item_code)
+        if raw_text and len(raw_text.strip()) > 0:
+            yield item_code, item_name, raw_text
+
+
+def iter_chunk_batches(text_splitter, raw_text: str, batch_size: int):
+    """
+    Yields (index of the first chunk, chunk texts) for a section, batch_size
+    chunks at a time. The splitter returns the section's chunks as one list;
+    everything derived from them (hashes, embeddings, rows) only ever exists
+    for the current batch.
+    """
+    chunks = text_splitter.split_text(raw_text)
+    for start in range(0, len(chunks), batch_size):
+        yield start, chunks[start:start + batch_size]
+
+
+def estimate_token_count(text: str) -> int:
+    # Real BPE count when tiktoken is installed (see tokens.py)
+    return count_tokens(text)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,65 @@
+"""
+Persistent cache for summary / risk note / email generations.
+
+Generations run at temperature 0 over fixed 10-K sections, so the output is a
+function of (company, mode, source documents, prompt). The key captures all
+four: source documents through their content hashes and the prompt through a
+hash of the prompt text and model name. Re-ingesting changed sections or
+editing a prompt therefore misses the cache automatically.
+"""
+import hashlib
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.domain import GenerationCache
+
+
+def compute_source_hash(doc_rows) -> str:
+    """doc_rows: rows with item_code and content_hash (order-insensitive)."""
+    parts = sorted(f"{row.item_code}:{row.content_hash}" for row in doc_rows)
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def compute_prompt_version(model_name: str, *prompt_parts: str) -> str:
+    payload = "\x1f".join((model_name,) + prompt_parts)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+async def get_cached_generation(db: AsyncSession, company_id: int, mode: str, source_hash: str,
+                                prompt_version: str):
+    return await db.scalar(
+        select(GenerationCache).filter(
+            GenerationCache.company_id == company_id,
+            GenerationCache.mode == mode,
+            GenerationCache.source_hash == source_hash,
+            GenerationCache.prompt_version == prompt_version
+        ).limit(1)
+    )
+
+
+async def store_generation(db: AsyncSession, company_id: int, mode: str, source_hash: str,
+                           prompt_version: str, content: str, sources):
+    """
+    Adds the entry to the session's transaction (caller commits) and drops
+    entries for the same company/mode that older documents or prompts produced.
+    Concurrent identical generations are harmless: the loser's insert is ignored.
+    """
+    await db.execute(
+        delete(GenerationCache).filter(
+            GenerationCache.company_id == company_id,
+            GenerationCache.mode == mode,
+            (GenerationCache.source_hash != source_hash) | (GenerationCache.prompt_version != prompt_version)
+        )
+    )
+    await db.execute(
+        insert(GenerationCache)
+        .values(
+            company_id=company_id,
+            mode=mode,
+            source_hash=source_hash,
+            prompt_version=prompt_version,
+            content=content,
+            sources=list(sources)
+        )
+        .on_conflict_do_nothing(constraint="uq_generation_cache_key")
+    )
@@ -1,50 +1,38 @@
-import json
-import os
-from datetime import datetime
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
+from app.core.config import settings
+from app.core.database import check_embedding_storage
+from app.core.metrics import stage_timer
 from app.models.domain import Company, Document, Chunk
+from app.services.filings import (
+    build_text_splitter,
+    content_hash,
+    estimate_token_count,
+    iter_chunk_batches,
+    iter_filing_sections,
+    parse_filing_dates,
+    resolve_company_name,
+    scan_filing,
+)
+# Local embeddings (CPU-based, no API limits), 384-dimensional vectors
+from app.services.embeddings import embed_documents
+from app.services.vector_store import embedding_attribute, embedding_column, embedding_values
 
-# Initialize Local Embeddings (CPU-based, no API limits)
-# This model produces 384-dimensional vectors
-embeddings_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
 
-# Mapping JSON keys to human-readable Section Names
-ITEM_MAPPINGS = {
-    "item_1": "Business",
-    "item_1A": "Risk Factors",
-    "item_7": "Management's Discussion and Analysis"
-}
-
-def ingest_10k_json(file_path: str, db: Session):
+def get_or_create_company(db: Session, data: dict):
     """
-    Parses an SEC 10-K JSON, creates/updates company records, 
-    and generates local embeddings for text chunks.
+    Resolves the Company for a parsed 10-K JSON by CIK, creating it on first
+    sight and repairing 'Unknown Company' names. Returns None if there is no CIK.
     """
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     cik = data.get("cik")
     if not cik:
-        print(f"Skipping {file_path}: No CIK found.")
-        return
-
-    # Resolve company name using the 'company' key from your specific JSON format
-    resolved_name = data.get("company") or data.get("name") or "Unknown Company"
+        return None
 
-    # 1. Create or Get Company
+    resolved_name = resolve_company_name(data)
     company = db.query(Company).filter(Company.cik == cik).first()
-    
-    if not company:
-        # Date parsing with safety fallbacks
-        try:
-            f_date = datetime.strptime(data.get("filing_date", "2023-01-01"), "%Y-%m-%d")
-            p_date = datetime.strptime(data.get("period_of_report", "2022-12-31"), "%Y-%m-%d")
-        except (ValueError, TypeError):
-            f_date = datetime(2023, 1, 1)
-            p_date = datetime(2022, 12, 31)
 
+    if not company:
+        f_date, p_date = parse_filing_dates(data)
         company = Company(
             cik=cik,
             name=resolved_name,
@@ -62,50 +50,221 @@ def ingest_10k_json(file_path: str, db: Session):
         db.commit()
         db.refresh(company)
 
-    # Configure Text Splitter (~2000 chars is roughly 500 tokens)
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=2000, 
-        chunk_overlap=200
+    return company
+
+
+def find_existing_section(db: Session, company_id: int, item_code: str, section_hash: str):
+    """
+    Compares a section against what is already stored for the company.
+    Returns (unchanged_doc_id, stale_doc_ids): unchanged_doc_id is set when an
+    identical section exists; stale_doc_ids are the rows the new text replaces
+    (or duplicates left behind by older, non-idempotent ingestions).
+    """
+    rows = db.query(Document.id, Document.content_hash).filter(
+        Document.company_id == company_id,
+        Document.item_code == item_code
+    ).order_by(Document.id).all()
+
+    unchanged_id = next((row.id for row in rows if row.content_hash == section_hash), None)
+    stale_ids = [row.id for row in rows if row.id != unchanged_id]
+    return unchanged_id, stale_ids
+
+
+def reusable_embeddings(db: Session, document_ids, chunk_hashes=None) -> dict:
+    """
+    Maps chunk content hash -> embedding for the chunks of the given documents,
+    so re-chunked text that did not change is never sent through the model again.
+    Rows ingested before hashes existed are hashed from their text on the fly.
+    chunk_hashes, if given, limits the lookup to those chunks.
+    """
+    if not document_ids:
+        return {}
+    query = db.query(Chunk.content_hash, Chunk.chunk_text, embedding_column().label("embedding")).filter(
+        Chunk.document_id.in_(document_ids)
     )
+    if chunk_hashes is not None:
+        query = query.filter(or_(Chunk.content_hash.in_(list(chunk_hashes)), Chunk.content_hash.is_(None)))
+    rows = query.all()
+    return {
+        (row.content_hash or content_hash(row.chunk_text)): embedding_values(row.embedding)
+        for row in rows if row.embedding is not None
+    }
+
+
+def delete_documents(db: Session, document_ids):
+    if not document_ids:
+        return
+    db.query(Chunk).filter(Chunk.document_id.in_(document_ids)).delete(synchronize_session=False)
+    db.query(Document).filter(Document.id.in_(document_ids)).delete(synchronize_session=False)
+
+
+def delete_dropped_sections(db: Session, company_id: int, item_codes) -> int:
+    """
+    Deletes the company's documents whose item is not in item_codes, i.e.
+    sections the latest filing no longer has. Returns how many were deleted.
+    """
+    if not item_codes:
+        # Nothing parsed from the filing: keep what is stored rather than wipe the company
+        return 0
+    dropped_ids = [
+        doc_id for (doc_id,) in db.query(Document.id).filter(
+            Document.company_id == company_id, Document.item_code.notin_(list(item_codes))
+        )
+    ]
+    delete_documents(db, dropped_ids)
+    return len(dropped_ids)
+
+
+def embed_missing(chunks, chunk_hashes, cached: dict):
+    """
+    Returns (embeddings, embedded_count). Only chunks whose hash is not in
+    `cached` are embedded; identical chunks within the batch are embedded once.
+    """
+    to_embed = list(dict.fromkeys(
+        (h, text) for h, text in zip(chunk_hashes, chunks) if h not in cached
+    ))
+    if to_embed:
+        # This happens on your CPU/GPU and avoids Google API Quotas
+        vectors = embed_documents([text for _, text in to_embed])
+        cached = {**cached, **{h: v for (h, _), v in zip(to_embed, vectors)}}
+    return [cached[h] for h in chunk_hashes], len(to_embed)
 
-    # 2. Process Sections (Items) defined in ITEM_MAPPINGS
-    for item_code, item_name in ITEM_MAPPINGS.items():
-        raw_text = data.get(item_code)
-        
-        if raw_text and len(raw_text.strip()) > 0:
-            # Create Document entry for the section
+
+def new_ingestion_report(company) -> dict:
+    return {
+        "company_id": company.id,
+        "cik": company.cik,
+        "sections_reused": 0,
+        "sections_replaced": 0,
+        "sections_added": 0,
+        "sections_removed": 0,
+        "chunks_reused": 0,
+        "chunks_embedded": 0,
+        "timings": {},
+    }
+
+
+def write_chunk_batch(db: Session, document_id: int, company_id: int, first_index: int, chunks, stale_ids, timings: dict) -> int:
+    """
+    Embeds (reusing what the stale documents already have) and inserts one
+    batch of a section's chunks. Returns how many were embedded.
+    """
+    chunk_hashes = [content_hash(chunk_text) for chunk_text in chunks]
+    with stage_timer("ingest_embed", timings):
+        cached = reusable_embeddings(db, stale_ids, chunk_hashes)
+        embeddings, embedded_count = embed_missing(chunks, chunk_hashes, cached)
+
+    with stage_timer("ingest_insert", timings):
+        embedding_key = embedding_attribute()
+        db.bulk_save_objects([
+            Chunk(
+                document_id=document_id,
+                company_id=company_id,
+                chunk_index=first_index + i,
+                chunk_text=chunk_text,
+                content_hash=chunk_hashes[i],
+                token_count=estimate_token_count(chunk_text),
+                # List of 384 floats, in whichever column embedding_storage uses
+                **{embedding_key: embeddings[i]}
+            )
+            for i, chunk_text in enumerate(chunks)
+        ])
+    return embedded_count
+
+
+def ingest_10k_json(file_path: str, db: Session, progress=None):
+    """
+    Parses an SEC 10-K JSON, creates/updates company records,
+    and generates local embeddings for text chunks.
+
+    Idempotent: sections whose content hash is unchanged are skipped, changed
+    sections replace the previous rows, and embeddings are reused for any chunk
+    whose text was already embedded. Returns a report of reused vs recomputed work,
+    with seconds spent per stage under "timings" (ingest_chunk, ingest_embed,
+    ingest_insert). progress, if given, is called after every section with the
+    report so far plus sections_done / sections_total.
+
+    The file is streamed twice (metadata, then one section at a time) and each
+    section is embedded and inserted ingest_batch_size chunks at a time, so
+    memory grows with the largest section, not with the filing.
+    """
+    # Job worker processes never ran init_db: check the server here, before
+    # any chunk is written to a column it may not have
+    check_embedding_storage(db)
+    data, item_codes = scan_filing(file_path)
+
+    # 1. Create or Get Company
+    company = get_or_create_company(db, data)
+    if company is None:
+        print(f"Skipping {file_path}: No CIK found.")
+        return None
+
+    report = new_ingestion_report(company)
+    timings = report["timings"]
+    text_splitter = build_text_splitter()
+    batch_size = max(1, settings.ingest_batch_size)
+
+    def report_progress(sections_done):
+        if progress is not None:
+            progress({**report, "sections_done": sections_done, "sections_total": len(item_codes)})
+
+    report_progress(0)
+
+    # 2. Process the filing's sections (items of filings.ITEM_MAPPINGS)
+    seen_codes = set()
+    for section_number, (item_code, item_name, raw_text) in enumerate(iter_filing_sections(file_path), start=1):
+        seen_codes.add(item_code)
+        section_hash = content_hash(raw_text)
+        unchanged_id, stale_ids = find_existing_section(db, company.id, item_code, section_hash)
+
+        if unchanged_id is not None:
+            # Same text already stored: only clean up leftover duplicates
+            delete_documents(db, stale_ids)
+            db.commit()
+            report["sections_reused"] += 1
+            report_progress(section_number)
+            continue
+
+        report["sections_replaced" if stale_ids else "sections_added"] += 1
+        with stage_timer("ingest_insert", timings):
             doc = Document(
                 company_id=company.id,
                 item_code=item_code,
                 item_name=item_name,
-                raw_text=raw_text
+                raw_text=raw_text,
+                content_hash=section_hash
             )
             db.add(doc)
+            db.flush()
+
+        # 3-5. Chunk, embed (reusing unchanged chunks) and insert, one batch at a time
+        batches = iter_chunk_batches(text_splitter, raw_text, batch_size)
+        while True:
+            with stage_timer("ingest_chunk", timings):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            first_index, chunks = batch
+            embedded_count = write_chunk_batch(db, doc.id, company.id, first_index, chunks, stale_ids, timings)
+            report["chunks_embedded"] += embedded_count
+            report["chunks_reused"] += len(chunks) - embedded_count
+
+        # Swap the old section for the new one: both happen in this one transaction
+        with stage_timer("ingest_insert", timings):
+            delete_documents(db, stale_ids)
             db.commit()
-            db.refresh(doc)
-
-            # 3. Chunking the section text
-            chunks = text_splitter.split_text(raw_text)
-            
-            # 4. Generate Local Embeddings in batch
-            # This happens on your CPU/GPU and avoids Google API Quotas
-            embeddings = embeddings_model.embed_documents(chunks)
-
-            # 5. Prepare Chunk objects for Bulk Insertion
-            db_chunks = []
-            for i, chunk_text in enumerate(chunks):
-                db_chunks.append(
-                    Chunk(
-                        document_id=doc.id,
-                        chunk_index=i,
-                        chunk_text=chunk_text,
-                        embedding=embeddings[i], # List of 384 floats
-                        token_count=len(chunk_text) // 4 
-                    )
-                )
-            
-            # Efficiently save all chunks for this document at once
-            db.bulk_save_objects(db_chunks)
-            db.commit()
+        report_progress(section_number)
 
-    print(f"Successfully ingested {company.name} (CIK: {cik})")
\ No newline at end of file
+    # 6. Sections an earlier filing had but this one dropped would otherwise keep being retrieved
+    with stage_timer("ingest_insert", timings):
+        report["sections_removed"] = delete_dropped_sections(db, company.id, seen_codes)
+        db.commit()
+
+    print(
+        f"Successfully ingested {company.name} (CIK: {company.cik}): "
+        f"{report['sections_reused']} sections unchanged, "
+        f"{report['sections_replaced']} replaced, {report['sections_added']} added, "
+        f"{report['sections_removed']} removed; "
+        f"{report['chunks_reused']} chunk embeddings reused, {report['chunks_embedded']} computed"
+    )
+    return report
@@ -0,0 +1,435 @@
+"""
+Pipelined batch ingestion.
+
+Stages:
+  1. A process pool parses the 10-K JSON files and chunks their sections.
+     Only a small window of files is in flight at once, and the next file
+     is submitted as each one finishes, so memory stays bounded
+     by the window and the queues, not by the size of the corpus.
+  2. A dedicated embedding thread batches chunks across files, so the model
+     always runs on full batches instead of one small section at a time.
+  3. A writer thread inserts Documents through the ORM and loads Chunks with
+     Postgres COPY, then records the file in the manifest.
+
+Before a file is embedded, its section and chunk hashes are compared with what
+is already stored, so unchanged sections are skipped and unchanged chunks keep
+their existing embeddings (same rules as ingest_10k_json).
+
+The manifest stores the SHA-256 of every file that was fully committed, so an
+interrupted run resumes where it stopped and unchanged files are skipped.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from app.services.filings import (
+    build_text_splitter,
+    content_hash,
+    estimate_token_count,
+    iter_sections,
+    load_filing,
+)
+
+DEFAULT_EMBED_BATCH_SIZE = 256
+REPORT_KEYS = ("sections_reused", "sections_replaced", "sections_added", "sections_removed", "chunks_reused", "chunks_embedded")
+_DONE = object()
+
+# One splitter per worker process, built lazily on first use
+_worker_splitter = None
+
+
+def file_checksum(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestionManifest:
+    """
+    JSON file mapping checksum -> details of a completed file. Written
+    atomically after every commit so a crash never leaves it half-written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def is_done(self, checksum: str) -> bool:
+        return checksum in self.entries
+
+    def mark_done(self, checksum: str, filename: str, cik: str):
+        with self._lock:
+            self.entries[checksum] = {
+                "filename": filename,
+                "cik": cik,
+                "completed_at": datetime.utcnow().isoformat(),
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def parse_and_chunk(file_path: str, checksum: str) -> dict:
+    """
+    Worker-process stage: parse one JSON file and split its sections.
+    Returns plain data so it can be pickled back to the parent.
+    """
+    global _worker_splitter
+    if _worker_splitter is None:
+        _worker_splitter = build_text_splitter()
+
+    data = load_filing(file_path)
+    sections = []
+    for item_code, item_name, raw_text in iter_sections(data):
+        chunks = _worker_splitter.split_text(raw_text)
+        sections.append({
+            "item_code": item_code,
+            "item_name": item_name,
+            "raw_text": raw_text,
+            "content_hash": content_hash(raw_text),
+            "chunks": chunks,
+            "chunk_hashes": [content_hash(chunk_text) for chunk_text in chunks],
+        })
+
+    # Drop the section bodies from the metadata we send back
+    metadata = {k: v for k, v in data.items() if not k.startswith("item_")}
+    return {
+        "file_path": file_path,
+        "checksum": checksum,
+        "data": metadata,
+        "sections": sections,
+    }
+
+
+def plan_filing(session_factory, record: dict):
+    """
+    Pre-fills record sections with reusable embeddings from the database so
+    the embedding stage only computes vectors for new or changed chunks.
+    """
+    from app.models.domain import Company
+    from app.services.ingestion import find_existing_section, reusable_embeddings
+
+    for section in record["sections"]:
+        section["embeddings"] = [None] * len(section["chunks"])
+        section["reused_count"] = 0
+
+    db = session_factory()
+    try:
+        company_id = db.query(Company.id).filter(Company.cik == record["data"].get("cik")).scalar()
+        if company_id is None:
+            return
+        for section in record["sections"]:
+            unchanged_id, stale_ids = find_existing_section(
+                db, company_id, section["item_code"], section["content_hash"]
+            )
+            if unchanged_id is not None:
+                # Nothing to embed; the writer re-checks before skipping it
+                section["unchanged"] = True
+                continue
+            cached = reusable_embeddings(db, stale_ids)
+            section["embeddings"] = [cached.get(h) for h in section["chunk_hashes"]]
+            section["reused_count"] = sum(1 for v in section["embeddings"] if v is not None)
+    finally:
+        db.close()
+
+
+def _put(q, item, worker):
+    # Never block forever on a stage that has died
+    while worker.is_alive():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _embed_stage(in_q, out_q, batch_size, errors, writer):
+    """
+    Accumulates chunks across files and embeds them in fixed-size batches.
+    Files are passed on in arrival order once all their chunks are embedded.
+    """
+    from app.services.embeddings import embed_documents
+
+    pending_files = []
+    batch_texts = []
+    batch_slots = []
+
+    def release_ready():
+        while pending_files and pending_files[0]["remaining"] == 0:
+            if not _put(out_q, pending_files.pop(0), writer):
+                raise RuntimeError("Write stage stopped, aborting the run")
+
+    def flush():
+        vectors = embed_documents(batch_texts)
+        for (record, section, i), vector in zip(batch_slots, vectors):
+            section["embeddings"][i] = vector
+            record["remaining"] -= 1
+        batch_texts.clear()
+        batch_slots.clear()
+        release_ready()
+
+    try:
+        while True:
+            record = in_q.get()
+            if record is _DONE:
+                break
+
+            record["remaining"] = sum(
+                1 for s in record["sections"] if not s.get("unchanged")
+                for v in s["embeddings"] if v is None
+            )
+            pending_files.append(record)
+            for section in record["sections"]:
+                if section.get("unchanged"):
+                    continue
+                for i, chunk_text in enumerate(section["chunks"]):
+                    if section["embeddings"][i] is not None:
+                        continue
+                    batch_texts.append(chunk_text)
+                    batch_slots.append((record, section, i))
+                    if len(batch_texts) >= batch_size:
+                        flush()
+            release_ready()
+
+        if batch_texts:
+            flush()
+        release_ready()
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _put(out_q, _DONE, writer)
+
+
+def _vector_literal(vector) -> str:
+    return "[" + ",".join(repr(float(v)) for v in vector) + "]"
+
+
+def copy_chunks(db, rows):
+    """
+    Bulk-loads chunk rows with COPY on the session's own connection, so they
+    commit (or roll back) together with the Documents they belong to.
+    rows: iterable of (document_id, company_id, chunk_index, chunk_text, content_hash, embedding, token_count)
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for document_id, company_id, chunk_index, chunk_text, chunk_hash, embedding, token_count in rows:
+        writer.writerow([
+            document_id, company_id, chunk_index, chunk_text, chunk_hash,
+            _vector_literal(embedding), token_count
+        ])
+    buffer.seek(0)
+
+    from app.services.vector_store import embedding_attribute
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY chunks (document_id, company_id, chunk_index, chunk_text, content_hash, {embedding_attribute()}, token_count) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def write_filing(db, record: dict):
+    """
+    Writer stage for a single parsed + embedded file. Returns (company, report),
+    or (None, None) if the file has no CIK. Sections are re-diffed against the
+    database here, since another file for the same CIK may have landed since
+    the file was planned.
+    """
+    from app.models.domain import Document
+    from app.services.ingestion import (
+        delete_documents,
+        delete_dropped_sections,
+        find_existing_section,
+        get_or_create_company,
+        new_ingestion_report,
+    )
+
+    company = get_or_create_company(db, record["data"])
+    if company is None:
+        return None, None
+
+    report = new_ingestion_report(company)
+    written = []
+    for section in record["sections"]:
+        unchanged_id, stale_ids = find_existing_section(
+            db, company.id, section["item_code"], section["content_hash"]
+        )
+        delete_documents(db, stale_ids)
+        if unchanged_id is not None:
+            report["sections_reused"] += 1
+            continue
+        if section.get("unchanged"):
+            # Planned as unchanged but the stored copy is gone: nothing was embedded
+            raise RuntimeError(f"Section {section['item_code']} changed during ingestion, retry the file")
+
+        report["sections_replaced" if stale_ids else "sections_added"] += 1
+        report["chunks_reused"] += section["reused_count"]
+        report["chunks_embedded"] += len(section["chunks"]) - section["reused_count"]
+
+        doc = Document(
+            company_id=company.id,
+            item_code=section["item_code"],
+            item_name=section["item_name"],
+            raw_text=section["raw_text"],
+            content_hash=section["content_hash"]
+        )
+        db.add(doc)
+        written.append((doc, section))
+    # Flush once to get primary keys for every section
+    db.flush()
+
+    rows = []
+    for doc, section in written:
+        for i, chunk_text in enumerate(section["chunks"]):
+            rows.append((
+                doc.id, company.id, i, chunk_text, section["chunk_hashes"][i],
+                section["embeddings"][i], estimate_token_count(chunk_text)
+            ))
+    if rows:
+        copy_chunks(db, rows)
+    report["sections_removed"] = delete_dropped_sections(
+        db, company.id, [section["item_code"] for section in record["sections"]]
+    )
+
+    db.commit()
+    return company, report
+
+
+def _write_stage(in_q, session_factory, manifest, stats, errors):
+    try:
+        db = session_factory()
+    except Exception as e:
+        errors.append(e)
+        return
+    try:
+        while True:
+            record = in_q.get()
+            if record is _DONE:
+                break
+            filename = os.path.basename(record["file_path"])
+            try:
+                company, report = write_filing(db, record)
+                if company is None:
+                    print(f"Skipping {filename}: No CIK found.")
+                    stats["skipped"] += 1
+                    continue
+                manifest.mark_done(record["checksum"], filename, company.cik)
+                stats["ingested"] += 1
+                for key in REPORT_KEYS:
+                    stats[key] += report[key]
+                print(f"  -> Ingested {company.name} (CIK: {company.cik})")
+            except Exception as e:
+                print(f"  -> ERROR on {filename}: {str(e)}")
+                db.rollback()
+                stats["failed"] += 1
+    finally:
+        db.close()
+
+
+def run_pipeline(file_paths, session_factory, manifest_path, workers=None,
+                 embed_batch_size=DEFAULT_EMBED_BATCH_SIZE, resume=True):
+    """
+    Runs the three-stage pipeline over file_paths. Returns a stats dict.
+    """
+    from app.core.database import check_embedding_storage
+
+    check_embedding_storage()
+    manifest = IngestionManifest(manifest_path)
+    if not resume:
+        manifest.entries = {}
+
+    stats = {"ingested": 0, "skipped": 0, "resumed": 0, "failed": 0}
+    stats.update({key: 0 for key in REPORT_KEYS})
+
+    pending = []
+    for path in file_paths:
+        checksum = file_checksum(path)
+        if manifest.is_done(checksum):
+            stats["resumed"] += 1
+        else:
+            pending.append((path, checksum))
+
+    print(f"{stats['resumed']} files already in manifest, {len(pending)} to ingest.")
+    if not pending:
+        return stats
+
+    # Bounded queues plus a bounded window of files being parsed give
+    # backpressure: parsing blocks on a full queue instead of racing ahead of
+    # the model, and at most window + queue sizes parsed files are held
+    embed_q = queue.Queue(maxsize=8)
+    write_q = queue.Queue(maxsize=8)
+    errors = []
+
+    writer = threading.Thread(
+        target=_write_stage, args=(write_q, session_factory, manifest, stats, errors), daemon=True
+    )
+    embedder = threading.Thread(
+        target=_embed_stage, args=(embed_q, write_q, embed_batch_size, errors, writer), daemon=True
+    )
+    embedder.start()
+    writer.start()
+
+    window = 2 * (workers or os.cpu_count() or 1)
+    remaining = iter(pending)
+    in_flight = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            def submit_next():
+                for path, checksum in remaining:
+                    in_flight[pool.submit(parse_and_chunk, path, checksum)] = path
+                    return
+
+            for _ in range(window):
+                submit_next()
+            parsed = 0
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                future = done.pop()
+                path = in_flight.pop(future)
+                submit_next()
+                parsed += 1
+                try:
+                    record = future.result()
+                    plan_filing(session_factory, record)
+                except Exception as e:
+                    print(f"  -> ERROR parsing {os.path.basename(path)}: {str(e)}")
+                    stats["failed"] += 1
+                    continue
+                finally:
+                    # The future holds the parsed record until it is released
+                    del future
+                if not _put(embed_q, record, embedder):
+                    # Embedding stage failed: stop parsing the rest
+                    for f in in_flight:
+                        f.cancel()
+                    break
+                del record
+                if parsed % 10 == 0:
+                    print(f"Progress: {parsed}/{len(pending)} files parsed...")
+    finally:
+        in_flight.clear()
+        _put(embed_q, _DONE, embedder)
+        embedder.join()
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+    return stats
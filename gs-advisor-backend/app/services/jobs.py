@@ -0,0 +1,251 @@
+"""
+Background ingestion jobs behind POST /ingest.
+
+Jobs run in a small pool of worker *processes* (spawned, niced), not in the
+API's threads: chunking and MiniLM forward passes are CPU-bound and would
+otherwise compete with the event loop and query embeddings for the GIL.
+Workers report progress over a multiprocessing queue that a listener thread
+in the API process folds into the job table.
+
+Backpressure: at most ingest_workers jobs run and ingest_queue_size wait;
+beyond that submit() raises IngestQueueFull and the route answers 429.
+Job state is in memory, per API process.
+
+Uploads: the route parses the multipart body itself from request.stream()
+through limit_body(), so an oversized upload is cut off once the limit is
+crossed, whatever Content-Length the client sent, instead of being spooled
+to disk in full first.
+"""
+import multiprocessing
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from app.core.config import settings
+from app.core.metrics import observe_stage
+
+
+class IngestQueueFull(Exception):
+    """Every worker is busy and the wait queue is full."""
+
+
+class IngestQueueClosed(Exception):
+    """The worker pool is shutting down or has died."""
+
+
+class UploadTooLarge(ValueError):
+    """The request body or the uploaded file is over ingest_max_upload_mb."""
+
+
+# --- Worker process side ---
+
+_progress_queue = None
+
+
+def _init_worker(progress_queue, nice: int):
+    global _progress_queue
+    _progress_queue = progress_queue
+    if nice and hasattr(os, "nice"):
+        # Chat requests on the same pod get the CPU first
+        os.nice(nice)
+
+
+def _run_job(job_id: str, file_path: str):
+    from app.core.database import SessionLocal
+    from app.services.ingestion import ingest_10k_json
+
+    _progress_queue.put((job_id, "running", None))
+    db = SessionLocal()
+    try:
+        return ingest_10k_json(
+            file_path, db, progress=lambda progress: _progress_queue.put((job_id, "progress", progress))
+        )
+    finally:
+        db.close()
+
+
+# --- API process side ---
+
+class IngestionJobQueue:
+
+    def __init__(self, workers: int, queue_size: int, history: int, nice: int = 0):
+        self.capacity = workers + queue_size
+        self.history = history
+        self._jobs = OrderedDict()
+        self._active = 0
+        self._lock = threading.Lock()
+        context = multiprocessing.get_context("spawn")
+        self._progress_queue = context.Queue()
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._progress_queue, nice)
+        )
+        # Post-ingestion refresh (vector store, caches) off the pool's result thread
+        self._finalizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-finalize")
+        self._closed = False
+        threading.Thread(target=self._listen, name="ingest-progress", daemon=True).start()
+
+    def submit(self, file_path: str, filename: str) -> dict:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if self._closed:
+                raise IngestQueueClosed("Ingestion workers are shutting down")
+            if self._active >= self.capacity:
+                raise IngestQueueFull(f"{self._active} ingestion jobs already queued or running")
+            job = {
+                "job_id": job_id,
+                "filename": filename,
+                "status": "queued",
+                "progress": {},
+                "report": None,
+                "error": None,
+                "created_at": datetime.utcnow().isoformat(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            self._jobs[job_id] = job
+            self._active += 1
+            self._trim()
+            try:
+                future = self._pool.submit(_run_job, job_id, file_path)
+            except RuntimeError as e:
+                # BrokenProcessPool or submit after shutdown
+                self._active -= 1
+                job.update(status="failed", error=str(e))
+                raise IngestQueueClosed(str(e))
+        future.add_done_callback(lambda f: self._finalizer.submit(self._finish, job_id, f))
+        return dict(job)
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else {**job, "progress": dict(job["progress"])}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"active": self._active, "capacity": self.capacity, "tracked": len(self._jobs)}
+
+    def _trim(self):
+        # Forget the oldest finished jobs beyond the history limit (caller holds the lock)
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in ("succeeded", "failed")]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+    def _listen(self):
+        while True:
+            try:
+                job_id, kind, payload = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] in ("succeeded", "failed"):
+                    continue
+                if kind == "running":
+                    job.update(status="running", started_at=datetime.utcnow().isoformat())
+                else:
+                    job["progress"] = payload
+
+    def _finish(self, job_id: str, future):
+        error = None
+        report = None
+        try:
+            report = future.result()
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+        else:
+            if report is None:
+                error = "No CIK found in filing"
+            else:
+                # The worker's stage timers went to its own registry; record them here for /metrics
+                for stage, seconds in report.get("timings", {}).items():
+                    observe_stage(stage, seconds)
+                try:
+                    refresh_company(report["company_id"])
+                except Exception as e:
+                    # The data is in Postgres; the periodic sync will pick it up
+                    print(f"Ingestion job {job_id}: vector store refresh failed: {str(e)}")
+        with self._lock:
+            self._active -= 1
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(
+                    status="failed" if error else "succeeded",
+                    report=report,
+                    error=error,
+                    finished_at=datetime.utcnow().isoformat()
+                )
+        print(f"Ingestion job {job_id} " + (f"failed: {error}" if error else "finished"))
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._finalizer.shutdown(wait=False)
+
+
+def refresh_company(company_id: int):
+    """Makes a freshly ingested company visible to retrieval in this process."""
+    from app.core.database import SessionLocal
+    from app.services.rag import invalidate_company_cache
+    from app.services.vector_store import get_vector_store
+
+    db = SessionLocal()
+    try:
+        get_vector_store().sync_company(db, company_id)
+    finally:
+        db.close()
+    invalidate_company_cache(company_id)
+
+
+async def limit_body(stream, max_bytes: int):
+    """
+    Passes request body blocks through, raising UploadTooLarge as soon as
+    more than max_bytes have arrived. Nothing past the limit is read.
+    """
+    received = 0
+    async for block in stream:
+        received += len(block)
+        if received > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+        yield block
+
+
+def save_upload(source, destination: str, max_bytes: int) -> int:
+    """
+    Copies a parsed upload to disk in 1 MiB blocks, giving up once it exceeds
+    max_bytes. Returns the size written; raises UploadTooLarge when too large.
+    """
+    written = 0
+    with open(destination, "wb") as out:
+        while True:
+            block = source.read(1024 * 1024)
+            if not block:
+                return written
+            written += len(block)
+            if written > max_bytes:
+                out.close()
+                os.remove(destination)
+                raise UploadTooLarge(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+            out.write(block)
+
+
+@lru_cache
+def get_job_queue() -> IngestionJobQueue:
+    # Created on the first upload, so API processes that never ingest spawn no workers
+    return IngestionJobQueue(
+        workers=settings.ingest_workers,
+        queue_size=settings.ingest_queue_size,
+        history=settings.ingest_job_history,
+        nice=settings.ingest_worker_nice
+    )
+
+
+def shutdown_job_queue():
+    if get_job_queue.cache_info().currsize:
+        get_job_queue().shutdown()
@@ -0,0 +1,417 @@
+"""
+Every Gemini call goes through LLMClient, which adds three things around
+the LangChain chat model:
+
+- Single-flight: identical prompts already in flight are joined rather
+  than sent again. When a new 10-K lands and the whole floor asks for the
+  same summary, Gemini sees one call. A joined stream replays what was
+  produced so far, then follows along. Nothing is kept once the call ends;
+  reuse across time is generation_cache's job.
+- Scheduling: calls wait for a concurrency slot (llm_max_concurrency) and
+  for room in two token buckets, requests and tokens per minute. Waiting
+  calls are served by priority, so interactive chat overtakes queued
+  generations and map-reduce parts.
+- Retries: rate-limited (429) and unavailable (503) responses are retried
+  with jittered exponential backoff. A rate limit also pauses the scheduler
+  for the backoff, since the quota is shared by every queued call. Once
+  retries run out the caller gets LLMRateLimited or LLMBusy, which the
+  routes return as 429/503 with Retry-After.
+"""
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import random
+import re
+import time
+from contextlib import nullcontext
+from functools import lru_cache
+from langchain_google_genai import ChatGoogleGenerativeAI
+from app.core.config import settings
+from app.core.metrics import LLM_COALESCED, LLM_RETRIES, observe_stage, stage_timer
+from app.services.tokens import count_tokens
+
+# Configure Gemini
+# Ensure GOOGLE_API_KEY is in your .env file
+LLM_MODEL = "models/gemini-2.5-flash"
+
+# Lower is served first
+PRIORITIES = {"chat": 0, "generation": 1, "map": 2}
+
+# "Please retry in 17.3s" / "retryDelay": "17s" in Gemini's quota errors
+_RETRY_HINT = re.compile(r"retry(?:[ _]?delay)?\W{0,4}(?:in\s+)?(\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+
+class LLMUnavailable(Exception):
+    """The call could not be made in time; status_code and retry_after go to the client."""
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class LLMRateLimited(LLMUnavailable):
+    """Gemini kept answering 429 (quota exhausted) through every retry."""
+    status_code = 429
+
+
+class LLMBusy(LLMUnavailable):
+    """Queued past llm_queue_timeout_seconds, or Gemini kept answering 503."""
+
+
+def classify_error(error: BaseException):
+    """
+    "rate_limit", "unavailable" or None (not worth retrying). The Gemini SDK
+    and LangChain wrap errors differently across versions, so this looks for
+    an HTTP status code (google.api_core and google.genai errors carry it as
+    .code) or a network error type along the exception chain. Messages are
+    never matched: a 400 that mentions "quota" must not be retried.
+    """
+    while error is not None:
+        code = getattr(error, "code", None) or getattr(error, "status_code", None)
+        if code is None:
+            code = getattr(getattr(error, "response", None), "status_code", None)
+        if code == 429:
+            return "rate_limit"
+        if code in (500, 502, 503, 504) or isinstance(error, (ConnectionError, TimeoutError)):
+            return "unavailable"
+        if isinstance(code, int):
+            # An explicit non-transient status (400, 403, 404, ...): the cause doesn't matter
+            return None
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def retry_hint(error: BaseException):
+    match = _RETRY_HINT.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def backoff_delay(attempt: int) -> float:
+    # Equal jitter: half the exponential step is kept so retries can't all bunch up at zero
+    step = min(settings.llm_backoff_max_seconds, settings.llm_backoff_base_seconds * 2 ** attempt)
+    return step / 2 + random.uniform(0, step / 2)
+
+
+def request_key(model_name: str, messages) -> str:
+    return hashlib.sha256(json.dumps([model_name, messages], default=str).encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(messages) -> int:
+    # Prompt tokens plus the answer we expect back; corrected once usage is reported
+    prompt = sum(count_tokens(content if isinstance(content, str) else str(content)) for _, content in messages)
+    return prompt + settings.llm_expected_output_tokens
+
+
+def _usage_tokens(message):
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+
+class TokenBucket:
+    """Refills per_minute units per minute, up to per_minute. 0 means unlimited."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        # A single call larger than the bucket only has to wait for a full one
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float):
+        if self.capacity > 0:
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        # Usage reported after the call; the level may go negative and is repaid by waiting
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level - delta)
+
+
+class LLMScheduler:
+    """
+    Grants calls a concurrency slot once both buckets have room, best
+    priority first (FIFO within a priority). Runs on the event loop only.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, max_concurrency: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._timer = None
+
+    async def acquire(self, priority: str, tokens: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._sequence), tokens, future))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, settings.llm_queue_timeout_seconds)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up: hand the slot on
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise LLMBusy("Gemini request queue is full, try again shortly", settings.llm_queue_timeout_seconds) from None
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def pause(self, seconds: float):
+        """Holds every queued call back, e.g. after Gemini reported the quota exhausted."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._waiters and self.in_flight < self.max_concurrency:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                # Timed out or cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            wait = max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": sum(1 for waiter in self._waiters if not waiter[3].done()),
+            "requests_available": round(self.requests.level, 1) if self.requests.capacity else None,
+            "tokens_available": round(self.tokens.level) if self.tokens.capacity else None,
+            "paused_seconds": round(max(0.0, self.paused_until - time.monotonic()), 2),
+        }
+
+
+class _SharedStream:
+    """Pieces of one streamed answer, replayed to every subscriber."""
+
+    def __init__(self):
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self.updated = asyncio.Event()
+
+    def _notify(self):
+        updated, self.updated = self.updated, asyncio.Event()
+        updated.set()
+
+    def append(self, piece: str):
+        self.pieces.append(piece)
+        self._notify()
+
+    def finish(self, error: BaseException = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+
+class LLMClient:
+
+    def __init__(self, model, scheduler: LLMScheduler):
+        self.model = model
+        self.scheduler = scheduler
+        self._calls = {}
+        self._streams = {}
+        self._coalesced = 0
+        self._retries = 0
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.model, "model", None) or LLM_MODEL
+
+    async def _acquire(self, priority: str, tokens: int):
+        # Time queued for a slot or budget, reported apart from Gemini's own latency
+        with stage_timer("llm_wait"):
+            await self.scheduler.acquire(priority, tokens)
+
+    def _retry_delay(self, error: Exception, attempt: int):
+        """
+        Seconds to back off before retrying error, None if it isn't
+        retryable; raises LLMRateLimited/LLMBusy when retries are used up.
+        """
+        kind = classify_error(error)
+        if kind is None:
+            return None
+        delay = max(backoff_delay(attempt), retry_hint(error) or 0.0)
+        if attempt >= settings.llm_max_retries:
+            if kind == "rate_limit":
+                raise LLMRateLimited("Gemini rate limit reached, try again shortly", delay) from error
+            raise LLMBusy("Gemini is unavailable, try again shortly", delay) from error
+        if kind == "rate_limit":
+            self.scheduler.pause(delay)
+        self._retries += 1
+        LLM_RETRIES.labels(kind).inc()
+        print(f"Gemini {kind.replace('_', ' ')} ({str(error)[:200]}), retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
+    async def _call(self, messages, priority: str) -> str:
+        estimate = estimate_tokens(messages)
+        for attempt in itertools.count():
+            await self._acquire(priority, estimate)
+            try:
+                with stage_timer("llm"):
+                    response = await self.model.ainvoke(messages)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            else:
+                used = _usage_tokens(response)
+                if used is not None:
+                    self.scheduler.tokens.adjust(used - estimate)
+                return response.content
+            finally:
+                self.scheduler.release()
+            await asyncio.sleep(delay)
+
+    async def invoke(self, messages, priority: str = "chat") -> str:
+        """The answer text. Joins an identical call that is already running."""
+        key = request_key(self.model_name, messages)
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = {"task": asyncio.create_task(self._call(messages, priority)), "waiters": 0}
+            self._calls[key] = entry
+            entry["task"].add_done_callback(lambda _: self._forget(self._calls, key, entry))
+            joined = False
+        else:
+            self._coalesced += 1
+            LLM_COALESCED.labels("invoke").inc()
+            joined = True
+
+        entry["waiters"] += 1
+        try:
+            # shield: one waiter cancelling must not cancel the call for the others
+            with stage_timer("llm_coalesced") if joined else nullcontext():
+                return await asyncio.shield(entry["task"])
+        finally:
+            entry["waiters"] -= 1
+            if entry["waiters"] == 0 and not entry["task"].done():
+                # Everyone waiting went away (client disconnects): stop paying for it
+                self._forget(self._calls, key, entry)
+                entry["task"].cancel()
+
+    @staticmethod
+    def _forget(registry: dict, key: str, entry):
+        if registry.get(key) is entry:
+            del registry[key]
+
+    async def _produce(self, shared: _SharedStream, messages, priority: str):
+        estimate = estimate_tokens(messages)
+        used = None
+        try:
+            for attempt in itertools.count():
+                await self._acquire(priority, estimate)
+                try:
+                    with stage_timer("llm"):
+                        started = time.perf_counter()
+                        first = True
+                        async for piece in self.model.astream(messages):
+                            if first:
+                                observe_stage("llm_first_token", time.perf_counter() - started)
+                                first = False
+                            used = _usage_tokens(piece) or used
+                            if piece.content:
+                                shared.append(piece.content)
+                    break
+                except Exception as e:
+                    # Text already sent can't be taken back, so only a failed start is retried
+                    delay = None if shared.pieces else self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                finally:
+                    self.scheduler.release()
+                await asyncio.sleep(delay)
+        except BaseException as e:
+            shared.finish(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        else:
+            if used is not None:
+                self.scheduler.tokens.adjust(used - estimate)
+            shared.finish()
+
+    async def stream(self, messages, priority: str = "chat"):
+        """
+        Yields the answer as text pieces. Joins an identical stream that is
+        already running, starting with the pieces it has produced so far.
+        """
+        key = request_key(self.model_name, messages)
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = _SharedStream()
+            self._streams[key] = shared
+            shared.task = asyncio.create_task(self._produce(shared, messages, priority))
+            shared.task.add_done_callback(lambda _: self._forget(self._streams, key, shared))
+        else:
+            self._coalesced += 1
+            LLM_COALESCED.labels("stream").inc()
+
+        shared.subscribers += 1
+        index = 0
+        try:
+            while True:
+                # Taken before reading, so a piece added while we yield still wakes us
+                updated = shared.updated
+                while index < len(shared.pieces):
+                    index += 1
+                    yield shared.pieces[index - 1]
+                if index < len(shared.pieces):
+                    continue
+                if shared.done:
+                    if shared.error is not None:
+                        raise shared.error
+                    return
+                await updated.wait()
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.done:
+                self._forget(self._streams, key, shared)
+                shared.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            **self.scheduler.stats(),
+            "calls_in_flight": len(self._calls),
+            "streams_in_flight": len(self._streams),
+            "coalesced": self._coalesced,
+            "retries": self._retries,
+        }
+
+
+@lru_cache
+def get_llm_client() -> LLMClient:
+    return LLMClient(
+        # No retries at the LangChain level; they are scheduled here, within the budgets
+        ChatGoogleGenerativeAI(model=LLM_MODEL, temperature=0, max_retries=0),
+        LLMScheduler(settings.llm_requests_per_minute, settings.llm_tokens_per_minute, settings.llm_max_concurrency),
+    )
@@ -0,0 +1,148 @@
+"""
+Map-reduce generation for filings whose sections don't fit comfortably in a
+single prompt (Item 1A and Item 7 of large filers regularly run past 50k
+tokens each).
+
+Map: every section is split into parts under a token budget and each part is
+condensed into notes for the requested mode. Parts are summarized
+concurrently; notes are cached in section_summaries keyed on the part's
+content hash, so re-ingesting a filing only re-summarizes the parts that
+changed, and other modes/companies sharing identical text reuse them too.
+
+Reduce: the notes replace the raw sections in the usual generation prompt.
+"""
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from app.core.config import settings
+from app.models.domain import SectionSummary
+from app.services.filings import content_hash, estimate_token_count
+
+# What the map step should keep from each part, per generation mode
+MAP_FOCUS = {
+    "summary": "the company's core business, segments, and financial performance",
+    "risk_note": "every distinct risk factor and its potential impact",
+    "email": "the business profile, recent performance, and key risks",
+}
+
+MAP_PROMPT = (
+    "You are an expert financial analyst condensing one part of a 10-K section. "
+    "Extract {focus} as concise factual notes. Keep figures, dates, and names exactly "
+    "as written. Do not add anything that is not in the text."
+)
+MAP_REQUEST = "10-K section: {item_name} (part {index} of {total})\n\n{text}"
+
+
+def needs_map_reduce(raw_texts) -> bool:
+    total = sum(estimate_token_count(text or "") for text in raw_texts)
+    return total > settings.generation_map_reduce_threshold_tokens
+
+
+def split_section(text: str):
+    """Splits a section into parts of at most generation_part_tokens tokens."""
+    # Measured in characters at ~4 chars/token (conservative for English filings
+    # text), which keeps the split cheap and independent of the tokenizer
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.generation_part_tokens * 4,
+        chunk_overlap=0
+    )
+    return splitter.split_text(text or "")
+
+
+def plan_parts(sections):
+    """
+    sections: (item_name, raw_text) pairs.
+    Returns one dict per part, in document order.
+    """
+    parts = []
+    for item_name, raw_text in sections:
+        texts = split_section(raw_text)
+        for index, text in enumerate(texts, start=1):
+            parts.append({
+                "item_name": item_name,
+                "index": index,
+                "total": len(texts),
+                "text": text,
+                "hash": content_hash(text),
+            })
+    return parts
+
+
+async def load_part_summaries(db: AsyncSession, hashes, mode: str, prompt_version: str):
+    rows = await db.execute(
+        select(SectionSummary.content_hash, SectionSummary.summary).filter(
+            SectionSummary.content_hash.in_(set(hashes)),
+            SectionSummary.mode == mode,
+            SectionSummary.prompt_version == prompt_version
+        )
+    )
+    return dict(rows.all())
+
+
+async def store_part_summaries(db: AsyncSession, summaries: dict, mode: str, prompt_version: str):
+    if not summaries:
+        return
+    await db.execute(
+        insert(SectionSummary)
+        .values([
+            {"content_hash": part_hash, "mode": mode, "prompt_version": prompt_version, "summary": summary}
+            for part_hash, summary in summaries.items()
+        ])
+        .on_conflict_do_nothing(constraint="uq_section_summary_key")
+    )
+    await db.commit()
+
+
+async def summarize_parts(db: AsyncSession, parts, mode: str, prompt_version: str, call_llm, release_connection):
+    """
+    Map step. Returns the notes for every part, in order. The connection is
+    released while the LLM calls run; the session is only touched before and
+    after the gather, never concurrently.
+    Notes for the parts that succeeded are cached even if others fail, so a
+    retry only pays for the failures.
+    """
+    # 1. Reuse notes for parts we have already summarized
+    notes = await load_part_summaries(db, [part["hash"] for part in parts], mode, prompt_version)
+    await release_connection(db)
+
+    # 2. Summarize the rest concurrently (one call per distinct part text)
+    pending = {part["hash"]: part for part in parts if part["hash"] not in notes}
+    system_prompt = MAP_PROMPT.format(focus=MAP_FOCUS[mode])
+    # Bounds the fan-out of a single request; call_llm bounds the process
+    limiter = asyncio.Semaphore(settings.generation_map_concurrency)
+
+    async def summarize(part):
+        async with limiter:
+            return await call_llm([
+                ("system", system_prompt),
+                ("human", MAP_REQUEST.format(
+                    item_name=part["item_name"], index=part["index"], total=part["total"], text=part["text"]
+                ))
+            ])
+
+    results = await asyncio.gather(*(summarize(part) for part in pending.values()), return_exceptions=True)
+
+    # 3. Cache what succeeded, then surface the first failure
+    fresh = {}
+    errors = []
+    for part_hash, result in zip(pending, results):
+        if isinstance(result, BaseException):
+            errors.append(result)
+        else:
+            fresh[part_hash] = result
+    await store_part_summaries(db, fresh, mode, prompt_version)
+    if errors:
+        raise errors[0]
+
+    notes.update(fresh)
+    print(f"Map-reduce {mode}: {len(parts)} parts, {len(fresh)} summarized, {len(parts) - len(fresh)} reused")
+    return [notes[part["hash"]] for part in parts]
+
+
+def build_reduce_context(parts, notes) -> str:
+    return "\n\n".join(
+        f"--- {part['item_name']} (part {part['index']} of {part['total']}) ---\n{note}"
+        for part, note in zip(parts, notes)
+    )
@@ -1,52 +1,201 @@
-import os
-from sqlalchemy.orm import Session
+import asyncio
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from anyio import CancelScope
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from app.models.domain import Chunk, AuditLog, Company, Document
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_huggingface import HuggingFaceEmbeddings
-# Configure Gemini
-# Ensure GOOGLE_API_KEY is in your .env file
-llm = ChatGoogleGenerativeAI(model="models/gemini-2.5-flash", temperature=0)
-embeddings_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+from app.models.domain import Chunk, Document
+from app.core.config import settings
+from app.core.metrics import stage_timer
+from app.services.vector_store import get_vector_store
+from app.services.audit import record_audit
+from app.services.cache import LRUTTLCache
+from app.services.context import build_context, context_token_budget
+from app.services.embedding_batcher import QueryEmbeddingBatcher
+from app.services.retrieval import lexical_search, reciprocal_rank_fusion
+from app.services.generation_cache import (
+    compute_prompt_version,
+    compute_source_hash,
+    get_cached_generation,
+    store_generation,
+)
+from app.services.map_reduce import (
+    MAP_FOCUS,
+    MAP_PROMPT,
+    MAP_REQUEST,
+    build_reduce_context,
+    needs_map_reduce,
+    plan_parts,
+    summarize_parts,
+)
+from app.services.llm_client import LLM_MODEL, LLMUnavailable, get_llm_client
 
-def query_rag(db: Session, query_text: str, company_id: int):
+# Everything below runs on the event loop. The two things that can't:
+# - MiniLM forward passes are CPU-bound, so they go to a small dedicated pool
+#   instead of the default executor shared with FastAPI's sync routes.
+# - Gemini calls are awaited, but bounded, rate-limited and coalesced by the
+#   client in llm_client.py so a burst can't open unlimited upstream requests.
+embedding_executor = ThreadPoolExecutor(max_workers=settings.embedding_threads, thread_name_prefix="embed")
+# Concurrent cache misses share one forward pass (see embedding_batcher.py)
+query_embedder = QueryEmbeddingBatcher(
+    embedding_executor,
+    settings.query_embedding_batch_max,
+    settings.query_embedding_batch_wait_ms
+)
+
+# Advisors ask the same canned questions about the same companies, so both
+# the query embedding and the top-k search result are cached.
+query_embedding_cache = LRUTTLCache(
+    "query_embedding",
+    settings.query_embedding_cache_size,
+    settings.query_embedding_cache_ttl_seconds
+)
+# Keyed on (company_id, k, embedding bytes); invalidated when a company is re-ingested
+retrieval_cache = LRUTTLCache(
+    "retrieval",
+    settings.retrieval_cache_size,
+    settings.retrieval_cache_ttl_seconds
+)
+
+def normalize_query(query_text: str) -> str:
+    # MiniLM is uncased, so case and whitespace never change the embedding
+    return " ".join(query_text.lower().split())
+
+async def embed_query_cached(query_text: str):
+    key = normalize_query(query_text)
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        # Includes the few milliseconds spent waiting for the batch to fill
+        with stage_timer("embed"):
+            embedding = await query_embedder.embed(key)
+        query_embedding_cache.set(key, embedding)
+    return embedding
+
+async def search_chunk_ids_cached(db: AsyncSession, company_id: int, query_embedding, k: int):
+    key = (company_id, k, array("f", query_embedding).tobytes())
+    chunk_ids = retrieval_cache.get(key)
+    if chunk_ids is None:
+        with stage_timer("retrieve"):
+            chunk_ids = await get_vector_store().asearch(company_id, query_embedding, k, db=db)
+        retrieval_cache.set(key, tuple(chunk_ids))
+    return list(chunk_ids)
+
+async def search_many_cached(db: AsyncSession, company_ids, query_embedding, k: int):
     """
-    1. Embeds the user query.
-    2. Searches for semantically similar chunks in Postgres (pgvector).
-    3. Constructs a context window.
-    4. Sends to Gemini for an answer.
-    5. Logs the interaction for audit.
+    search_chunk_ids_cached for many companies at once: cache hits are served
+    from memory and all misses go to the vector store in one call.
     """
-    
-    # 1. Generate embedding for the question
-    query_embedding = embeddings_model.embed_query(query_text)
-
-    # 2. Vector Search in Postgres (L2 Distance)
-    # We want chunks that match the company AND are semantically similar
-    results = db.scalars(
-        select(Chunk)
-        .join(Chunk.document)
-        .filter(Chunk.document.has(company_id=company_id))
-        .order_by(Chunk.embedding.l2_distance(query_embedding))
-        .limit(5)
-    ).all()
-
-    # 3. Construct Context
-    context_str = ""
-    chunk_ids = []
-    
+    embedding_key = array("f", query_embedding).tobytes()
+    ranked = {}
+    for company_id in company_ids:
+        chunk_ids = retrieval_cache.get((company_id, k, embedding_key))
+        if chunk_ids is not None:
+            ranked[company_id] = list(chunk_ids)
+    misses = [company_id for company_id in company_ids if company_id not in ranked]
+    if misses:
+        with stage_timer("retrieve"):
+            found = await get_vector_store().asearch_many(misses, query_embedding, k, db=db)
+        for company_id in misses:
+            ranked[company_id] = list(found.get(company_id, []))
+            retrieval_cache.set((company_id, k, embedding_key), tuple(ranked[company_id]))
+    return ranked
+
+async def lexical_chunk_ids_cached(db: AsyncSession, company_id: int, query_text: str, k: int):
+    # Same cache as vector results: the company ID leads the key, so invalidation covers both
+    key = (company_id, k, "lexical", normalize_query(query_text))
+    chunk_ids = retrieval_cache.get(key)
+    if chunk_ids is None:
+        with stage_timer("retrieve_lexical"):
+            chunk_ids = await lexical_search(db, company_id, query_text, k)
+        retrieval_cache.set(key, tuple(chunk_ids))
+    return list(chunk_ids)
+
+async def retrieve_chunk_ids(db: AsyncSession, company_id: int, query_text: str, k: int, mode: str = None):
+    """
+    Ranked chunk IDs for a question. mode: "vector", "lexical" or "hybrid"
+    (defaults to settings.retrieval_mode). Hybrid takes hybrid_candidates
+    from each retriever and fuses them with reciprocal rank fusion.
+    """
+    mode = mode or settings.retrieval_mode
+    if mode == "lexical":
+        return await lexical_chunk_ids_cached(db, company_id, query_text, k)
+
+    query_embedding = await embed_query_cached(query_text)
+    if mode == "vector":
+        return await search_chunk_ids_cached(db, company_id, query_embedding, k)
+
+    candidates = max(k, settings.hybrid_candidates)
+    vector_ids = await search_chunk_ids_cached(db, company_id, query_embedding, candidates)
+    lexical_ids = await lexical_chunk_ids_cached(db, company_id, query_text, candidates)
+    return reciprocal_rank_fusion([vector_ids, lexical_ids], k, settings.rrf_k)
+
+def invalidate_company_cache(company_id: int):
+    """Call after a company's chunks change so cached searches can't return stale IDs."""
+    return retrieval_cache.invalidate(lambda key: key[0] == company_id)
+
+def cache_stats():
+    return [query_embedding_cache.stats(), retrieval_cache.stats()]
+
+async def load_chunks(db: AsyncSession, chunk_ids):
+    """
+    Fetches the columns prompt building needs for ranked chunk IDs (plus the
+    section name, joined in the same query), preserving the ranking. IDs that
+    no longer exist (e.g. a re-ingest landed after the store was synced) are
+    dropped. Rows, not entities: nothing else (embedding, raw_text) is read.
+    """
+    if not chunk_ids:
+        return []
+    with stage_timer("load_chunks"):
+        rows = await db.execute(
+            select(Chunk.id, Chunk.document_id, Chunk.chunk_index, Chunk.chunk_text, Document.item_name)
+            .join(Document, Chunk.document_id == Document.id)
+            .filter(Chunk.id.in_(chunk_ids))
+        )
+    by_id = {chunk.id: chunk for chunk in rows}
+    return [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+
+async def release_connection(db: AsyncSession):
+    """
+    Ends the read transaction so the pooled connection is returned before a
+    slow LLM call. The session stays usable for the cache writes afterwards.
+    """
+    await db.rollback()
+
+async def call_llm(messages, priority: str = "chat") -> str:
+    """priority: "chat", "generation" or "map" (see llm_client.PRIORITIES)."""
+    return await get_llm_client().invoke(messages, priority)
+
+def call_map_llm(messages):
+    return call_llm(messages, "map")
+
+NO_RESULTS_ANSWER = "I could not find any relevant information in the uploaded 10-K documents for this company."
+
+async def prepare_chat(db: AsyncSession, query_text: str, company_id: int, retrieval_mode: str = None):
+    """
+    Retrieval half of query_rag: embeds the question, searches the vector store
+    (and/or the full-text index, see retrieval_mode) and builds the prompt.
+    Returns None when nothing relevant was found.
+    """
+    # 1-2. Embed the question and search (pgvector or in-process, see vector_store.py),
+    # fused with full-text hits in hybrid mode. Only chunks of this company match.
+    ranked_ids = await retrieve_chunk_ids(db, company_id, query_text, settings.retrieval_top_k, retrieval_mode)
+    results = await load_chunks(db, ranked_ids)
+
     if not results:
-        return {
-            "answer": "I could not find any relevant information in the uploaded 10-K documents for this company.",
-            "sources": []
-        }
+        await release_connection(db)
+        return None
+
+    prepared = build_chat_prompt(query_text, results)
+    await release_connection(db)
+    return prepared
 
-    for chunk in results:
-        # Append context for the LLM
-        context_str += f"---\nSource: {chunk.document.item_name}\nContent: {chunk.chunk_text}\n"
-        # Keep track of IDs for the audit log
-        chunk_ids.append(chunk.id)
+def build_chat_prompt(query_text: str, results):
+    """Prompt, audit chunk IDs and source names for the retrieved chunks."""
+    # 3. Construct Context: neighbouring chunks merged without their overlap,
+    # passages added by relevance within the token budget (see context.py)
+    with stage_timer("context"):
+        context = build_context(results, context_token_budget())
+    context_str = context["context"]
 
     # 4. Build Prompt
     system_prompt = (
@@ -55,40 +204,177 @@ def query_rag(db: Session, query_text: str, company_id: int):
         "If the answer is not in the context, say you don't know.\n\n"
         f"Context:\n{context_str}"
     )
-    
-    # 5. Call LLM
-    try:
-        response = llm.invoke([
+
+    return {
+        "messages": [
             ("system", system_prompt),
             ("human", query_text)
-        ])
-        answer_text = response.content
-    except Exception as e:
-        answer_text = f"Error calling Gemini API: {str(e)}"
+        ],
+        # Only the chunks that made it into the prompt are audited
+        "chunk_ids": context["chunk_ids"],
+        "sources": context["sources"],
+        "context_stats": context["stats"]
+    }
 
-    # 6. Audit Logging (Compliance)
-    # We log exactly what the advisor asked and what the model replied
-    audit = AuditLog(
+def log_chat_audit(company_id: int, query_text: str, chunk_ids, answer_text: str):
+    # We log exactly what the advisor asked and what the model replied.
+    # Queued for the write-behind audit writer, not written on the request path
+    record_audit(
         company_id=company_id,
         query_text=query_text,
         retrieved_chunk_ids=chunk_ids,
         llm_mode="chat",
         llm_response=answer_text
     )
-    db.add(audit)
-    db.commit()
+
+async def query_rag(db: AsyncSession, query_text: str, company_id: int, retrieval_mode: str = None):
+    """
+    1. Embeds the user query.
+    2. Searches for semantically similar chunks in Postgres (pgvector).
+    3. Constructs a context window.
+    4. Sends to Gemini for an answer.
+    5. Logs the interaction for audit.
+    """
+    prepared = await prepare_chat(db, query_text, company_id, retrieval_mode)
+    if prepared is None:
+        return {
+            "answer": NO_RESULTS_ANSWER,
+            "sources": []
+        }
+
+    # 5. Call LLM
+    try:
+        answer_text = await call_llm(prepared["messages"])
+    except LLMUnavailable as e:
+        # Out of quota: the route answers 429/503 so clients back off and retry
+        log_chat_audit(company_id, query_text, prepared["chunk_ids"], f"Error calling Gemini API: {str(e)}")
+        raise
+    except Exception as e:
+        answer_text = f"Error calling Gemini API: {str(e)}"
+
+    # 6. Audit Logging (Compliance)
+    log_chat_audit(company_id, query_text, prepared["chunk_ids"], answer_text)
 
     return {
         "answer": answer_text,
-        "sources": [c.document.item_name for c in results]
+        "sources": prepared["sources"]
     }
 
-def generate_specialized_content(db: Session, company_id: int, mode: str):
+async def prepare_chat_batch(db: AsyncSession, query_text: str, company_ids, retrieval_mode: str = None):
     """
-    Bypasses vector search to pull specific full-text documents based on the mode,
-    then leverages Gemini's large context window to generate comprehensive outputs.
+    prepare_chat for one question over many companies: the question is
+    embedded once, vector search runs as a single statement for all companies
+    (see PgVectorStore.asearch_many) and chunks are loaded in one query.
+    Lexical and hybrid modes share the embedding but search per company.
+    Returns {company_id: prepared dict, or None when nothing was found}.
     """
-    
+    mode = retrieval_mode or settings.retrieval_mode
+    k = settings.retrieval_top_k
+    if mode == "vector":
+        query_embedding = await embed_query_cached(query_text)
+        ranked = await search_many_cached(db, company_ids, query_embedding, k)
+    else:
+        ranked = {
+            company_id: await retrieve_chunk_ids(db, company_id, query_text, k, mode)
+            for company_id in company_ids
+        }
+
+    chunks = await load_chunks(db, [chunk_id for ids in ranked.values() for chunk_id in ids])
+    by_id = {chunk.id: chunk for chunk in chunks}
+    prepared = {}
+    for company_id in company_ids:
+        results = [by_id[chunk_id] for chunk_id in ranked.get(company_id, []) if chunk_id in by_id]
+        prepared[company_id] = build_chat_prompt(query_text, results) if results else None
+    await release_connection(db)
+    return prepared
+
+async def stream_rag_batch(db: AsyncSession, query_text: str, company_ids, retrieval_mode: str = None):
+    """
+    Answers one question for many companies. Yields a ("result", {...}) event
+    per company as soon as its answer is ready (completion order, not request
+    order), then ("done", {...}). LLM calls run concurrently, bounded by the
+    process-wide LLM scheduler. Every answered company gets its own audit
+    record; calls cut short by a client disconnect are audited with no answer.
+    """
+    prepared = await prepare_chat_batch(db, query_text, company_ids, retrieval_mode)
+
+    async def answer(company_id: int, chat: dict):
+        answer_text = ""
+        try:
+            answer_text = await call_llm(chat["messages"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            answer_text = f"Error calling Gemini API: {str(e)}"
+        finally:
+            log_chat_audit(company_id, query_text, chat["chunk_ids"], answer_text)
+        return {"company_id": company_id, "answer": answer_text, "sources": chat["sources"]}
+
+    for company_id, chat in prepared.items():
+        if chat is None:
+            yield ("result", {"company_id": company_id, "answer": NO_RESULTS_ANSWER, "sources": []})
+
+    tasks = [asyncio.create_task(answer(company_id, chat)) for company_id, chat in prepared.items() if chat]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield ("result", await next_done)
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield ("done", {"companies": len(prepared)})
+
+async def stream_llm(messages, on_text, priority: str = "chat"):
+    """
+    Yields ("token", text) events as Gemini produces them, passing each piece
+    to on_text. A failure mid-stream becomes an ("error", message) event.
+    The concurrency slot is held for the whole stream; identical streams in
+    flight are shared (see LLMClient.stream).
+    """
+    try:
+        async for text in get_llm_client().stream(messages, priority):
+            on_text(text)
+            yield ("token", text)
+    except Exception as e:
+        message = f"Error calling Gemini API: {str(e)}"
+        on_text(message)
+        yield ("error", message)
+
+async def stream_rag(db: AsyncSession, query_text: str, company_id: int, retrieval_mode: str = None):
+    """
+    Streaming variant of query_rag. Yields (event, data) tuples: "sources"
+    first, then "token" events, then "done". The audit record is written once
+    the answer is complete, or with the partial answer if the client
+    disconnects mid-stream.
+    """
+    prepared = await prepare_chat(db, query_text, company_id, retrieval_mode)
+    if prepared is None:
+        yield ("sources", [])
+        yield ("token", NO_RESULTS_ANSWER)
+        yield ("done", {})
+        return
+
+    yield ("sources", prepared["sources"])
+
+    parts = []
+    try:
+        async for event in stream_llm(prepared["messages"], parts.append):
+            yield event
+    finally:
+        # Runs even when a client disconnect cancels the stream
+        log_chat_audit(company_id, query_text, prepared["chunk_ids"], "".join(parts))
+    yield ("done", {})
+
+GENERATION_REQUEST = "Please generate the {mode} based on the following SEC filings:\n\n{context}"
+
+async def prepare_generation(db: AsyncSession, company_id: int, mode: str):
+    """
+    Everything generate_specialized_content does before calling the LLM.
+    Returns a dict whose "status" is "missing" (sections not ingested),
+    "cached" (content served from generation_cache) or "ready". A ready dict
+    carries either "messages" or, for oversized sections, the map-reduce
+    "parts" (see build_generation_messages).
+    """
+
     # 1. Route the logic based on the requested mode
     if mode == "summary":
         item_codes = ["item_1", "item_7"]
@@ -105,44 +391,195 @@ def generate_specialized_content(db: Session, company_id: int, mode: str):
     else:
         raise ValueError("Invalid generation mode")
 
-    # 2. Fetch exact full-text documents from Postgres (No Vector Search)
-    docs = db.query(Document).filter(
-        Document.company_id == company_id,
-        Document.item_code.in_(item_codes)
-    ).all()
+    # 2. Resolve the source sections (metadata only; raw_text is only read on a cache miss)
+    doc_rows = (await db.execute(
+        select(Document.id, Document.item_code, Document.item_name, Document.content_hash).filter(
+            Document.company_id == company_id,
+            Document.item_code.in_(item_codes)
+        ).order_by(Document.id)
+    )).all()
 
-    if not docs:
+    if not doc_rows:
+        await release_connection(db)
         return {
-            "content": f"Required 10-K sections ({', '.join(item_codes)}) not found for this company.", 
+            "status": "missing",
+            "content": f"Required 10-K sections ({', '.join(item_codes)}) not found for this company.",
             "sources": []
         }
 
-    # 3. Construct the context string
-    context_str = "\n\n".join([f"--- {doc.item_name} ---\n{doc.raw_text}" for doc in docs])
-    sources = [doc.item_name for doc in docs]
+    sources = [row.item_name for row in doc_rows]
+    source_hash = compute_source_hash(doc_rows)
+    # Map-reduce prompts and budgets are part of the key: they change the output for large filings
+    prompt_version = compute_prompt_version(
+        LLM_MODEL, system_prompt, GENERATION_REQUEST, MAP_PROMPT, MAP_FOCUS[mode], MAP_REQUEST,
+        str(settings.generation_map_reduce_threshold_tokens), str(settings.generation_part_tokens)
+    )
 
-    # 4. Call Gemini
-    try:
-        response = llm.invoke([
+    # 3. Serve from the persistent generation cache when sources and prompt are unchanged
+    with stage_timer("generation_cache"):
+        cached = await get_cached_generation(db, company_id, mode, source_hash, prompt_version)
+    if cached is not None:
+        content, cached_sources = cached.content, cached.sources
+        await release_connection(db)
+        return {
+            "status": "cached",
+            "content": content,
+            "sources": cached_sources
+        }
+
+    # 4. Construct the context string
+    raw_texts = dict((await db.execute(
+        select(Document.id, Document.raw_text).filter(Document.id.in_([row.id for row in doc_rows]))
+    )).all())
+    await release_connection(db)
+
+    ready = {
+        "status": "ready",
+        "sources": sources,
+        "source_hash": source_hash,
+        "prompt_version": prompt_version,
+        "system_prompt": system_prompt,
+        "parts": None,
+        "messages": None
+    }
+
+    # 5. Oversized sections go through map-reduce instead of a single prompt
+    if needs_map_reduce(raw_texts.values()):
+        ready["parts"] = plan_parts([(row.item_name, raw_texts[row.id]) for row in doc_rows])
+        ready["map_prompt_version"] = compute_prompt_version(LLM_MODEL, MAP_PROMPT, MAP_FOCUS[mode], MAP_REQUEST)
+        return ready
+
+    context_str = "\n\n".join([f"--- {row.item_name} ---\n{raw_texts[row.id]}" for row in doc_rows])
+    ready["messages"] = [
             ("system", system_prompt),
-            ("human", f"Please generate the {mode} based on the following SEC filings:\n\n{context_str}")
-        ])
-        answer_text = response.content
+            ("human", GENERATION_REQUEST.format(mode=mode, context=context_str))
+        ]
+    return ready
+
+async def build_generation_messages(db: AsyncSession, prepared: dict, mode: str):
+    """
+    Messages for the final LLM call. For map-reduce plans this runs the map
+    step first and builds the prompt from the part notes instead of raw text.
+    """
+    if prepared["parts"] is None:
+        return prepared["messages"]
+    # Part calls run concurrently, so "map" is wall time and the "llm" total can exceed it
+    with stage_timer("map"):
+        notes = await summarize_parts(
+            db, prepared["parts"], mode, prepared["map_prompt_version"], call_map_llm, release_connection
+        )
+    return [
+        ("system", prepared["system_prompt"]),
+        ("human", GENERATION_REQUEST.format(mode=mode, context=build_reduce_context(prepared["parts"], notes)))
+    ]
+
+async def generate_specialized_content(db: AsyncSession, company_id: int, mode: str):
+    """
+    Bypasses vector search to pull specific full-text documents based on the mode,
+    then leverages Gemini's large context window to generate comprehensive outputs.
+    """
+    prepared = await prepare_generation(db, company_id, mode)
+
+    if prepared["status"] == "missing":
+        return {"content": prepared["content"], "sources": []}
+
+    if prepared["status"] == "cached":
+        log_generation_audit(company_id, mode, prepared["content"], cache_hit=True)
+        return {"content": prepared["content"], "sources": prepared["sources"], "cached": True}
+
+    # 5. Call Gemini (map step first for oversized sections)
+    try:
+        messages = await build_generation_messages(db, prepared, mode)
+        answer_text = await call_llm(messages, "generation")
+    except LLMUnavailable as e:
+        log_generation_audit(company_id, mode, f"Error calling Gemini API: {str(e)}", cache_hit=False)
+        raise
     except Exception as e:
         answer_text = f"Error calling Gemini API: {str(e)}"
+        log_generation_audit(company_id, mode, answer_text, cache_hit=False)
+    else:
+        # 6. Audit Logging, before the cache write so a failed write can't skip it
+        log_generation_audit(company_id, mode, answer_text, cache_hit=False)
+        # Only successful generations are worth reusing
+        await cache_generation(db, company_id, mode, prepared, answer_text)
+
+    return {
+        "content": answer_text,
+        "sources": prepared["sources"]
+    }
 
-    # 5. Audit Logging
-    audit = AuditLog(
+async def stream_specialized_content(db: AsyncSession, company_id: int, mode: str):
+    """
+    Streaming variant of generate_specialized_content, same event protocol as
+    stream_rag. Cache hits are sent as a single token event.
+    """
+    prepared = await prepare_generation(db, company_id, mode)
+    yield ("sources", prepared["sources"])
+
+    if prepared["status"] == "missing":
+        yield ("token", prepared["content"])
+        yield ("done", {})
+        return
+
+    if prepared["status"] == "cached":
+        yield ("token", prepared["content"])
+        log_generation_audit(company_id, mode, prepared["content"], cache_hit=True)
+        yield ("done", {"cached": True})
+        return
+
+    parts = []
+    failed = []
+    completed = False
+    try:
+        if prepared["parts"] is not None:
+            # The map step can take a while; let the client know something is happening
+            yield ("progress", {"stage": "map", "parts": len(prepared["parts"])})
+        try:
+            messages = await build_generation_messages(db, prepared, mode)
+        except Exception as e:
+            # Same shape as a stream_llm failure, so the audit log records it
+            messages = None
+            message = f"Error calling Gemini API: {str(e)}"
+            parts.append(message)
+            failed.append(message)
+            yield ("error", message)
+        if messages is not None:
+            async for event, data in stream_llm(messages, parts.append, "generation"):
+                if event == "error":
+                    failed.append(data)
+                yield (event, data)
+        completed = True
+    finally:
+        # If the client went away we keep the partial output for compliance but
+        # never cache it. Shielded so a disconnect can't cancel the cache write.
+        with CancelScope(shield=True):
+            answer_text = "".join(parts)
+            log_generation_audit(company_id, mode, answer_text, cache_hit=False)
+            if completed and not failed:
+                await cache_generation(db, company_id, mode, prepared, answer_text)
+    yield ("done", {})
+
+async def cache_generation(db: AsyncSession, company_id: int, mode: str, prepared: dict, answer_text: str):
+    """
+    Stores a finished generation for reuse. The cache is an optimization: a
+    failed write is logged and the answer is still returned.
+    """
+    try:
+        await store_generation(
+            db, company_id, mode, prepared["source_hash"], prepared["prompt_version"],
+            answer_text, prepared["sources"]
+        )
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        print(f"Generation cache write failed for company {company_id} ({mode}): {str(e)}")
+
+def log_generation_audit(company_id: int, mode: str, answer_text: str, cache_hit: bool):
+    record_audit(
         company_id=company_id,
         query_text=f"System triggered specialized generation: {mode}",
         retrieved_chunk_ids=[], # We didn't use chunks, we used full docs
         llm_mode=mode,
-        llm_response=answer_text
+        llm_response=answer_text,
+        cache_hit=cache_hit
     )
-    db.add(audit)
-    db.commit()
-
-    return {
-        "content": answer_text,
-        "sources": sources
-    }
\ No newline at end of file
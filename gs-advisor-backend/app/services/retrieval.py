@@ -0,0 +1,40 @@
+"""
+Lexical retrieval and rank fusion for hybrid search.
+
+MiniLM embeddings blur exact figures, tickers and defined terms ("Tier 1
+capital", "goodwill impairment"). Postgres full-text search over
+chunks.chunk_tsv catches those; reciprocal rank fusion merges the two
+rankings without having to calibrate cosine distances against ts_rank.
+"""
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.domain import Chunk, TEXT_SEARCH_CONFIG
+
+
+def _lexical_query(company_id: int, query_text: str, k: int):
+    # websearch_to_tsquery never raises on user input ("quoted phrases", -exclusions, OR)
+    ts_query = func.websearch_to_tsquery(TEXT_SEARCH_CONFIG, query_text)
+    return (
+        select(Chunk.id)
+        .filter(Chunk.company_id == company_id, Chunk.chunk_tsv.op("@@")(ts_query))
+        .order_by(func.ts_rank_cd(Chunk.chunk_tsv, ts_query).desc(), Chunk.id)
+        .limit(k)
+    )
+
+
+async def lexical_search(db: AsyncSession, company_id: int, query_text: str, k: int):
+    """Chunk IDs ranked by full-text relevance; empty when no term matches."""
+    return (await db.scalars(_lexical_query(company_id, query_text, k))).all()
+
+
+def reciprocal_rank_fusion(rankings, k: int, rrf_k: int = 60):
+    """
+    Merges ranked ID lists: each ID scores sum(1 / (rrf_k + rank)) over the
+    lists it appears in (rank starting at 1). Returns the top k IDs, ties
+    broken by first appearance.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
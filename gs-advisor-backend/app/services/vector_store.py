@@ -0,0 +1,352 @@
+"""
+Vector search backends used by query_rag.
+
+- PgVectorStore: searches the chunk embeddings inside Postgres (ANN index +
+  SET LOCAL knobs), stored per settings.embedding_storage: float32, float16,
+  or float16 behind a binary-quantized index whose candidates are re-ranked.
+- NumpyVectorStore: keeps one memory-mapped float32 matrix per company on disk
+  and does exact top-k in process (on a worker thread, off the event loop),
+  so retrieval needs no database round trip. It is rebuilt incrementally from
+  the chunks table with sync().
+"""
+import asyncio
+import glob
+import json
+import os
+import threading
+from functools import lru_cache
+import numpy as np
+from pgvector.sqlalchemy import BIT, HALFVEC
+from sqlalchemy import Integer, cast, func, literal, select, true
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import configure_vector_search, configure_vector_search_async
+from app.models.domain import EMBEDDING_DIM, Chunk
+
+
+class VectorStore:
+    """
+    Returns chunk IDs ranked by similarity to a query embedding.
+    """
+
+    def search(self, company_id: int, query_embedding, k: int, db: Session = None):
+        raise NotImplementedError
+
+    async def asearch(self, company_id: int, query_embedding, k: int, db=None):
+        """Async variant for the request path; db is an AsyncSession."""
+        return self.search(company_id, query_embedding, k)
+
+    async def asearch_many(self, company_ids, query_embedding, k: int, db=None):
+        """Top-k per company for one query: {company_id: [chunk_id, ...]}."""
+        return {
+            company_id: await self.asearch(company_id, query_embedding, k, db=db)
+            for company_id in company_ids
+        }
+
+    def sync(self, db: Session):
+        """Bring the store up to date with the chunks table (no-op for pgvector)."""
+
+    def sync_company(self, db: Session, company_id: int):
+        """Refresh a single company after it was (re-)ingested."""
+
+
+def embedding_attribute() -> str:
+    """The Chunk attribute that holds embeddings under the configured storage."""
+    return "embedding" if settings.embedding_storage == "vector" else "embedding_half"
+
+
+def embedding_column():
+    return getattr(Chunk, embedding_attribute())
+
+
+def embedding_values(embedding):
+    """A loaded embedding as an array (halfvec rows load as HalfVector objects)."""
+    return embedding.to_numpy() if hasattr(embedding, "to_numpy") else embedding
+
+
+def _binary_code(expression):
+    # Must match the index expression in database.EMBEDDING_INDEX_TARGETS
+    return cast(func.binary_quantize(expression), BIT(EMBEDDING_DIM))
+
+
+def _ranked(company_id_filter, query_embedding, k: int):
+    """
+    (chunk id, distance) query for one company's top-k, best first. Under
+    "binary" storage the index pass orders by Hamming distance between bit
+    codes, and only its k * binary_rerank_factor candidates are ranked by
+    exact L2 distance on the halfvec values.
+    """
+    if settings.embedding_storage != "binary":
+        distance = embedding_column().l2_distance(query_embedding)
+        return (
+            select(Chunk.id.label("chunk_id"), distance.label("distance"))
+            .filter(company_id_filter)
+            .order_by(distance)
+            .limit(k)
+        )
+    query_half = cast(literal(query_embedding, HALFVEC(EMBEDDING_DIM)), HALFVEC(EMBEDDING_DIM))
+    candidates = (
+        select(Chunk.id, Chunk.embedding_half)
+        .filter(company_id_filter)
+        .order_by(_binary_code(Chunk.embedding_half).hamming_distance(_binary_code(query_half)))
+        .limit(k * max(1, settings.binary_rerank_factor))
+        # Inside _search_many_query's LATERAL, the company comes from the outer query
+        .correlate_except(Chunk)
+        .lateral("candidates")
+    )
+    distance = candidates.c.embedding_half.l2_distance(query_half)
+    return (
+        select(candidates.c.id.label("chunk_id"), distance.label("distance"))
+        .order_by(distance)
+        .limit(k)
+    )
+
+
+def _search_query(company_id: int, query_embedding, k: int):
+    ranked = _ranked(Chunk.company_id == company_id, query_embedding, k).subquery("ranked")
+    return select(ranked.c.chunk_id).order_by(ranked.c.distance)
+
+
+def _search_many_query(company_ids, query_embedding, k: int):
+    """
+    One statement for every company: a LATERAL subquery runs the usual
+    company-filtered ANN search once per ID in the unnested array.
+    """
+    companies = select(
+        func.unnest(literal(list(company_ids), ARRAY(Integer))).label("company_id")
+    ).subquery("companies")
+    top = _ranked(Chunk.company_id == companies.c.company_id, query_embedding, k).lateral("top")
+    return (
+        select(companies.c.company_id, top.c.chunk_id)
+        .select_from(companies)
+        .join(top, true())
+        .order_by(companies.c.company_id, top.c.distance)
+    )
+
+
+class PgVectorStore(VectorStore):
+
+    def search(self, company_id: int, query_embedding, k: int, db: Session = None):
+        if db is None:
+            raise ValueError("PgVectorStore.search requires a database session")
+        configure_vector_search(db)
+        return db.scalars(_search_query(company_id, query_embedding, k)).all()
+
+    async def asearch(self, company_id: int, query_embedding, k: int, db=None):
+        if db is None:
+            raise ValueError("PgVectorStore.asearch requires a database session")
+        await configure_vector_search_async(db)
+        return (await db.scalars(_search_query(company_id, query_embedding, k))).all()
+
+    async def asearch_many(self, company_ids, query_embedding, k: int, db=None):
+        if db is None:
+            raise ValueError("PgVectorStore.asearch_many requires a database session")
+        await configure_vector_search_async(db)
+        results = {company_id: [] for company_id in company_ids}
+        for company_id, chunk_id in (await db.execute(_search_many_query(company_ids, query_embedding, k))).all():
+            results[company_id].append(chunk_id)
+        return results
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    """
+    Row indices of the k best dot-product scores, best first. argpartition
+    keeps this O(n) for the selection; only the k winners get sorted.
+    """
+    scores = matrix @ query
+    if k >= len(scores):
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    One file per company in `directory`, company_<id>.vec: the row count
+    (int64), the chunk IDs (int64) and the row-major float32 matrix of
+    L2-normalized rows. IDs and rows live in one file so a rebuild is a
+    single rename: a search sees either the old pair or the new one. The
+    (ids, matrix) pair is loaded and cached under the lock, from one open
+    file, so the two can never come from different versions.
+
+    manifest.json records (count, max chunk id) per company so sync() only
+    reloads companies whose chunks changed. Embeddings are unit-normalized,
+    so the dot-product ranking matches pgvector's L2 ranking.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._loaded = {}
+        self._manifest_path = os.path.join(directory, "manifest.json")
+        self.manifest = {}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                # Entries without a file (e.g. written in the old two-file layout) are rebuilt by sync()
+                self.manifest = {
+                    company_id: signature for company_id, signature in json.load(f).items()
+                    if os.path.exists(self._path(int(company_id)))
+                }
+        for path in glob.glob(os.path.join(directory, "company_*.f32")) + glob.glob(os.path.join(directory, "company_*.ids.npy")):
+            os.remove(path)
+
+    def _path(self, company_id: int) -> str:
+        return os.path.join(self.directory, f"company_{company_id}.vec")
+
+    def _save_manifest(self):
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _load(self, company_id: int):
+        with self._lock:
+            entry = self._loaded.get(company_id)
+            if entry is not None:
+                return entry
+            path = self._path(company_id)
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as f:
+                count = int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+                ids = np.frombuffer(f.read(8 * count), dtype=np.int64)
+                if count == 0:
+                    # An empty matrix can't be memory-mapped
+                    matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+                else:
+                    # Mapped from the same open file as the IDs; the mapping outlives the close
+                    matrix = np.memmap(f, dtype=np.float32, mode="r", offset=8 + 8 * count,
+                                       shape=(count, EMBEDDING_DIM))
+            entry = (ids, matrix)
+            self._loaded[company_id] = entry
+            return entry
+
+    def add_company(self, company_id: int, chunk_ids, embeddings, signature=None):
+        """
+        Replaces the stored matrix for a company. The file is written to a
+        temp path and renamed over the old one; searches holding the old
+        mapping finish on it, later ones load the new file.
+        """
+        ids = np.asarray(chunk_ids, dtype=np.int64)
+        matrix = _normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), EMBEDDING_DIM))
+        path = self._path(company_id)
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(np.int64(len(ids)).tobytes())
+            f.write(ids.tobytes())
+            f.write(matrix.astype(np.float32, copy=False).tobytes())
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._loaded.pop(company_id, None)
+            self.manifest[str(company_id)] = signature or [len(ids), int(ids.max()) if len(ids) else 0]
+            self._save_manifest()
+
+    def remove_company(self, company_id: int):
+        with self._lock:
+            path = self._path(company_id)
+            if os.path.exists(path):
+                os.remove(path)
+            self._loaded.pop(company_id, None)
+            self.manifest.pop(str(company_id), None)
+            self._save_manifest()
+
+    def search(self, company_id: int, query_embedding, k: int, db: Session = None):
+        entry = self._load(company_id)
+        if entry is None or len(entry[0]) == 0:
+            return []
+        ids, matrix = entry
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        return [int(i) for i in ids[top_k(matrix, query, k)]]
+
+    async def asearch(self, company_id: int, query_embedding, k: int, db=None):
+        # A matrix product over a page-faulting memmap: keep it off the event loop
+        return await asyncio.to_thread(self.search, company_id, query_embedding, k)
+
+    async def asearch_many(self, company_ids, query_embedding, k: int, db=None):
+        return await asyncio.to_thread(
+            lambda: {company_id: self.search(company_id, query_embedding, k) for company_id in company_ids}
+        )
+
+    def _company_signatures(self, db: Session, company_id: int = None):
+        query = select(Chunk.company_id, func.count(Chunk.id), func.max(Chunk.id)).filter(
+            Chunk.company_id.isnot(None)
+        )
+        if company_id is not None:
+            query = query.filter(Chunk.company_id == company_id)
+        rows = db.execute(query.group_by(Chunk.company_id)).all()
+        return {str(cid): [count, max_id] for cid, count, max_id in rows}
+
+    def _rebuild(self, db: Session, company_id: int, signature):
+        rows = db.execute(
+            select(Chunk.id, embedding_column().label("embedding"))
+            .filter(Chunk.company_id == company_id)
+            .order_by(Chunk.id)
+        ).all()
+        self.add_company(
+            company_id,
+            [row.id for row in rows],
+            [embedding_values(row.embedding) for row in rows],
+            signature=signature
+        )
+
+    def sync(self, db: Session):
+        """
+        Rebuilds only companies whose (chunk count, max chunk id) changed
+        since the last sync, and drops companies that no longer have chunks.
+        Returns the number of companies rebuilt.
+        """
+        signatures = self._company_signatures(db)
+        rebuilt = 0
+        for company_id, signature in signatures.items():
+            if self.manifest.get(company_id) != signature:
+                self._rebuild(db, int(company_id), signature)
+                rebuilt += 1
+        for company_id in set(self.manifest) - set(signatures):
+            self.remove_company(int(company_id))
+        return rebuilt
+
+    def sync_company(self, db: Session, company_id: int):
+        signature = self._company_signatures(db, company_id).get(str(company_id))
+        if signature is None:
+            self.remove_company(company_id)
+        elif self.manifest.get(str(company_id)) != signature:
+            self._rebuild(db, company_id, signature)
+
+
+def sync_vector_store(session_factory):
+    db = session_factory()
+    try:
+        return get_vector_store().sync(db)
+    finally:
+        db.close()
+
+
+async def run_periodic_sync(session_factory, interval: int):
+    """
+    Keeps an in-process store in step with ingestion done by other processes
+    (batch_ingest.py, other API pods).
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            rebuilt = await asyncio.to_thread(sync_vector_store, session_factory)
+            if rebuilt:
+                print(f"Vector store: rebuilt {rebuilt} companies")
+        except Exception as e:
+            print(f"Vector store sync failed: {str(e)}")
+
+
+@lru_cache
+def get_vector_store() -> VectorStore:
+    if settings.vector_store_backend == "numpy":
+        return NumpyVectorStore(settings.vector_store_dir)
+    return PgVectorStore()
@@ -1,15 +1,18 @@
 import os
 import json
+import argparse
 from datetime import datetime
 from pathlib import Path
 from sqlalchemy.orm import Session
 from app.core.database import SessionLocal, init_db
 from app.services.ingestion import ingest_10k_json
+from app.services.ingestion_pipeline import DEFAULT_EMBED_BATCH_SIZE, run_pipeline
 
 # Dynamically find the 10K-data/extracted folder
 # Path: financial-advisor/gs-advisor-backend/batch_ingest.py -> parent is backend -> parent is root
 root_dir = Path(__file__).resolve().parent.parent
 EXTRACTED_DIR = os.path.join(root_dir, "10K-data", "extracted")
+MANIFEST_PATH = os.path.join(root_dir, "10K-data", "ingest_manifest.json")
 
 def run_batch_ingestion():
     # Trigger table creation (this creates the 'filename' column now)
@@ -43,5 +46,57 @@ def run_batch_ingestion():
     print(f"\nCOMPLETED. Successfully ingested {success_count} companies.")
     db.close()
 
+def run_pipelined_ingestion(workers=None, embed_batch_size=DEFAULT_EMBED_BATCH_SIZE,
+                            manifest_path=MANIFEST_PATH, resume=True):
+    """
+    Parallel variant of run_batch_ingestion: parsing/chunking on a process pool,
+    cross-file embedding batches, COPY-based inserts and a resumable manifest.
+    """
+    print("Initializing database schema...")
+    init_db()
+
+    if not os.path.exists(EXTRACTED_DIR):
+        print(f"Error: Could not find directory at {EXTRACTED_DIR}")
+        return
+
+    files = sorted(
+        os.path.join(EXTRACTED_DIR, f) for f in os.listdir(EXTRACTED_DIR) if f.endswith('.json')
+    )
+    print(f"Found {len(files)} JSON files. Starting pipelined ingestion...")
+
+    started = datetime.now()
+    stats = run_pipeline(
+        files,
+        SessionLocal,
+        manifest_path,
+        workers=workers,
+        embed_batch_size=embed_batch_size,
+        resume=resume
+    )
+    elapsed = (datetime.now() - started).total_seconds()
+
+    print(f"\nCOMPLETED in {elapsed:.1f}s. {json.dumps(stats)}")
+
 if __name__ == "__main__":
-    run_batch_ingestion()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Ingest extracted 10-K JSON files into Postgres.")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Use the parallel, resumable ingestion pipeline.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Parser processes for --pipeline (default: CPU count).")
+    parser.add_argument("--embed-batch-size", type=int, default=DEFAULT_EMBED_BATCH_SIZE,
+                        help="Chunks per embedding batch for --pipeline.")
+    parser.add_argument("--manifest", default=MANIFEST_PATH,
+                        help="Manifest of completed files for --pipeline.")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Ignore the manifest and re-ingest every file.")
+    args = parser.parse_args()
+
+    if args.pipeline:
+        run_pipelined_ingestion(
+            workers=args.workers,
+            embed_batch_size=args.embed_batch_size,
+            manifest_path=args.manifest,
+            resume=not args.no_resume
+        )
+    else:
+        run_batch_ingestion()
@@ -0,0 +1,568 @@
+"""
+Performance benchmark for ingestion, retrieval, chat and generation.
+
+Generates a synthetic 10-K corpus in the JSON schema ingest_10k_json reads,
+runs it through the hot paths with a deterministic stub in place of Gemini,
+and writes throughput, p50/p95/p99 latency, retrieval recall (known-item
+queries, see eval_retrieval.py) and the per-stage breakdown from
+app/core/metrics.py as JSON.
+
+Backends:
+  memory    No database. Chunking and embedding, the numpy vector store,
+            context building and the stub LLM. Vector retrieval only.
+  postgres  The configured DATABASE_URL: ingest_10k_json, every retrieval
+            mode, and POST /chat and /generate/* through the ASGI app (needs
+            httpx). Benchmark companies get CIKs 99xxxxxxxx and their
+            documents, cached generations and part notes are cleared first,
+            so every run is cold. Point it at a scratch database.
+
+    python benchmark.py --companies 20 --section-words 3000
+    python benchmark.py --backend postgres --out results.json
+    python benchmark.py --baseline results.json --tolerance 0.2   # exits 1 on a regression
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime
+
+# The stub replaces the Gemini client before any call; the constructor only needs a key to exist
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-stub")
+
+from app.core.config import settings
+from app.core.metrics import STAGE_SECONDS, stage_timer
+from app.services import rag
+from app.services.embeddings import embed_documents
+from app.services.filings import build_text_splitter, iter_sections, load_filing
+from app.services.llm_client import get_llm_client
+from ann_report import latency_summary
+from eval_retrieval import evaluate, known_item_queries
+
+# --- Synthetic corpus ---
+
+SEGMENTS = [
+    "cloud services", "consumer lending", "industrial automation", "specialty pharmaceuticals",
+    "payments", "semiconductor equipment", "asset management", "renewable energy",
+]
+REGIONS = ["North America", "Europe", "Latin America", "Asia Pacific", "the Middle East", "Japan"]
+RISKS = [
+    "interest rate volatility", "a cybersecurity incident", "supply chain disruption",
+    "new banking regulation", "customer concentration", "foreign exchange exposure",
+    "pending litigation", "the loss of key personnel", "a prolonged recession",
+]
+METRICS = [
+    "net revenue", "operating margin", "free cash flow", "gross margin",
+    "net interest income", "diluted earnings per share", "Tier 1 capital ratio",
+]
+SYLLABLES = ["ka", "lor", "vex", "tri", "mon", "qua", "zen", "dor", "pi", "sul", "bex", "ran", "tho", "mi"]
+PRODUCT_KINDS = ["Platform", "Suite", "Engine", "Card", "Fund", "Cloud", "Reactor", "Exchange"]
+
+SENTENCES = {
+    "item_1": [
+        "{company} sells {product} to customers in {region} through its {segment} segment.",
+        "{product} accounted for {pct}% of {segment} revenue in fiscal {year}.",
+        "We employed {count} people across {region} at the end of fiscal {year}.",
+        "Our {segment} business competes on price, reliability and the breadth of {product}.",
+    ],
+    "item_1A": [
+        "{risk} could reduce our {metric} by as much as {pct}% in fiscal {year}.",
+        "Demand for {product} in {region} may fall if {risk} persists.",
+        "We cannot assure you that {risk} will not harm the {segment} segment.",
+        "{company} depends on {count} suppliers in {region}, exposing it to {risk}.",
+    ],
+    "item_7": [
+        "{metric} for the {segment} segment was ${amount} million in fiscal {year}, up {pct}% year over year.",
+        "Sales of {product} in {region} grew {pct}% to ${amount} million.",
+        "{metric} declined {pct}% as {risk} weighed on {region}.",
+        "Capital expenditures of ${amount} million funded {count} new {product} deployments.",
+    ],
+}
+
+BENCHMARK_CIK_PREFIX = "99"
+
+
+def benchmark_cik(index: int) -> str:
+    return f"{BENCHMARK_CIK_PREFIX}{index:08d}"
+
+
+def generate_filing(index: int, section_words: int, seed: int) -> dict:
+    """
+    One synthetic 10-K. Each company draws from its own RNG, so a filing is
+    identical for a given (index, seed) whatever the corpus size.
+    """
+    rng = random.Random(f"{seed}-{index}")
+    company = "".join(rng.choice(SYLLABLES) for _ in range(3)).title() + " Holdings"
+    products = [
+        "".join(rng.choice(SYLLABLES) for _ in range(3)).title() + " " + rng.choice(PRODUCT_KINDS)
+        for _ in range(4)
+    ]
+    segments = rng.sample(SEGMENTS, 3)
+
+    def section(item_code):
+        paragraphs = []
+        words = 0
+        while words < section_words:
+            sentences = [
+                rng.choice(SENTENCES[item_code]).format(
+                    company=company,
+                    product=rng.choice(products),
+                    segment=rng.choice(segments),
+                    region=rng.choice(REGIONS),
+                    risk=rng.choice(RISKS),
+                    metric=rng.choice(METRICS),
+                    pct=rng.randint(1, 60),
+                    amount=f"{rng.randint(5, 9000):,}",
+                    count=f"{rng.randint(20, 90000):,}",
+                    year=rng.randint(2018, 2024),
+                )
+                for _ in range(rng.randint(3, 7))
+            ]
+            paragraph = " ".join(sentences)
+            paragraphs.append(paragraph[0].upper() + paragraph[1:])
+            words += len(paragraph.split())
+        return "\n\n".join(paragraphs)
+
+    return {
+        "cik": benchmark_cik(index),
+        "company": company,
+        "filing_date": "2024-02-15",
+        "filing_type": "10-K",
+        "period_of_report": "2023-12-31",
+        "item_1": section("item_1"),
+        "item_1A": section("item_1A"),
+        "item_7": section("item_7"),
+    }
+
+
+def write_corpus(directory: str, companies: int, section_words: int, seed: int):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(companies):
+        path = os.path.join(directory, f"benchmark_{index:05d}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(generate_filing(index, section_words, seed), f)
+        paths.append(path)
+    return paths
+
+
+# --- Stub LLM ---
+
+class StubMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StubLLM:
+    """
+    Stands in for ChatGoogleGenerativeAI. Answers are derived from a hash of
+    the prompt, so runs are reproducible, and arrive after latency_ms (time
+    to first token) plus token_ms per token.
+    """
+
+    def __init__(self, latency_ms: float, tokens: int, token_ms: float):
+        self.latency = latency_ms / 1000
+        self.tokens = tokens
+        self.token_delay = token_ms / 1000
+
+    def _answer(self, messages) -> str:
+        digest = hashlib.sha256(repr(messages).encode("utf-8")).hexdigest()
+        return " ".join(digest[i % 56:i % 56 + 8] for i in range(self.tokens))
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.latency + self.tokens * self.token_delay)
+        return StubMessage(self._answer(messages))
+
+    async def astream(self, messages):
+        await asyncio.sleep(self.latency)
+        for word in self._answer(messages).split(" "):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield StubMessage(word + " ")
+
+
+# --- Measurement helpers ---
+
+def throughput_summary(latencies, seconds: float, unit: str = "requests") -> dict:
+    return {
+        unit: len(latencies),
+        "seconds": round(seconds, 3),
+        f"{unit}_per_s": round(len(latencies) / seconds, 2) if seconds else 0.0,
+        **latency_summary(latencies),
+    }
+
+
+async def run_concurrently(calls, concurrency: int):
+    """
+    Awaits every call() with at most `concurrency` in flight.
+    Returns (latencies in ms, wall-clock seconds).
+    """
+    limiter = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(call):
+        async with limiter:
+            started = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(call) for call in calls))
+    return latencies, time.perf_counter() - started
+
+
+def stage_breakdown() -> dict:
+    """Totals of advisor_stage_seconds for the whole run, per stage."""
+    stages = {}
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            stage = stages.setdefault(sample.labels["stage"], {})
+            if sample.name.endswith("_sum"):
+                stage["seconds"] = round(sample.value, 3)
+            elif sample.name.endswith("_count"):
+                stage["count"] = int(sample.value)
+    for stage in stages.values():
+        stage["mean_ms"] = round(stage["seconds"] * 1000 / stage["count"], 2) if stage.get("count") else 0.0
+    return stages
+
+
+def clear_query_caches():
+    # Every phase starts cold, so results don't depend on phase order
+    rag.query_embedding_cache.clear()
+    rag.retrieval_cache.clear()
+
+
+# --- memory backend ---
+
+ChunkRow = namedtuple("ChunkRow", "id company_id document_id chunk_index chunk_text item_name")
+
+
+def ingest_memory(paths, store):
+    """
+    Chunks and embeds every filing (per section, like ingest_10k_json) into
+    the numpy vector store. Returns (summary, chunk rows).
+    """
+    splitter = build_text_splitter()
+    rows = []
+    timings = {}
+    latencies = []
+    document_id = 0
+    started = time.perf_counter()
+    for company_id, path in enumerate(paths, start=1):
+        file_started = time.perf_counter()
+        embeddings = []
+        company_rows = []
+        for _, item_name, raw_text in iter_sections(load_filing(path)):
+            document_id += 1
+            with stage_timer("ingest_chunk", timings):
+                chunks = splitter.split_text(raw_text)
+            with stage_timer("ingest_embed", timings):
+                embeddings.extend(embed_documents(chunks))
+            for chunk_index, chunk_text in enumerate(chunks):
+                chunk_id = len(rows) + len(company_rows) + 1
+                company_rows.append(ChunkRow(chunk_id, company_id, document_id, chunk_index, chunk_text, item_name))
+        with stage_timer("ingest_insert", timings):
+            store.add_company(company_id, [row.id for row in company_rows], embeddings)
+        rows.extend(company_rows)
+        latencies.append((time.perf_counter() - file_started) * 1000)
+    elapsed = time.perf_counter() - started
+    return {
+        **throughput_summary(latencies, elapsed, "files"),
+        "chunks": len(rows),
+        "chunks_per_s": round(len(rows) / elapsed, 2) if elapsed else 0.0,
+        "timings": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+    }, rows
+
+
+async def run_memory(args, paths, results):
+    from app.services.vector_store import NumpyVectorStore
+
+    with tempfile.TemporaryDirectory(prefix="benchmark-store-") as store_dir:
+        store = NumpyVectorStore(store_dir)
+        print(f"Ingesting {len(paths)} filings (memory)...")
+        results["ingestion"], rows = ingest_memory(paths, store)
+        rows_by_id = {row.id: row for row in rows}
+
+        rng = random.Random(args.seed)
+        queries = known_item_queries(rng.sample(rows, min(args.queries, len(rows))), args.query_words, rng)
+
+        async def search(item, k):
+            embedding = await rag.embed_query_cached(item["query"])
+            with stage_timer("retrieve"):
+                return store.search(item["company_id"], embedding, k)
+
+        print(f"Retrieval: {len(queries)} known-item queries...")
+        clear_query_caches()
+        results["retrieval"] = [await evaluate("vector", queries, args.ks, search)]
+
+        async def chat(item):
+            ids = await search(item, settings.retrieval_top_k)
+            prepared = rag.build_chat_prompt(item["query"], [rows_by_id[chunk_id] for chunk_id in ids])
+            await rag.call_llm(prepared["messages"])
+
+        print(f"Chat: {len(queries)} requests, concurrency {args.concurrency}...")
+        clear_query_caches()
+        latencies, seconds = await run_concurrently(
+            [lambda item=item: chat(item) for item in queries], args.concurrency
+        )
+        results["chat"] = throughput_summary(latencies, seconds)
+        # Specialized generation reads sections and its cache from Postgres
+        results["generation"] = None
+
+
+# --- postgres backend ---
+
+def reset_benchmark_companies(paths):
+    """
+    Deletes what earlier runs stored for the benchmark CIKs (company rows are
+    kept: audit records point at them).
+    """
+    from sqlalchemy import select
+    from app.core.database import SessionLocal
+    from app.models.domain import Company, Document, GenerationCache, SectionSummary
+    from app.services.ingestion import delete_documents
+    from app.services.map_reduce import plan_parts
+
+    filings = [load_filing(path) for path in paths]
+    part_hashes = [
+        part["hash"]
+        for data in filings
+        for part in plan_parts([(item_name, raw_text) for _, item_name, raw_text in iter_sections(data)])
+    ]
+    db = SessionLocal()
+    try:
+        company_ids = db.scalars(select(Company.id).filter(Company.cik.in_([data["cik"] for data in filings]))).all()
+        if company_ids:
+            delete_documents(db, db.scalars(select(Document.id).filter(Document.company_id.in_(company_ids))).all())
+            db.query(GenerationCache).filter(GenerationCache.company_id.in_(company_ids)).delete(synchronize_session=False)
+        db.query(SectionSummary).filter(SectionSummary.content_hash.in_(part_hashes)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def ingest_postgres(paths):
+    """Runs ingest_10k_json on every filing. Returns (summary, company IDs)."""
+    from app.core.database import SessionLocal
+    from app.services.ingestion import ingest_10k_json
+    from app.services.jobs import refresh_company
+
+    company_ids = []
+    timings = {}
+    latencies = []
+    chunks = 0
+    elapsed = 0.0
+    db = SessionLocal()
+    try:
+        for path in paths:
+            started = time.perf_counter()
+            report = ingest_10k_json(path, db)
+            latencies.append((time.perf_counter() - started) * 1000)
+            elapsed += time.perf_counter() - started
+            for stage, seconds in report["timings"].items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+            chunks += report["chunks_embedded"] + report["chunks_reused"]
+            company_ids.append(report["company_id"])
+            # Not timed: what POST /ingest does once the job is done
+            refresh_company(report["company_id"])
+    finally:
+        db.close()
+    return {
+        **throughput_summary(latencies, elapsed, "files"),
+        "chunks": chunks,
+        "chunks_per_s": round(chunks / elapsed, 2) if elapsed else 0.0,
+        "timings": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+    }, company_ids
+
+
+async def run_postgres(args, paths, results):
+    from httpx import ASGITransport, AsyncClient
+    from sqlalchemy import select
+    from app.core.database import SessionLocal, init_db
+    from app.models.domain import Chunk
+    from app.services.audit import shutdown_audit_writer
+    from eval_retrieval import evaluate_mode
+    from app.main import app
+
+    init_db()
+    reset_benchmark_companies(paths)
+    print(f"Ingesting {len(paths)} filings (postgres)...")
+    results["ingestion"], company_ids = ingest_postgres(paths)
+
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(Chunk.id, Chunk.company_id, Chunk.chunk_text)
+            .filter(Chunk.company_id.in_(company_ids))
+            .order_by(Chunk.id)
+        ).all()
+    finally:
+        db.close()
+    rng = random.Random(args.seed)
+    queries = known_item_queries(rng.sample(rows, min(args.queries, len(rows))), args.query_words, rng)
+
+    print(f"Retrieval: {len(queries)} known-item queries, modes {', '.join(args.modes)}...")
+    results["retrieval"] = [await evaluate_mode(mode, queries, args.ks) for mode in args.modes]
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://benchmark") as client:
+        async def post(path, body):
+            response = await client.post(path, json=body)
+            response.raise_for_status()
+            return response.json()
+
+        print(f"Chat: {len(queries)} requests, concurrency {args.concurrency}...")
+        clear_query_caches()
+        latencies, seconds = await run_concurrently(
+            [
+                lambda item=item: post("/api/v1/chat", {"company_id": item["company_id"], "query": item["query"]})
+                for item in queries
+            ],
+            args.concurrency
+        )
+        results["chat"] = throughput_summary(latencies, seconds)
+
+        generation_ids = company_ids[:args.generation_companies]
+        results["generation"] = []
+        for kind in ("summary", "risk", "email"):
+            print(f"Generation: /generate/{kind} for {len(generation_ids)} companies, cold then cached...")
+            row = {"endpoint": f"/generate/{kind}"}
+            for phase in ("cold", "cached"):
+                latencies, seconds = await run_concurrently(
+                    [
+                        lambda company_id=company_id: post(f"/api/v1/generate/{kind}", {"company_id": company_id})
+                        for company_id in generation_ids
+                    ],
+                    args.concurrency
+                )
+                row[phase] = throughput_summary(latencies, seconds)
+            results["generation"].append(row)
+
+    # Flush the audit records the requests queued
+    shutdown_audit_writer()
+
+
+# --- Regression check ---
+
+def flatten(value, prefix: str = ""):
+    """{"retrieval": [{"mode": "vector", "p50_ms": 3}]} -> {"retrieval.vector.p50_ms": 3}"""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}{key}."))
+        return flat
+    if isinstance(value, list):
+        flat = {}
+        for index, item in enumerate(value):
+            name = item.get("mode") or item.get("endpoint") if isinstance(item, dict) else None
+            flat.update(flatten(item, f"{prefix}{name or index}."))
+        return flat
+    return {prefix[:-1]: value}
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float):
+    """
+    Compares latency percentiles and throughput (relative tolerance) and
+    recall / MRR (absolute drop of more than 0.01) with a previous run.
+    Stage means are left out: too noisy to gate on.
+    """
+    current = flatten({key: results[key] for key in ("ingestion", "retrieval", "chat", "generation")})
+    previous = flatten({key: baseline.get(key) for key in ("ingestion", "retrieval", "chat", "generation")})
+    regressions = []
+    for key, old in previous.items():
+        new = current.get(key)
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or isinstance(old, bool):
+            continue
+        metric = key.rsplit(".", 1)[-1]
+        # Latencies also need to grow by 1ms: sub-millisecond stages are mostly jitter
+        if metric in ("p50_ms", "p99_ms") and new > old * (1 + tolerance) and new - old > 1:
+            regressions.append(f"{key}: {old} -> {new} ms")
+        elif metric.endswith("_per_s") and new < old * (1 - tolerance):
+            regressions.append(f"{key}: {old} -> {new} per second")
+        elif (metric.startswith("recall@") or metric == "mrr") and new < old - 0.01:
+            regressions.append(f"{key}: {old} -> {new}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, retrieval, chat and generation.")
+    parser.add_argument("--backend", choices=["memory", "postgres"], default="memory")
+    parser.add_argument("--companies", type=int, default=20, help="Synthetic filings to generate.")
+    parser.add_argument("--section-words", type=int, default=3000, help="Words per 10-K section.")
+    parser.add_argument("--corpus-dir", help="Keep the generated corpus here (default: a temp dir).")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--queries", type=int, default=200, help="Known-item queries for retrieval and chat.")
+    parser.add_argument("--query-words", type=int, default=12)
+    parser.add_argument("--ks", type=int, nargs="+", default=[1, settings.retrieval_top_k, 10])
+    parser.add_argument("--modes", nargs="+", default=["vector", "lexical", "hybrid"],
+                        choices=["vector", "lexical", "hybrid"], help="Retrieval modes (postgres only).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight for chat and generation.")
+    parser.add_argument("--generation-companies", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="Stub LLM time to first token.")
+    parser.add_argument("--llm-tokens", type=int, default=200, help="Stub LLM answer length.")
+    parser.add_argument("--llm-token-ms", type=float, default=0.0, help="Stub LLM delay per token.")
+    parser.add_argument("--out", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="Previous results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown vs the baseline.")
+    args = parser.parse_args()
+    args.ks = sorted(set(args.ks))
+
+    # The stub has no quota; per-minute budgets would only measure the throttle
+    settings.llm_requests_per_minute = 0
+    settings.llm_tokens_per_minute = 0
+    get_llm_client().model = StubLLM(args.llm_latency_ms, args.llm_tokens, args.llm_token_ms)
+    results = {
+        "config": {
+            "backend": args.backend,
+            "companies": args.companies,
+            "section_words": args.section_words,
+            "seed": args.seed,
+            "queries": args.queries,
+            "concurrency": args.concurrency,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_tokens": args.llm_tokens,
+            "llm_token_ms": args.llm_token_ms,
+            "embedding_backend": settings.embedding_backend,
+            "vector_store_backend": settings.vector_store_backend,
+            "vector_index_type": settings.vector_index_type,
+            "retrieval_top_k": settings.retrieval_top_k,
+            "python": platform.python_version(),
+            "started_at": datetime.utcnow().isoformat(),
+        },
+    }
+
+    with tempfile.TemporaryDirectory(prefix="benchmark-corpus-") as corpus_dir:
+        paths = write_corpus(args.corpus_dir or corpus_dir, args.companies, args.section_words, args.seed)
+        run = run_memory if args.backend == "memory" else run_postgres
+        asyncio.run(run(args, paths, results))
+    results["stages"] = stage_breakdown()
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    ingestion = results["ingestion"]
+    print(f"\nIngestion: {ingestion['files_per_s']} files/s, {ingestion['chunks_per_s']} chunks/s, "
+          f"p50 {ingestion['p50_ms']}ms, p99 {ingestion['p99_ms']}ms")
+    for row in results["retrieval"]:
+        recalls = ", ".join(f"{key} {value}" for key, value in row.items() if key.startswith("recall@"))
+        print(f"Retrieval {row['mode']}: {recalls}, mrr {row['mrr']}, p50 {row['p50_ms']}ms, p99 {row['p99_ms']}ms")
+    chat = results["chat"]
+    print(f"Chat: {chat['requests_per_s']} req/s, p50 {chat['p50_ms']}ms, p99 {chat['p99_ms']}ms")
+    for row in results["generation"] or []:
+        print(f"Generation {row['endpoint']}: cold p50 {row['cold']['p50_ms']}ms, cached p50 {row['cached']['p50_ms']}ms")
+    print(f"Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
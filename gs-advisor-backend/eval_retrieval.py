@@ -0,0 +1,136 @@
+"""
+Compares retrieval modes (vector, lexical, hybrid) on the ingested corpus.
+
+By default builds known-item queries: a random run of words is cut from a
+sampled chunk and the chunk itself is the only relevant result. Chunks
+overlap, so this slightly understates recall for every mode alike. For
+real questions pass a JSONL file of labeled queries:
+
+    {"company_id": 3, "query": "Tier 1 capital ratio", "relevant_chunk_ids": [812, 813]}
+
+    python eval_retrieval.py --samples 200 --ks 1 3 5 10
+    python eval_retrieval.py --queries labeled.jsonl --modes vector hybrid
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from sqlalchemy import select, text
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, SessionLocal, init_db
+from app.models.domain import Chunk
+from app.services import rag
+from ann_report import latency_summary
+
+
+def sample_known_item_queries(samples: int, words: int, seed: int):
+    rng = random.Random(seed)
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(Chunk.id, Chunk.company_id, Chunk.chunk_text)
+            .filter(Chunk.company_id.isnot(None))
+            .order_by(text("random()"))
+            .limit(samples)
+        ).all()
+    finally:
+        db.close()
+    return known_item_queries(rows, words, rng)
+
+
+def known_item_queries(rows, words: int, rng: random.Random):
+    """rows: objects with id, company_id and chunk_text (one query per row)."""
+    queries = []
+    for row in rows:
+        tokens = (row.chunk_text or "").split()
+        if len(tokens) < words:
+            continue
+        start = rng.randrange(len(tokens) - words + 1)
+        queries.append({
+            "company_id": row.company_id,
+            "query": " ".join(tokens[start:start + words]),
+            "relevant_chunk_ids": [row.id],
+        })
+    return queries
+
+
+def load_labeled_queries(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def evaluate(name: str, queries, ks, search):
+    """
+    Scores search(item, k) -> ranked chunk IDs over the labeled queries:
+    recall@k for every k, MRR and latency percentiles.
+    """
+    depth = max(ks)
+    recalls = {k: [] for k in ks}
+    reciprocal_ranks = []
+    latencies = []
+    for item in queries:
+        relevant = set(item["relevant_chunk_ids"])
+        started = time.perf_counter()
+        found = await search(item, depth)
+        latencies.append((time.perf_counter() - started) * 1000)
+        for k in ks:
+            recalls[k].append(len(relevant & set(found[:k])) / len(relevant))
+        rank = next((i for i, chunk_id in enumerate(found, start=1) if chunk_id in relevant), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+    return {
+        "mode": name,
+        **{f"recall@{k}": round(statistics.mean(recalls[k]), 4) for k in ks},
+        "mrr": round(statistics.mean(reciprocal_ranks), 4),
+        **latency_summary(latencies),
+    }
+
+
+async def evaluate_mode(mode: str, queries, ks):
+    # Cold caches, so modes are timed on equal terms
+    rag.query_embedding_cache.clear()
+    rag.retrieval_cache.clear()
+    async with AsyncSessionLocal() as db:
+        async def search(item, k):
+            found = await rag.retrieve_chunk_ids(db, item["company_id"], item["query"], k, mode)
+            await db.rollback()
+            return found
+
+        return await evaluate(mode, queries, ks, search)
+
+
+async def run_eval(queries, modes, ks):
+    return [await evaluate_mode(mode, queries, ks) for mode in modes]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare vector, lexical and hybrid retrieval.")
+    parser.add_argument("--queries", help="JSONL of labeled queries (default: sampled known-item queries).")
+    parser.add_argument("--samples", type=int, default=200, help="Known-item queries to sample.")
+    parser.add_argument("--words", type=int, default=12, help="Words per known-item query.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--modes", nargs="+", default=["vector", "lexical", "hybrid"],
+                        choices=["vector", "lexical", "hybrid"])
+    parser.add_argument("--ks", type=int, nargs="+", default=[1, 3, settings.retrieval_top_k, 10])
+    parser.add_argument("--json", action="store_true", help="Also print the rows as JSON.")
+    args = parser.parse_args()
+
+    init_db()
+    if args.queries:
+        queries = load_labeled_queries(args.queries)
+    else:
+        queries = sample_known_item_queries(args.samples, args.words, args.seed)
+    if not queries:
+        raise SystemExit("No queries. Ingest some filings first or pass --queries.")
+
+    ks = sorted(set(args.ks))
+    rows = asyncio.run(run_eval(queries, args.modes, ks))
+
+    print(f"\n{len(queries)} queries, hybrid_candidates={settings.hybrid_candidates}, rrf_k={settings.rrf_k}")
+    columns = [f"recall@{k}" for k in ks] + ["mrr", "p50_ms", "p95_ms"]
+    print(f"{'mode':<10}" + "".join(f"{c:>12}" for c in columns))
+    for row in rows:
+        print(f"{row['mode']:<10}" + "".join(f"{row[c]:>12.3f}" for c in columns))
+    if args.json:
+        print(json.dumps(rows, indent=2))
@@ -0,0 +1,221 @@
+"""
+Converts stored chunk embeddings to the configured embedding_storage, and
+compares recall, latency and size across the storage forms.
+
+    EMBEDDING_STORAGE=halfvec python migrate_embeddings.py
+    python migrate_embeddings.py --to binary --drop-full
+    python migrate_embeddings.py --update-extension --to halfvec
+    python migrate_embeddings.py --compare --samples 200 --k 5 --factors 4 8 16
+
+Converting fills chunks.embedding_half from chunks.embedding ("halfvec",
+"binary") or the other way round ("vector", which can only restore float16
+precision once the float32 values were dropped). Rows are updated in
+batches of --batch-size, each committed on its own, so an interrupted run
+picks up where it stopped. ANN indexes on the embeddings are dropped first
+and the target one is built once at the end: searches run as exact scans in
+between, so run it during a quiet period.
+
+--update-extension first runs ALTER EXTENSION vector UPDATE: a database
+created on an older image keeps its pgvector version after the server's
+package is upgraded, and the API never upgrades it by itself.
+
+--compare builds the index of every storage form that has data, measures
+each against exact float32 search (float16 once float32 was dropped), prints
+average row and index sizes, then drops all but the configured index again
+(--keep-indexes leaves them).
+"""
+import argparse
+import json
+import time
+from sqlalchemy import text
+from app.core import database
+from app.core.config import settings
+from app.core.database import (
+    SessionLocal, engine, ensure_vector_index, init_db, vector_index_definition
+)
+from app.models.domain import Chunk, EMBEDDING_DIM
+from ann_report import exact_top_k, measure, sample_queries
+
+STORAGE_FORMS = ["vector", "halfvec", "binary"]
+
+# (column written, column read, cast) per conversion target
+CONVERSIONS = {
+    "vector": ("embedding", "embedding_half", f"vector({EMBEDDING_DIM})"),
+    "halfvec": ("embedding_half", "embedding", f"halfvec({EMBEDDING_DIM})"),
+}
+
+
+def drop_embedding_indexes(conn):
+    names = conn.execute(text(
+        "SELECT indexname FROM pg_indexes "
+        "WHERE tablename = 'chunks' AND indexname LIKE 'ix_chunks_embedding_%'"
+    )).scalars().all()
+    for name in names:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    return names
+
+
+def update_in_batches(statement: str, batch_size: int, label: str) -> int:
+    """Runs an UPDATE over `WHERE id IN (... LIMIT :n)` until it matches no rows."""
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            updated = conn.execute(text(statement), {"n": batch_size}).rowcount
+        if not updated:
+            return total
+        total += updated
+        print(f"{label}: {total} rows")
+
+
+def update_vector_extension():
+    """Upgrades the database's pgvector extension to the newest version the server ships."""
+    before = database.vector_extension_version()
+    with engine.begin() as conn:
+        conn.execute(text("ALTER EXTENSION vector UPDATE"))
+    database._vector_version = None
+    print(f"pgvector extension: {before} -> {database.vector_extension_version()}")
+
+
+def convert(target: str, batch_size: int, drop_full: bool):
+    written, read, cast = CONVERSIONS["vector" if target == "vector" else "halfvec"]
+    init_db()
+    if not database.compact_storage_supported():
+        raise SystemExit(f"Compact embedding storage needs pgvector >= 0.7 (installed: {database.vector_extension_version()}). "
+                         "If the server has a newer one, re-run with --update-extension.")
+
+    with engine.begin() as conn:
+        dropped = drop_embedding_indexes(conn)
+    if dropped:
+        print(f"Dropped {', '.join(dropped)} (searches are exact scans until the rebuild)")
+
+    converted = update_in_batches(
+        f"UPDATE chunks SET {written} = {read}::{cast} WHERE id IN ("
+        f"SELECT id FROM chunks WHERE {written} IS NULL AND {read} IS NOT NULL LIMIT :n)",
+        batch_size, f"{read} -> {written}"
+    )
+    cleared = 0
+    if drop_full:
+        cleared = update_in_batches(
+            f"UPDATE chunks SET {read} = NULL WHERE id IN ("
+            f"SELECT id FROM chunks WHERE {read} IS NOT NULL AND {written} IS NOT NULL LIMIT :n)",
+            batch_size, f"clearing {read}"
+        )
+
+    settings.embedding_storage = target
+    name, _ = vector_index_definition()
+    print(f"Building {name or 'no index'} ...")
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        ensure_vector_index(conn)
+    print(f"Converted {converted} rows to {written}, cleared {cleared} {read} values, "
+          f"index built in {time.perf_counter() - started:.1f}s.")
+    if cleared:
+        print("Run VACUUM FULL chunks (locks the table) to hand the freed space back to the OS; "
+              "plain VACUUM only makes it reusable.")
+    print(f"Set EMBEDDING_STORAGE={target} for the API and ingestion.")
+
+
+def storage_sizes(conn):
+    """Average stored bytes per row of each embedding column, and every embedding index's size."""
+    averages = conn.execute(text(
+        "SELECT avg(pg_column_size(embedding)), avg(pg_column_size(embedding_half)) FROM chunks"
+    )).one()
+    indexes = conn.execute(text(
+        "SELECT indexname, pg_relation_size(indexname::regclass) FROM pg_indexes "
+        "WHERE tablename = 'chunks' AND indexname LIKE 'ix_chunks_embedding_%' ORDER BY indexname"
+    )).all()
+    return {
+        "embedding_bytes_per_row": round(float(averages[0] or 0), 1),
+        "embedding_half_bytes_per_row": round(float(averages[1] or 0), 1),
+        "index_bytes": {name: size for name, size in indexes},
+    }
+
+
+def compare(samples: int, k: int, factors, keep_indexes: bool):
+    init_db()
+    configured = (settings.embedding_storage, settings.binary_rerank_factor)
+    with engine.connect() as conn:
+        has_full, has_half = conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM chunks WHERE embedding IS NOT NULL), "
+            + ("EXISTS (SELECT 1 FROM chunks WHERE embedding_half IS NOT NULL)"
+               if database.compact_storage_supported() else "false")
+        )).one()
+    forms = [form for form in STORAGE_FORMS if (has_full if form == "vector" else has_half)]
+    if not forms:
+        print("No embeddings found. Ingest some filings first.")
+        return []
+
+    with engine.begin() as conn:
+        for form in forms:
+            _, create_sql = vector_index_definition(form)
+            if create_sql:
+                conn.execute(text(create_sql))
+
+    db = SessionLocal()
+    rows = []
+    try:
+        reference = Chunk.embedding if has_full else Chunk.embedding_half
+        queries = sample_queries(db, samples, reference)
+        truth, exact_stats = exact_top_k(db, queries, k, reference)
+        rows.append({"storage": "exact", "rerank_factor": None, **exact_stats})
+        try:
+            for form in forms:
+                settings.embedding_storage = form
+                for factor in (factors if form == "binary" else [None]):
+                    if factor is not None:
+                        settings.binary_rerank_factor = factor
+                    rows.append({"storage": form, "rerank_factor": factor, **measure(db, queries, truth, k)})
+        finally:
+            settings.embedding_storage, settings.binary_rerank_factor = configured
+    finally:
+        db.close()
+
+    with engine.connect() as conn:
+        sizes = storage_sizes(conn)
+    if not keep_indexes:
+        with engine.begin() as conn:
+            ensure_vector_index(conn)
+
+    print(f"\npgvector {database.vector_extension_version()}, index={settings.vector_index_type}, "
+          f"k={k}, queries={len(queries)}, ground truth={reference.key}")
+    print(f"{'storage':<10}{'rerank':>8}{'recall':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in rows:
+        factor = "-" if row["rerank_factor"] is None else row["rerank_factor"]
+        print(f"{row['storage']:<10}{factor:>8}{row['recall']:>10.3f}"
+              f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+    print(f"\nBytes per row: embedding {sizes['embedding_bytes_per_row']}, "
+          f"embedding_half {sizes['embedding_half_bytes_per_row']}")
+    for name, size in sizes["index_bytes"].items():
+        print(f"{name:<48}{size / (1024 * 1024):>10.1f} MiB")
+    return {"rows": rows, "sizes": sizes}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert chunk embeddings between storage forms, or compare them.")
+    parser.add_argument("--to", choices=STORAGE_FORMS, default=settings.embedding_storage,
+                        help="Storage to convert to (default: the configured embedding_storage).")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows updated per transaction.")
+    parser.add_argument("--drop-full", action="store_true",
+                        help="After converting to halfvec/binary, clear the float32 column to reclaim its space.")
+    parser.add_argument("--update-extension", action="store_true",
+                        help="Run ALTER EXTENSION vector UPDATE first (needs the newer pgvector installed on the server).")
+    parser.add_argument("--compare", action="store_true", help="Report recall, latency and size instead of converting.")
+    parser.add_argument("--samples", type=int, default=100, help="Number of sampled query chunks (--compare).")
+    parser.add_argument("--k", type=int, default=settings.retrieval_top_k, help="Top-k to evaluate (--compare).")
+    parser.add_argument("--factors", type=int, nargs="+", default=[2, 4, 8, 16],
+                        help="binary_rerank_factor values to try (--compare).")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="Keep every storage form's index after --compare.")
+    parser.add_argument("--json", action="store_true", help="Also print the comparison as JSON.")
+    args = parser.parse_args()
+
+    if args.update_extension:
+        update_vector_extension()
+    if args.compare:
+        result = compare(args.samples, args.k, args.factors, args.keep_indexes)
+        if args.json:
+            print(json.dumps(result, indent=2))
+    else:
+        if args.drop_full and args.to == "vector":
+            parser.error("--drop-full only applies when converting to halfvec or binary")
+        convert(args.to, args.batch_size, args.drop_full)
@@ -0,0 +1,122 @@
+"""
+One-off migrations for databases created by older versions, too slow or too
+heavily locking to run in init_db on every startup:
+
+    python migrate_schema.py
+    python migrate_schema.py --batch-size 20000
+
+- Backfills chunks.company_id and the content hashes of documents and chunks
+  ingested before those columns existed.
+- Adds chunks.chunk_tsv (hybrid retrieval). New tables get it as a generated
+  column; on an existing table that would rewrite every row under an
+  exclusive lock. Here it is added as a plain column, kept up to date by a
+  trigger, filled in batches, and its GIN index is built concurrently.
+
+Rows are updated in id ranges of --batch-size, each committed on its own, so
+the API keeps serving and an interrupted run picks up where it stopped.
+Every step is idempotent; the API refuses to start until chunk_tsv exists.
+"""
+import argparse
+from sqlalchemy import text
+from app.core.database import apply_schema_migrations, engine, init_db
+from app.models.domain import TEXT_SEARCH_CONFIG
+
+# Same expression as the generated column in domain.py
+CHUNK_TSV = "to_tsvector('" + TEXT_SEARCH_CONFIG + "', coalesce({text}, ''))"
+
+# (label, table, SET clause, rows still to fill)
+BACKFILLS = [
+    (
+        "chunks.company_id", "chunks",
+        "company_id = (SELECT documents.company_id FROM documents WHERE documents.id = chunks.document_id)",
+        "company_id IS NULL",
+    ),
+    # Same sha256 as filings.content_hash
+    (
+        "documents.content_hash", "documents",
+        "content_hash = encode(sha256(convert_to(raw_text, 'UTF8')), 'hex')",
+        "content_hash IS NULL AND raw_text IS NOT NULL",
+    ),
+    (
+        "chunks.content_hash", "chunks",
+        "content_hash = encode(sha256(convert_to(chunk_text, 'UTF8')), 'hex')",
+        "content_hash IS NULL AND chunk_text IS NOT NULL",
+    ),
+]
+
+CHUNK_TSV_TRIGGER = [
+    f"""
+    CREATE OR REPLACE FUNCTION chunks_chunk_tsv_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.chunk_tsv := {CHUNK_TSV.format(text='NEW.chunk_text')};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS chunks_chunk_tsv_update ON chunks",
+    "CREATE TRIGGER chunks_chunk_tsv_update BEFORE INSERT OR UPDATE OF chunk_text ON chunks "
+    "FOR EACH ROW EXECUTE FUNCTION chunks_chunk_tsv_update()",
+]
+
+
+def update_in_id_ranges(table: str, assignment: str, condition: str, batch_size: int, label: str) -> int:
+    """
+    Runs UPDATE table SET assignment WHERE condition over consecutive id
+    ranges, one transaction each. Walking the primary key keeps every batch
+    an index range scan, however many rows were already filled.
+    """
+    with engine.connect() as conn:
+        last_id = conn.execute(text(f"SELECT max(id) FROM {table}")).scalar() or 0
+    total = 0
+    for start in range(0, last_id + 1, batch_size):
+        with engine.begin() as conn:
+            total += conn.execute(
+                text(f"UPDATE {table} SET {assignment} WHERE id >= :start AND id < :end AND {condition}"),
+                {"start": start, "end": start + batch_size}
+            ).rowcount
+        print(f"{label}: {total} rows updated, through id {min(start + batch_size - 1, last_id)} of {last_id}")
+    return total
+
+
+def add_chunk_tsv(batch_size: int):
+    with engine.connect() as conn:
+        column = conn.execute(text(
+            "SELECT is_generated FROM information_schema.columns "
+            "WHERE table_name = 'chunks' AND column_name = 'chunk_tsv'"
+        )).scalar()
+    if column == "ALWAYS":
+        print("chunks.chunk_tsv: generated column, nothing to fill")
+    else:
+        with engine.begin() as conn:
+            # A nullable column without a default only changes the catalog
+            conn.execute(text("ALTER TABLE chunks ADD COLUMN IF NOT EXISTS chunk_tsv tsvector"))
+            # Rows written from here on get their tsvector from the trigger
+            for statement in CHUNK_TSV_TRIGGER:
+                conn.execute(text(statement))
+        update_in_id_ranges("chunks", f"chunk_tsv = {CHUNK_TSV.format(text='chunk_text')}", "chunk_tsv IS NULL", batch_size, "chunks.chunk_tsv")
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # An interrupted CREATE INDEX CONCURRENTLY leaves an invalid index behind
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass('ix_chunks_chunk_tsv') AND NOT indisvalid"
+        )).scalar()
+        if invalid:
+            conn.execute(text("DROP INDEX CONCURRENTLY ix_chunks_chunk_tsv"))
+        print("Building ix_chunks_chunk_tsv ...")
+        conn.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chunks_chunk_tsv ON chunks USING gin (chunk_tsv)"))
+
+
+def migrate(batch_size: int):
+    apply_schema_migrations()
+    for label, table, assignment, condition in BACKFILLS:
+        update_in_id_ranges(table, assignment, condition, batch_size, label)
+    add_chunk_tsv(batch_size)
+    init_db()
+    print("Schema is up to date.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the one-off backfills and the chunk_tsv migration in batches.")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Ids covered per transaction.")
+    args = parser.parse_args()
+    migrate(args.batch_size)
@@ -0,0 +1,8 @@
+import os
+
+# Tests that need Postgres (with pgvector) run against TEST_DATABASE_URL, a
+# disposable database: its tables are created and emptied. Without it they
+# are skipped. Set before anything imports app.core.database.
+if os.getenv("TEST_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+    os.environ.pop("ASYNC_DATABASE_URL", None)
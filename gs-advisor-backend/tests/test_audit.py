@@ -0,0 +1,126 @@
+import glob
+import json
+import os
+import time
+from sqlalchemy.exc import IntegrityError
+from app.services.audit import AuditWriter, new_audit_record
+
+
+class RecordingWriter(AuditWriter):
+    """AuditWriter whose inserts land in a list instead of audit_logs."""
+
+    def __init__(self, wal_dir, reject=None, **kwargs):
+        super().__init__(None, str(wal_dir), batch_size=kwargs.pop("batch_size", 50), flush_interval=0.01, **kwargs)
+        self.inserted = []
+        self.reject = reject or (lambda record: None)
+        self.on_insert = None
+
+    def _insert(self, batch):
+        for record in batch:
+            error = self.reject(record)
+            if error is not None:
+                raise error
+        self.inserted.extend(record["record_id"] for record in batch)
+        if self.on_insert is not None:
+            self.on_insert()
+
+
+def record(query_text="q", company_id=1):
+    return new_audit_record(company_id=company_id, query_text=query_text, llm_mode="chat", llm_response="a")
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def wal_lines(wal_dir):
+    return sum(1 for path in glob.glob(os.path.join(wal_dir, "audit-*.wal")) for _ in open(path, "rb"))
+
+
+def test_committed_segments_are_deleted_under_steady_traffic(tmp_path):
+    writer = RecordingWriter(tmp_path)
+    flushes = []
+
+    # Every flush sees a new record arrive, so the queue never drains to zero
+    def traffic():
+        flushes.append(1)
+        if len(flushes) < 30:
+            writer.submit(record())
+
+    writer.on_insert = traffic
+    writer.start()
+    writer.submit(record())
+    wait_until(lambda: len(flushes) >= 30)
+    wait_until(lambda: writer.stats()["queue_depth"] == 0)
+    writer.stop()
+
+    assert len(writer.inserted) == 30
+    # Only the active segment is left, and nothing in it is still needed
+    assert writer.stats()["wal_segments"] == 1
+    assert wal_lines(tmp_path) == 0
+
+
+def test_wal_of_a_dead_process_is_replayed(tmp_path):
+    crashed = RecordingWriter(tmp_path)
+    records = [record(f"q{i}") for i in range(5)]
+    for item in records:
+        crashed.submit(item)
+    # Never started: the records only exist in its WAL. Closing the files drops the locks, as exiting would
+    for segment in crashed._segments.values():
+        segment["file"].close()
+    with open(os.path.join(tmp_path, "audit-1.wal"), "ab") as f:
+        # WAL name from before segments, with a line torn by a crash
+        f.write(json.dumps(record("legacy")).encode() + b"\n{\"record_id\": \"to")
+
+    writer = RecordingWriter(tmp_path)
+    writer.start()
+    wait_until(lambda: writer.stats()["queue_depth"] == 0)
+    writer.stop()
+
+    assert set(item["record_id"] for item in records) <= set(writer.inserted)
+    assert len(writer.inserted) == 6
+    assert os.listdir(tmp_path) == [os.path.basename(writer._segments[writer._active]["path"])]
+
+
+def test_segments_of_a_live_process_are_left_alone(tmp_path):
+    live = RecordingWriter(tmp_path)
+    live.submit(record())
+
+    writer = RecordingWriter(tmp_path)
+    writer.start()
+    time.sleep(0.1)
+    writer.stop()
+
+    assert writer.inserted == []
+    assert wal_lines(tmp_path) == 1
+
+
+def test_rejected_records_go_to_the_dead_letter_file(tmp_path):
+    def reject(item):
+        if "\x00" in item["query_text"]:
+            return ValueError("A string literal cannot contain NUL (0x00) characters.")
+        if item["company_id"] == 999:
+            return IntegrityError("INSERT", {}, Exception("violates foreign key constraint"))
+        return None
+
+    writer = RecordingWriter(tmp_path, reject=reject)
+    bad = [record("bad\x00"), record(company_id=999)]
+    good = [record("q1"), record("q2"), record("q3")]
+    for item in [good[0], bad[0], good[1], bad[1], good[2]]:
+        writer.submit(item)
+    writer.start()
+    wait_until(lambda: writer.stats()["queue_depth"] == 0)
+    writer.stop()
+
+    assert sorted(writer.inserted) == sorted(item["record_id"] for item in good)
+    stats = writer.stats()
+    assert stats["dead_lettered"] == 2
+    assert stats["written"] == 3
+    assert stats["wal_bytes"] == 0
+    with open(writer.dead_letter_path, encoding="utf-8") as f:
+        letters = [json.loads(line) for line in f]
+    assert [letter["record"]["record_id"] for letter in letters] == [item["record_id"] for item in bad]
+    assert "NUL" in letters[0]["error"]
@@ -0,0 +1,113 @@
+from types import SimpleNamespace
+from app.core.config import settings
+from app.services.context import (
+    MIN_OVERLAP, build_context, context_token_budget, format_passage, merge_overlap
+)
+from app.services.filings import build_text_splitter
+from app.services.tokens import count_tokens
+
+
+def test_merge_overlap_drops_shared_text():
+    shared = "revenue grew 12% year over year"
+    assert len(shared) >= MIN_OVERLAP
+    left = "In fiscal 2023 " + shared
+    right = shared + " driven by services."
+    assert merge_overlap(left, right) == "In fiscal 2023 " + shared + " driven by services."
+
+
+def test_merge_overlap_keeps_chunks_without_overlap():
+    # A one-character coincidence must not eat the first digit of the figure
+    left = "A" * 300 + " for a total of $ 1"
+    right = "1 " + "B" * 300
+    merged = merge_overlap(left, right)
+    assert merged == f"{left}\n\n{right}"
+    assert "$ 1\n\n1 B" in merged
+
+
+def test_merge_overlap_reassembles_splitter_chunks():
+    paragraph = " ".join(f"Item {i} reported net income of ${i},{i:03d} million." for i in range(200))
+    chunks = build_text_splitter().split_text(paragraph)
+    assert len(chunks) > 2
+    merged = chunks[0]
+    for chunk in chunks[1:]:
+        merged = merge_overlap(merged, chunk)
+    # Every figure survives, in order
+    for i in range(200):
+        assert f"${i},{i:03d} million" in merged
+
+
+def make_chunk(chunk_id, document_id, chunk_index, text, item_name="Risk Factors"):
+    return SimpleNamespace(
+        id=chunk_id, document_id=document_id, chunk_index=chunk_index,
+        chunk_text=text, item_name=item_name
+    )
+
+
+def filing_chunks(count):
+    """Full-size chunks of 10-K-like prose, as the splitter cuts them."""
+    sentences = [
+        f"In fiscal {2000 + i % 24}, segment {i} revenue was ${i * 37 % 1000},{i * 53 % 1000:03d} million, "
+        f"up {i % 17}.{i % 9}% year over year, driven by pricing and volume in the Americas."
+        for i in range(count * 40)
+    ]
+    chunks = build_text_splitter().split_text(" ".join(sentences))
+    assert len(chunks[0]) > 1800
+    return chunks[:count]
+
+
+def test_default_budget_fits_top_k_full_chunks(monkeypatch):
+    monkeypatch.setattr(settings, "context_token_budget", 0)
+    # Five hits from different sections: nothing to merge, all full size
+    chunks = [make_chunk(i, i, 0, text) for i, text in enumerate(filing_chunks(settings.retrieval_top_k))]
+
+    context = build_context(chunks, context_token_budget())
+
+    assert context["chunk_ids"] == [chunk.id for chunk in chunks]
+    assert context["stats"]["passages_dropped"] == 0
+
+
+def test_budget_keeps_passages_by_relevance():
+    texts = filing_chunks(4)
+    # Ranked best first
+    chunks = [
+        make_chunk(10, 1, 0, texts[0], "Risk Factors"),
+        make_chunk(20, 2, 0, texts[1], "MD&A"),
+        make_chunk(30, 3, 0, texts[2][:300], "Legal Proceedings"),
+        make_chunk(40, 4, 0, texts[3], "Properties"),
+    ]
+    budget = sum(count_tokens(format_passage(chunk.item_name, chunk.chunk_text)) for chunk in chunks[:3])
+
+    context = build_context(chunks, budget)
+
+    # Exactly the three best fit; the 4th is left out, not swapped in
+    assert context["chunk_ids"] == [10, 20, 30]
+    assert context["sources"] == ["Risk Factors", "MD&A", "Legal Proceedings"]
+    assert context["context"].index(texts[0]) < context["context"].index(texts[1])
+    assert context["stats"]["passages_dropped"] == 1
+    assert context["stats"]["tokens_used"] == budget
+
+
+def test_best_passage_is_kept_over_budget():
+    chunks = [make_chunk(1, 1, 0, filing_chunks(1)[0]), make_chunk(2, 2, 0, "Short note.")]
+
+    context = build_context(chunks, 10)
+
+    assert context["chunk_ids"] == [1]
+    assert context["stats"]["passages_dropped"] == 1
+
+
+def test_adjacent_hits_merge_and_rank_by_best_chunk():
+    texts = build_text_splitter().split_text(" ".join(filing_chunks(3)))
+    chunks = [
+        make_chunk(7, 1, 5, "Unrelated hit from another document.", "Properties"),
+        make_chunk(2, 9, 1, texts[1]),
+        make_chunk(1, 9, 0, texts[0]),
+    ]
+
+    context = build_context(chunks, 100000)
+
+    assert context["chunk_ids"] == [7, 1, 2]
+    assert context["stats"]["passages"] == 2
+    merged = merge_overlap(texts[0], texts[1])
+    assert merged in context["context"]
+    assert context["stats"]["tokens_used"] < context["stats"]["tokens_verbatim"]
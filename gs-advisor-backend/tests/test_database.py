@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import create_mock_engine
+from app.core import database
+from app.core.config import settings
+
+
+class FakeResult:
+    def __init__(self, value=None):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return []
+
+
+class FakeConnection:
+    def __init__(self, log, version):
+        self.log = log
+        self.version = version
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, *args):
+        sql = str(statement)
+        self.log.append(sql)
+        if "information_schema.columns" in sql:
+            return FakeResult(1)
+        return FakeResult(self.version if "pg_extension" in sql else None)
+
+    def commit(self):
+        pass
+
+
+class FakeEngine:
+    def __init__(self, version):
+        self.log = []
+        self.version = version
+
+    def connect(self):
+        return FakeConnection(self.log, self.version)
+
+
+def test_init_db_without_halfvec_support(monkeypatch):
+    fake = FakeEngine("0.6.2")
+    ddl = []
+    mock = create_mock_engine("postgresql+psycopg2://", lambda sql, *a, **kw: ddl.append(str(sql.compile(dialect=mock.dialect))))
+    create_all = database.Base.metadata.create_all
+    monkeypatch.setattr(database, "engine", fake)
+    monkeypatch.setattr(database, "_vector_version", None)
+    monkeypatch.setattr(database.Base.metadata, "create_all", lambda bind: create_all(mock, checkfirst=False))
+    monkeypatch.setattr(settings, "embedding_storage", "vector")
+
+    database.init_db()
+
+    chunks_ddl = next(sql for sql in ddl if "CREATE TABLE chunks" in sql)
+    assert "embedding VECTOR(384)" in chunks_ddl
+    assert "embedding_half" not in chunks_ddl
+    assert not any("halfvec" in sql.lower() for sql in ddl + fake.log)
+    assert any("ON chunks USING hnsw (embedding vector_l2_ops)" in sql for sql in fake.log)
+
+
+def test_extension_version_is_read_lazily(monkeypatch):
+    fake = FakeEngine("0.8.0")
+    monkeypatch.setattr(database, "engine", fake)
+    monkeypatch.setattr(database, "_vector_version", None)
+    monkeypatch.setattr(settings, "embedding_storage", "halfvec")
+
+    # A process that never ran init_db (ingestion job worker, script)
+    assert database.compact_storage_supported()
+    database.check_embedding_storage()
+    assert sum("pg_extension" in sql for sql in fake.log) == 1
+
+    monkeypatch.setattr(database, "_vector_version", None)
+    fake.version = "0.6.2"
+    with pytest.raises(RuntimeError, match="0.6.2"):
+        database.check_embedding_storage()
@@ -0,0 +1,43 @@
+import pytest
+from app.core.config import settings
+from app.services import embeddings
+
+
+class FakeModel:
+    def __init__(self, backend, vector):
+        self.backend = backend
+        self.vector = vector
+
+    def embed_documents(self, texts):
+        return [self.vector for _ in texts]
+
+    def embed_query(self, text):
+        return self.vector
+
+
+@pytest.fixture
+def load(monkeypatch):
+    """Patches model loading; returns the ONNX vector to use, set per test."""
+    onnx_vector = [1.0, 0.0]
+    monkeypatch.setattr(embeddings, "_model", None)
+    monkeypatch.setattr(embeddings, "_backend", None)
+    monkeypatch.setattr(embeddings, "_parity", None)
+    monkeypatch.setattr(settings, "embedding_backend", "onnx")
+    monkeypatch.setattr(settings, "embedding_parity_check", True)
+    monkeypatch.setattr(embeddings, "_load", lambda backend: FakeModel(
+        backend, onnx_vector if backend == "onnx" else [1.0, 0.0]
+    ))
+    return onnx_vector
+
+
+def test_onnx_checked_on_first_embedding_without_warm_up(load):
+    # Drifted export: an ingestion worker never runs warm_up, yet gets torch
+    load[:] = [0.0, 1.0]
+    assert embeddings.get_embeddings_model().backend == "torch"
+    assert embeddings.embed_documents(["text"]) == [[1.0, 0.0]]
+    assert embeddings.warm_up()["parity"]["passed"] is False
+
+
+def test_onnx_kept_when_parity_passes(load):
+    assert embeddings.get_embeddings_model().backend == "onnx"
+    assert embeddings.warm_up()["backend"] == "onnx"
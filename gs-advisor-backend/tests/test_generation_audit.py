@@ -0,0 +1,71 @@
+"""
+A generation is audited even when storing it in the generation cache fails.
+"""
+import asyncio
+import pytest
+from app.services import rag
+
+PREPARED = {"status": "generate", "sources": ["Item 1A"], "parts": None, "source_hash": "h", "prompt_version": "v"}
+
+
+class FakeSession:
+    def __init__(self):
+        self.rolled_back = False
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        self.rolled_back = True
+
+
+@pytest.fixture
+def audited(monkeypatch):
+    audited = []
+
+    async def prepare_generation(db, company_id, mode):
+        return dict(PREPARED)
+
+    async def build_generation_messages(db, prepared, mode):
+        return ["prompt"]
+
+    async def call_llm(messages, priority="chat"):
+        return "generated report"
+
+    async def stream_llm(messages, on_token, priority="chat"):
+        for token in ["generated ", "report"]:
+            on_token(token)
+            yield ("token", token)
+
+    async def store_generation(*args):
+        raise RuntimeError("cache table is locked")
+
+    monkeypatch.setattr(rag, "prepare_generation", prepare_generation)
+    monkeypatch.setattr(rag, "build_generation_messages", build_generation_messages)
+    monkeypatch.setattr(rag, "call_llm", call_llm)
+    monkeypatch.setattr(rag, "stream_llm", stream_llm)
+    monkeypatch.setattr(rag, "store_generation", store_generation)
+    monkeypatch.setattr(rag, "log_generation_audit", lambda *args, **kwargs: audited.append(args))
+    return audited
+
+
+def test_generation_audited_when_cache_write_fails(audited):
+    db = FakeSession()
+    result = asyncio.run(rag.generate_specialized_content(db, 1, "risk"))
+
+    assert result["content"] == "generated report"
+    assert audited == [(1, "risk", "generated report")]
+    assert db.rolled_back
+
+
+def test_streamed_generation_audited_when_cache_write_fails(audited):
+    db = FakeSession()
+
+    async def consume():
+        return [event async for event in rag.stream_specialized_content(db, 1, "risk")]
+
+    events = asyncio.run(consume())
+
+    assert events[-1] == ("done", {})
+    assert audited == [(1, "risk", "generated report")]
+    assert db.rolled_back
@@ -0,0 +1,32 @@
+from app.services.llm_client import classify_error
+
+
+class APIError(Exception):
+    """Shaped like google.api_core / google.genai errors: the HTTP status in .code."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def wrapped(cause):
+    # LangChain re-raises SDK errors as its own type, `raise ... from e`
+    try:
+        raise cause
+    except Exception as e:
+        try:
+            raise RuntimeError(f"Error calling model: {e}") from e
+        except RuntimeError as outer:
+            return outer
+
+
+def test_transient_statuses_are_retried():
+    assert classify_error(APIError(429, "Resource has been exhausted")) == "rate_limit"
+    assert classify_error(wrapped(APIError(503, "The model is overloaded"))) == "unavailable"
+    assert classify_error(wrapped(ConnectionResetError())) == "unavailable"
+
+
+def test_client_errors_are_not_retried_whatever_they_say():
+    assert classify_error(wrapped(APIError(400, "Quota project not set; service unavailable in region"))) is None
+    assert classify_error(APIError(403, "rate limit for this API key is 0")) is None
+    assert classify_error(RuntimeError("429 Too Many Requests")) is None
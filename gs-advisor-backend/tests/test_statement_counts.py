@@ -0,0 +1,143 @@
+"""
+Statement budgets for the hot read paths, checked with count_statements()
+against a real database (TEST_DATABASE_URL). They catch an added query or a
+lazy load creeping into a request, and a large column (documents.raw_text)
+being read where it isn't needed.
+"""
+import asyncio
+import os
+import numpy as np
+import pytest
+from fastapi import Response
+from sqlalchemy import event, text
+
+pytestmark = pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="needs TEST_DATABASE_URL")
+
+EMBEDDING = (np.ones(384) / np.sqrt(384)).tolist()
+
+
+@pytest.fixture(scope="module")
+def company_id():
+    from app.core.database import SessionLocal, engine, init_db
+    from app.models.domain import Chunk, Company, Document
+
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE companies, documents, chunks, audit_logs RESTART IDENTITY CASCADE"))
+    rng = np.random.default_rng(0)
+    db = SessionLocal()
+    try:
+        company = Company(name="Test Corp", cik="0000000001", filename="test.json")
+        db.add(company)
+        db.flush()
+        for item in range(3):
+            doc = Document(
+                company_id=company.id, item_code=f"item_{item + 1}", item_name=f"Item {item + 1}",
+                raw_text="x" * 100000, content_hash=f"{item}"
+            )
+            db.add(doc)
+            db.flush()
+            # Bulk, as ingestion does: only the columns set are inserted
+            vectors = rng.normal(size=(10, 384))
+            db.bulk_save_objects([
+                Chunk(
+                    document_id=doc.id, company_id=company.id, chunk_index=index,
+                    chunk_text=f"Item {item + 1} chunk {index}: revenue and risk.",
+                    content_hash=f"{item}-{index}", embedding=(vector / np.linalg.norm(vector)).tolist(),
+                    token_count=10
+                )
+                for index, vector in enumerate(vectors)
+            ])
+        db.commit()
+        return company.id
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def statements():
+    """Every SQL statement the async engine sends, in order."""
+    from app.core.database import async_engine
+
+    sent = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        sent.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    yield sent
+    event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+
+def run(scenario):
+    from app.core.database import async_engine
+
+    async def main():
+        try:
+            # Connect (and let the dialect introspect the server) before anything is counted
+            async with async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return await scenario()
+        finally:
+            await async_engine.dispose()
+
+    return asyncio.run(main())
+
+
+def test_query_rag_statement_budget(company_id, statements, monkeypatch):
+    from app.core.database import AsyncSessionLocal, count_statements, vector_extension_version, vector_search_statements
+    from app.services import rag
+
+    async def embed(text):
+        return EMBEDDING
+
+    async def call_llm(messages, priority="chat"):
+        return "stub answer"
+
+    audited = []
+    monkeypatch.setattr(rag.query_embedder, "embed", embed)
+    monkeypatch.setattr(rag, "call_llm", call_llm)
+    monkeypatch.setattr(rag, "log_chat_audit", lambda *args: audited.append(args))
+    monkeypatch.setattr(rag.settings, "vector_store_backend", "pgvector")
+    monkeypatch.setattr(rag.settings, "retrieval_mode", "vector")
+    rag.retrieval_cache.invalidate(lambda key: True)
+
+    async def scenario():
+        counts = []
+        for _ in range(2):
+            async with AsyncSessionLocal() as db:
+                with count_statements() as counter:
+                    result = await rag.query_rag(db, "How did revenue develop?", company_id)
+                counts.append(counter[0])
+                assert result["answer"] == "stub answer"
+        return counts
+
+    del statements[:]
+    cold, warm = run(scenario)
+
+    # SET LOCAL knobs, the ANN search, one query for chunk text + section names
+    assert cold == len(vector_search_statements(vector_extension_version())) + 2
+    # Search results cached: only the chunk rows are read
+    assert warm == 1
+    assert len(audited) == 2
+    assert len(audited[0][2]) == rag.settings.retrieval_top_k
+    assert not any("raw_text" in statement for statement in statements)
+
+
+def test_list_companies_statement_budget(company_id, statements):
+    from app.api.routes import list_companies
+    from app.core.database import AsyncSessionLocal, count_statements
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            with count_statements() as counter:
+                response = Response()
+                companies = await list_companies(response, limit=500, after_id=None, db=db)
+        return counter[0], companies
+
+    del statements[:]
+    count, companies = run(scenario)
+
+    assert count == 1
+    assert [company.name for company in companies] == ["Test Corp"]
+    assert not any("raw_text" in statement for statement in statements)